@@ -0,0 +1,105 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Benchmark of asynchronous Execute job startup
+
+Compares new process started for each asynchronous request with pool of
+worker processes (``[server] workerpool=true``). For each job, time from
+submission to start of the handler, and to the moment the handler has its
+(expensive to load, cached per process) state ready is measured.
+
+Usage::
+
+    python benchmarks/async_pool.py
+"""
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pywps import Process, LiteralInput, configuration, dblog  # noqa
+from pywps.app import WPSRequest, WPSResponse, pool, scheduler  # noqa
+from pywps.app.WPSResponse import STATUS  # noqa
+
+JOBS = 20
+# time needed to load state of the handler, e.g. model or large raster
+LOAD_TIME = 0.2
+
+# (submitted, started, ready) times reported by the handlers
+TIMES = multiprocessing.Queue()
+_STATE = {}
+
+
+def handler(request, response):
+    started = time.time()
+    if 'model' not in _STATE:
+        time.sleep(LOAD_TIME)
+        _STATE['model'] = True
+    TIMES.put((float(request.inputs['submitted'][0].data), started, time.time()))
+    return response
+
+
+def run(workerpool, workdir):
+    configuration.CONFIG.set('server', 'workerpool', workerpool)
+    process = Process(handler, 'benchmark', 'Benchmark', store_supported=True, status_supported=True)
+    scheduler.register([process])
+
+    startup = []
+    ready = []
+    for _ in range(JOBS):
+        instance = process.new_instance()
+        instance._set_uuid(str(uuid.uuid1()))
+        instance.set_workdir(tempfile.mkdtemp(dir=workdir))
+        instance.async = True
+
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.version = '1.0.0'
+        request.identifier = 'benchmark'
+        request.outputs = {}
+        request.raw = False
+        submitted = LiteralInput('submitted', 'Submitted', data_type='string')
+        submitted.data = repr(time.time())
+        request.inputs = {'submitted': [submitted]}
+        response = WPSResponse(instance, request, instance.uuid)
+        response.status = STATUS.STORE_AND_UPDATE_STATUS
+
+        dblog.log_request(instance.uuid, request)
+        instance._execute_process(True, request, response)
+        (submitted, started, loaded) = TIMES.get()
+        startup.append((started - submitted) * 1000)
+        ready.append((loaded - submitted) * 1000)
+
+    pool.close()
+    return (sum(startup) / JOBS, sum(ready) / JOBS)
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    configuration.get_config_value('server', 'workdir')
+    configuration.CONFIG.set('server', 'workdir', workdir)
+    configuration.CONFIG.set('server', 'outputpath', workdir)
+    configuration.CONFIG.set('logging', 'level', 'INFO')
+    # queue of the requests is shared by the worker processes
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///%s' % os.path.join(workdir, 'pywps.db'))
+    try:
+        print('%25s %15s %15s' % ('', 'startup [ms]', 'ready [ms]'))
+        print('%25s %15.3f %15.3f' % (('process per request',) + run('false', workdir)))
+        print('%25s %15.3f %15.3f' % (('worker pool',) + run('true', workdir)))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Benchmark of per-request overhead of the logging database
+
+Each simulated Execute request is logged, its status is updated few times
+and number of running processes is checked, as the server does. Average
+time per request is measured for in-memory and file SQLite database.
+
+Usage::
+
+    python benchmarks/dblog_overhead.py
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pywps import configuration, dblog  # noqa
+from pywps.app import WPSRequest  # noqa
+
+REQUESTS = 500
+UPDATES = 3
+
+
+class Response(object):
+    status = 200
+    message = 'Running'
+    status_percentage = 0
+
+
+def run(database):
+    configuration.CONFIG.set('logging', 'database', database)
+    dblog._SESSION_MAKER = None
+
+    request = WPSRequest()
+    request.operation = 'execute'
+    request.version = '1.0.0'
+    request.identifier = 'benchmark'
+    response = Response()
+
+    start = time.time()
+    for _ in range(REQUESTS):
+        request_uuid = uuid.uuid1()
+        dblog.log_request(request_uuid, request)
+        dblog.count_running()
+        for percentage in range(UPDATES):
+            response.status_percentage = percentage * 100 // UPDATES
+            dblog.update_response(request_uuid, response)
+        response.status_percentage = 100
+        dblog.update_response(request_uuid, response)
+    return (time.time() - start) * 1000 / REQUESTS
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    configuration.get_config_value('logging', 'database')
+    try:
+        print('%25s %15s' % ('', 'request [ms]'))
+        print('%25s %15.3f' % ('in-memory database', run('sqlite:///:memory:')))
+        print('%25s %15.3f' % ('file database', run('sqlite:///%s' % os.path.join(workdir, 'pywps.db'))))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Benchmark of DescribeProcess response latency
+
+Compares building the ProcessDescriptions tree on each request with the
+cached process description fragments and the precomputed `all` document.
+
+Usage::
+
+    python benchmarks/describe.py
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pywps import Process, Service, LiteralInput, LiteralOutput, ComplexInput, ComplexOutput, Format  # noqa
+from pywps.app.Service import _describe_doc  # noqa
+from pywps.app.basic import xml_serialize  # noqa
+from pywps.inout.literaltypes import AllowedValue  # noqa
+
+REPEAT = 5
+NUMBER = 20
+
+
+def create_process(index):
+    def handler(request, response):
+        return response
+
+    formats = [Format('application/gml+xml'), Format('application/json'),
+               Format('image/tiff')]
+    return Process(
+        handler=handler,
+        identifier='process_%i' % index,
+        title='Process %i' % index,
+        abstract='Benchmark process number %i' % index,
+        inputs=[
+            LiteralInput('literal_%i' % i, 'Literal input %i' % i, data_type='integer',
+                         allowed_values=[AllowedValue(minval=0, maxval=100)])
+            for i in range(5)
+        ] + [
+            ComplexInput('complex_%i' % i, 'Complex input %i' % i, supported_formats=formats)
+            for i in range(3)
+        ],
+        outputs=[
+            LiteralOutput('literal', 'Literal output', data_type='string'),
+            ComplexOutput('complex', 'Complex output', supported_formats=formats)
+        ],
+        version='1.0')
+
+
+def best(statement):
+    """Return best time of one call in milliseconds"""
+    return min(timeit.repeat(statement, repeat=REPEAT, number=NUMBER)) / NUMBER * 1000
+
+
+def main():
+    print('%10s %15s %15s %15s' % ('processes', 'tree [ms]', 'fragments [ms]', 'all [ms]'))
+    for count in (1, 10, 150):
+        processes = [create_process(i) for i in range(count)]
+        service = Service(processes=processes)
+        identifiers = [p.identifier for p in processes]
+
+        def tree():
+            xml_serialize(_describe_doc([p.describe_xml() for p in processes]))
+
+        def fragments():
+            service.describe(identifiers)
+
+        def all_processes():
+            service.describe(['all'])
+
+        print('%10i %15.3f %15.3f %15.3f' % (count, best(tree), best(fragments), best(all_processes)))
+
+
+if __name__ == '__main__':
+    main()
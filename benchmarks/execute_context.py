@@ -0,0 +1,72 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Benchmark of Execute request setup
+
+Compares deep copy of the process, formerly done by Service.execute for
+each request, with lightweight per request instance created by
+Process.new_instance.
+
+Usage::
+
+    python benchmarks/execute_context.py
+"""
+
+from __future__ import print_function
+
+import copy
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pywps import Process, LiteralInput, LiteralOutput, ComplexInput, ComplexOutput, Format, FORMATS  # noqa
+from pywps.inout.literaltypes import AllowedValue  # noqa
+
+REPEAT = 5
+NUMBER = 20
+
+
+def create_process(allowed_values):
+    def handler(request, response):
+        return response
+
+    formats = [Format(frmt.mime_type, extension=frmt.extension) for frmt in FORMATS]
+    return Process(
+        handler=handler,
+        identifier='process',
+        title='Process',
+        inputs=[
+            LiteralInput('literal_%i' % i, 'Literal input %i' % i, data_type='integer',
+                         allowed_values=[AllowedValue(value=v) for v in range(allowed_values)])
+            for i in range(5)
+        ] + [
+            ComplexInput('complex_%i' % i, 'Complex input %i' % i, supported_formats=formats)
+            for i in range(5)
+        ],
+        outputs=[
+            LiteralOutput('literal', 'Literal output', data_type='string'),
+            ComplexOutput('complex', 'Complex output', supported_formats=formats)
+        ])
+
+
+def best(statement):
+    """Return best time of one call in milliseconds"""
+    return min(timeit.repeat(statement, repeat=REPEAT, number=NUMBER)) / NUMBER * 1000
+
+
+def main():
+    print('%15s %15s %18s' % ('allowed values', 'deepcopy [ms]', 'new_instance [ms]'))
+    for allowed_values in (10, 1000, 10000):
+        process = create_process(allowed_values)
+        print('%15i %15.3f %18.3f' % (allowed_values,
+                                      best(lambda: copy.deepcopy(process)),
+                                      best(process.new_instance)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Benchmark of download of reference inputs
+
+Executes process with many reference inputs pointing to local HTTP server,
+which answers each request after fixed latency, as remote data server
+would. Downloads one by one (``[server] referencethreads=1``) are compared
+with concurrent downloads.
+
+Usage::
+
+    python benchmarks/reference_fetch.py
+"""
+
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pywps import Service, Process, ComplexInput, Format, WPS, OWS, configuration  # noqa
+from pywps.tests import client_for, assert_response_success  # noqa
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+REFERENCES = 20
+# latency of the data server
+LATENCY = 0.05
+TILE = b'x' * 256 * 1024
+
+
+class TileHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(TILE)))
+        self.end_headers()
+        self.wfile.write(TILE)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def handler(request, response):
+    assert len(request.inputs['tile']) == REFERENCES
+    return response
+
+
+def run(client, port, threads):
+    configuration.CONFIG.set('server', 'referencethreads', str(threads))
+    request_doc = WPS.Execute(
+        OWS.Identifier('tiles'),
+        WPS.DataInputs(*[
+            WPS.Input(OWS.Identifier('tile'),
+                      WPS.Reference({'{http://www.w3.org/1999/xlink}href':
+                                     'http://127.0.0.1:%i/tile%i.bin' % (port, i)},
+                                    mimeType='application/octet-stream'))
+            for i in range(REFERENCES)]),
+        version='1.0.0')
+
+    start = time.time()
+    resp = client.post_xml(doc=request_doc)
+    assert_response_success(resp)
+    return (time.time() - start) * 1000
+
+
+def main():
+    workdir = tempfile.mkdtemp()
+    configuration.get_config_value('server', 'workdir')
+    configuration.CONFIG.set('server', 'workdir', workdir)
+    configuration.CONFIG.set('server', 'outputpath', workdir)
+    configuration.CONFIG.set('server', 'referencehostlimit', '8')
+    configuration.CONFIG.set('logging', 'level', 'INFO')
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), TileHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    process = Process(handler, 'tiles', 'Tiles',
+                      inputs=[ComplexInput('tile', 'Tile', max_occurs=REFERENCES,
+                                           supported_formats=[Format('application/octet-stream')])])
+    client = client_for(Service(processes=[process]))
+    try:
+        print('%i references, %i ms latency' % (REFERENCES, LATENCY * 1000))
+        for threads in (1, 4, 8):
+            print('%25s %10.1f ms' % ('%i threads' % threads, run(client, server.server_port, threads)))
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
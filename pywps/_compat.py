@@ -5,6 +5,7 @@
 ##################################################################
 
 import logging
+import os
 import sys
 
 __author__ = "Alex Morega"
@@ -19,7 +20,15 @@ if PY2:
     from flufl.enum import Enum
     from urlparse import urlparse
     from urlparse import urljoin
+    from urllib import quote
     from urllib2 import urlopen
+    import Queue as queue
+
+    def replace(src, dst):
+        """Rename src to dst, overwriting it"""
+        if os.name == 'nt' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
 
 else:
     LOGGER.debug('Python 3.x')
@@ -28,4 +37,7 @@ else:
     from enum import Enum
     from urllib.parse import urlparse
     from urllib.parse import urljoin
+    from urllib.parse import quote
     from urllib.request import urlopen
+    from os import replace
+    import queue
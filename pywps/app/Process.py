@@ -9,14 +9,16 @@ import logging
 import os
 import sys
 import traceback
-import json
 import shutil
 import tempfile
+import copy
+import inspect
+import types
 
 from pywps import WPS, OWS, E, dblog
 from pywps.app.WPSResponse import WPSResponse
 from pywps.app.WPSResponse import STATUS
-from pywps.app.WPSRequest import WPSRequest
+from pywps.app import resultcache, scheduler
 import pywps.configuration as config
 from pywps._compat import PY2
 from pywps.exceptions import (StorageNotSupported, OperationNotSupported,
@@ -43,10 +45,18 @@ class Process(object):
                    objects.
     :param metadata: List of metadata advertised by this process. They
                      should be :class:`pywps.app.Common.Metadata` objects.
+    :param priority: Queued asynchronous requests of processes with higher
+                     priority are started first.
+    :param cache_ttl: Outputs of deterministic process can be cached for
+                      cache_ttl seconds and reused for Execute requests with
+                      the same inputs, without invoking the handler. The
+                      version of the process should be changed, whenever
+                      the handler gives different results.
     """
 
     def __init__(self, handler, identifier, title, abstract='', profile=[], metadata=[], inputs=[],
-                 outputs=[], version='None', store_supported=False, status_supported=False, grass_location=None):
+                 outputs=[], version='None', store_supported=False, status_supported=False, grass_location=None,
+                 priority=0, cache_ttl=None):
         self.identifier = identifier
         self.handler = handler
         self.title = title
@@ -60,8 +70,12 @@ class Process(object):
         self.status_location = ''
         self.status_url = ''
         self.workdir = None
+        # environment variables for subprocesses started by the handler
+        self.environ = None
         self._grass_mapset = None
         self.grass_location = grass_location
+        self.priority = priority
+        self.cache_ttl = cache_ttl
 
         if store_supported:
             self.store_supported = 'true'
@@ -123,6 +137,34 @@ class Process(object):
 
         return doc
 
+    def new_instance(self):
+        """Return lightweight copy of this process for single Execute request
+
+        The process definition (descriptive metadata, handler, input and
+        output definitions) is shared with this instance, only request scoped
+        attributes (uuid, workdir, status location, state of inputs and
+        outputs) are separate.
+
+        :rtype: pywps.app.Process.Process
+        """
+
+        process = copy.copy(self)
+        process.inputs = [copy.copy(inpt) for inpt in self.inputs]
+        process.outputs = [copy.copy(outpt) for outpt in self.outputs]
+        process.uuid = None
+        process.status_location = ''
+        process.status_url = ''
+        process.workdir = None
+        process.environ = None
+        process._grass_mapset = None
+
+        # handler defined as method of this process has to be bound to the
+        # new instance, so that it sees e.g. its workdir
+        if inspect.ismethod(self.handler) and self.handler.__self__ is self:
+            process.handler = types.MethodType(self.handler.__func__, process)
+
+        return process
+
     def execute(self, wps_request, uuid):
         self._set_uuid(uuid)
         self.async = False
@@ -167,69 +209,53 @@ class Process(object):
         self.status_url = os.path.join(file_url, str(self.uuid)) + '.xml'
 
     def _execute_process(self, async, wps_request, wps_response):
-        """Uses :module:`multiprocessing` module for sending process to
-        background BUT first, check for maxprocesses configuration value
+        """Execute the process or put it into the queue of asynchronous
+        requests, first check for parallelprocesses configuration value
 
         :param async: run in asynchronous mode
         :return: wps_response or None
         """
 
         maxparallel = int(config.get_config_value('server', 'parallelprocesses'))
-        running = dblog.get_running().count()
-        stored = dblog.get_stored().count()
 
         # async
         if async:
-
-            # run immedietly
-            if running < maxparallel or maxparallel == -1:
-                self._run_async(wps_request, wps_response)
-
-            # try to store for later usage
-            else:
-                wps_response = self._store_process(stored,
-                                                   wps_request, wps_response)
+            # the request is started by the scheduler as soon as there is
+            # free slot
+            scheduler.enqueue(self, wps_request)
+            scheduler.dispatch()
 
         # not async
         else:
+            running = dblog.count_running()
             if running < maxparallel or maxparallel == -1:
                 wps_response = self._run_process(wps_request, wps_response)
+                # finished request freed slot for queued one
+                scheduler.dispatch()
             else:
                 raise ServerBusy('Maximum number of parallel running processes reached. Please try later.')
 
         return wps_response
 
-    def _run_async(self, wps_request, wps_response):
-        import multiprocessing
-        process = multiprocessing.Process(
-            target=self._run_process,
-            args=(wps_request, wps_response)
-        )
-        process.start()
-
-    def _store_process(self, stored, wps_request, wps_response):
-        """Try to store given requests
-        """
-
-        maxprocesses = int(config.get_config_value('server', 'maxprocesses'))
-
-        if stored < maxprocesses:
-            dblog.store_process(self.uuid, wps_request)
-        else:
-            raise ServerBusy('Maximum number of parallel running processes reached. Please try later.')
-
-        return wps_response
-
     def _run_process(self, wps_request, wps_response):
         try:
+            self.environ = os.environ.copy()
             self._set_grass()
             # if required set HOME to the current working directory.
             if config.get_config_value('server', 'sethomedir') is True:
-                os.environ['HOME'] = self.workdir
-                LOGGER.info('Setting HOME to current working directory: %s', os.environ['HOME'])
-            LOGGER.debug('ProcessID=%s, HOME=%s', self.uuid, os.environ.get('HOME'))
+                self._set_environ('HOME', self.workdir)
+                LOGGER.info('Setting HOME to current working directory: %s', self.environ['HOME'])
+            LOGGER.debug('ProcessID=%s, HOME=%s', self.uuid, self.environ.get('HOME'))
             wps_response.update_status('PyWPS Process started', 0)
-            wps_response = self.handler(wps_request, wps_response)
+
+            cache_key = None
+            if self.cache_ttl:
+                cache_key = resultcache.get_key(self, wps_request)
+            if cache_key is None or not resultcache.load(cache_key, self):
+                wps_response = self.handler(wps_request, wps_response)
+                if cache_key is not None:
+                    # stored before the working directory is removed
+                    resultcache.store(cache_key, self, self.cache_ttl)
 
             # if (not wps_response.status_percentage) or (wps_response.status_percentage != 100):
             LOGGER.debug('Updating process status to 100% if everything went correctly')
@@ -264,22 +290,20 @@ class Process(object):
             else:
                 wps_response.update_status(msg, -1)
 
-        # tr
-        stored_request = dblog.get_first_stored()
-        if stored_request:
-            (uuid, request_json) = (stored_request.uuid, stored_request.request)
-            if not PY2:
-                request_json = request_json.decode('utf-8')
-            new_wps_request = WPSRequest()
-            new_wps_request.json = json.loads(request_json)
-            new_wps_response = WPSResponse(self, new_wps_request, uuid)
-            new_wps_response.status = STATUS.STORE_AND_UPDATE_STATUS
-            self._set_uuid(uuid)
-            self._run_async(new_wps_request, new_wps_response)
-            dblog.remove_stored(uuid)
-
         return wps_response
 
+    def _set_environ(self, name, value):
+        """Set environment variable for subprocesses of this process
+
+        The variable is stored in :attr:`environ`, which should be passed to
+        the subprocesses. Unless PyWPS runs in thread safe mode, it is also
+        set for the whole server process.
+        """
+
+        self.environ[name] = value
+        if config.get_config_value('server', 'threadsafe') is not True:
+            os.environ[name] = value
+
     def clean(self):
         """Clean the process working dir and other temporary files
         """
@@ -333,23 +357,23 @@ class Process(object):
 
             # HOME needs to be set - and that is usually not the case for httpd
             # server
-            os.environ['HOME'] = self.workdir
+            self._set_environ('HOME', self.workdir)
 
             # GISRC envvariable needs to be set
             gisrc = open(os.path.join(self.workdir, 'GISRC'), 'w')
             gisrc.write("GISDBASE: %s\n" % self.workdir)
             gisrc.write("GUI: txt\n")
             gisrc.close()
-            os.environ['GISRC'] = gisrc.name
+            self._set_environ('GISRC', gisrc.name)
 
             # create new location from epsg code
             if self.grass_location.lower().startswith('epsg:'):
                 epsg = self.grass_location.lower().replace('epsg:', '')
                 dbase = self.workdir
-                os.environ['GISDBASE'] = self.workdir
+                self._set_environ('GISDBASE', self.workdir)
                 location = 'pywps_location'
-                grass.run_command('g.gisenv', set="GISDBASE=%s" % dbase)
-                grass.run_command('g.proj', flags="t", location=location, epsg=epsg)
+                grass.run_command('g.gisenv', set="GISDBASE=%s" % dbase, env=self.environ)
+                grass.run_command('g.proj', flags="t", location=location, epsg=epsg, env=self.environ)
                 LOGGER.debug('GRASS location based on EPSG code created')
 
             # create temporary mapset within existing location
@@ -357,7 +381,7 @@ class Process(object):
                 LOGGER.debug('Temporary mapset will be created')
                 dbase = os.path.dirname(self.grass_location)
                 location = os.path.basename(self.grass_location)
-                grass.run_command('g.gisenv', set="GISDBASE=%s" % dbase)
+                grass.run_command('g.gisenv', set="GISDBASE=%s" % dbase, env=self.environ)
 
             else:
                 raise NoApplicableCode('Location does exists or does not seem ' +
@@ -379,10 +403,10 @@ class Process(object):
 
             # final initialization
             LOGGER.debug('GRASS Mapset set to %s' % mapset_name)
-            grass.run_command('g.gisenv', set="LOCATION_NAME=%s" % location)
-            grass.run_command('g.gisenv', set="MAPSET=%s" % os.path.basename(mapset_name))
+            grass.run_command('g.gisenv', set="LOCATION_NAME=%s" % location, env=self.environ)
+            grass.run_command('g.gisenv', set="MAPSET=%s" % os.path.basename(mapset_name), env=self.environ)
 
             LOGGER.debug('GRASS environment initialised')
             LOGGER.debug('GISRC {}, GISBASE {}, GISDBASE {}, LOCATION {}, MAPSET {}'.format(
-                         os.environ.get('GISRC'), os.environ.get('GISBASE'),
+                         self.environ.get('GISRC'), self.environ.get('GISBASE'),
                          dbase, location, os.path.basename(mapset_name)))
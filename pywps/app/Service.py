@@ -7,24 +7,30 @@
 
 import logging
 import tempfile
+import datetime
+import hashlib
 from werkzeug.exceptions import HTTPException
 from werkzeug.wrappers import Request, Response
-from pywps import WPS, OWS
-from pywps._compat import PY2
-from pywps._compat import urlopen
-from pywps.app.basic import xml_response
+from pywps import WPS, OWS, E
+from pywps._compat import PY2, text_type
+from pywps._compat import urlopen, urlparse
+from pywps.app.basic import xml_response, xml_serialize, file_response
 from pywps.app.WPSRequest import WPSRequest
+from pywps.app import scheduler
+from pywps.app import refcache
+from pywps.app.fetcher import Fetcher, download, get_session, get_timeout, iter_content
 import pywps.configuration as config
 from pywps.exceptions import MissingParameterValue, NoApplicableCode, InvalidParameterValue, FileSizeExceeded, \
     StorageNotSupported
 from pywps.inout.inputs import ComplexInput, LiteralInput, BoundingBoxInput
+from pywps.inout.outputs import ComplexOutput
 from pywps.dblog import log_request, update_response
 
 from collections import deque, OrderedDict
 import os
+import shutil
 import sys
 import uuid
-import copy
 
 LOGGER = logging.getLogger("PYWPS")
 
@@ -43,6 +49,13 @@ class Service(object):
     def __init__(self, processes=[], cfgfiles=None):
         # ordered dict of processes
         self.processes = OrderedDict((p.identifier, p) for p in processes)
+        # serialized GetCapabilities document, see get_capabilities
+        self._capabilities = None
+        # serialized process descriptions, see describe
+        self._descriptions = {}
+        self._describe_all = None
+        # make processes available to the scheduler of async requests
+        scheduler.register(processes)
 
         if cfgfiles:
             config.load_configuration(cfgfiles)
@@ -55,7 +68,35 @@ class Service(object):
         else:  # NullHandler
             LOGGER.addHandler(logging.NullHandler())
 
-    def get_capabilities(self):
+    def get_capabilities(self, http_request=None):
+        """Return GetCapabilities response
+
+        The document is serialized only once and served from memory
+        afterwards. It is rebuilt, when the list of processes or the
+        configuration changes.
+
+        :param http_request: werkzeug request, used for answering conditional
+                             requests (If-None-Match, If-Modified-Since)
+        """
+
+        key = self._get_cache_key()
+        if self._capabilities is None or self._capabilities.key != key:
+            LOGGER.debug('Building GetCapabilities document')
+            self._capabilities = CachedDocument(key, self.capabilities_xml())
+
+        return self._capabilities.get_response(http_request)
+
+    def _get_cache_key(self):
+        """Return key identifying current state of configuration and processes
+        """
+
+        return (config.get_config_generation(),
+                tuple((identifier, id(process))
+                      for (identifier, process) in self.processes.items()))
+
+    def capabilities_xml(self):
+        """Return GetCapabilities document as lxml element
+        """
         process_elements = [p.capabilities_xml()
                             for p in self.processes.values()]
 
@@ -239,43 +280,71 @@ class Service(object):
 
         doc.append(languages_doc)
 
-        return xml_response(doc)
+        return doc
+
+    def describe(self, identifiers, http_request=None):
+        """Return DescribeProcess response
+
+        Process descriptions are serialized once per process identifier and
+        version and the response is assembled from the serialized fragments.
+        Response for the `all` identifier is kept in memory completely.
 
-    def describe(self, identifiers):
+        :param identifiers: list of process identifiers
+        :param http_request: werkzeug request, used for answering conditional
+                             requests for `all` processes
+        """
         if not identifiers:
             raise MissingParameterValue('', 'identifier')
 
-        identifier_elements = []
         # 'all' keyword means all processes
         if 'all' in (ident.lower() for ident in identifiers):
-            for process in self.processes:
-                try:
-                    identifier_elements.append(
-                        self.processes[process].describe_xml())
-                except Exception as e:
-                    raise NoApplicableCode(e)
-        else:
-            for identifier in identifiers:
-                try:
-                    process = self.processes[identifier]
-                except KeyError:
-                    raise InvalidParameterValue(
-                        "Unknown process %r" % identifier, "identifier")
-                else:
-                    try:
-                        identifier_elements.append(process.describe_xml())
-                    except Exception as e:
-                        raise NoApplicableCode(e)
+            key = self._get_cache_key()
+            if self._describe_all is None or self._describe_all.key != key:
+                LOGGER.debug('Building DescribeProcess document for all processes')
+                self._describe_all = CachedDocument(
+                    key, self._describe_body(self.processes.values()))
+            return self._describe_all.get_response(http_request)
+
+        processes = []
+        for identifier in identifiers:
+            try:
+                processes.append(self.processes[identifier])
+            except KeyError:
+                raise InvalidParameterValue(
+                    "Unknown process %r" % identifier, "identifier")
 
-        doc = WPS.ProcessDescriptions(
-            *identifier_elements
-        )
-        doc.attrib['{http://www.w3.org/2001/XMLSchema-instance}schemaLocation'] = \
-            'http://www.opengis.net/wps/1.0.0 http://schemas.opengis.net/wps/1.0.0/wpsDescribeProcess_response.xsd'
-        doc.attrib['service'] = 'WPS'
-        doc.attrib['version'] = '1.0.0'
-        doc.attrib['{http://www.w3.org/XML/1998/namespace}lang'] = 'en-US'
-        return xml_response(doc)
+        return xml_response(self._describe_body(processes))
+
+    def _describe_body(self, processes):
+        """Assemble serialized ProcessDescriptions document from cached
+        process description fragments
+        """
+
+        fragments = [self._get_description(process) for process in processes]
+        if not fragments:
+            return xml_serialize(_describe_doc([]))
+
+        (head, tail) = _get_describe_template()
+        return head + _DESCRIBE_SEPARATOR.join(fragments) + tail
+
+    def _get_description(self, process):
+        """Return serialized ProcessDescription element of given process
+        """
+
+        key = (process.identifier, process.version)
+        cached = self._descriptions.get(key)
+        if cached is not None and cached[0] is process:
+            return cached[1]
+
+        try:
+            doc = _describe_doc([process.describe_xml()])
+        except Exception as e:
+            raise NoApplicableCode(e)
+
+        (head, tail) = _get_describe_template()
+        fragment = xml_serialize(doc)[len(head):-len(tail)]
+        self._descriptions[key] = (process, fragment)
+        return fragment
 
     def execute(self, identifier, wps_request, uuid):
         """Parse and perform Execute WPS request call
@@ -287,19 +356,21 @@ class Service(object):
         self._set_grass()
         response = None
         try:
-            process = self.processes[identifier]
-
-            # make deep copy of the process instace
-            # so that processes are not overriding each other
-            # just for execute
-            process = copy.deepcopy(process)
+            # use separate instance of the process for each request, so that
+            # requests are not overriding each other
+            process = self.processes[identifier].new_instance()
 
             workdir = os.path.abspath(config.get_config_value('server', 'workdir'))
-            tempdir = tempfile.mkdtemp(prefix='pywps_process_', dir=workdir)
+            tempdir = tempfile.mkdtemp(prefix='pywps_process_{}_'.format(uuid), dir=workdir)
             process.set_workdir(tempdir)
         except KeyError:
             raise InvalidParameterValue("Unknown process '%r'" % identifier, 'Identifier')
 
+        # current working directory is shared by all threads of the process,
+        # in thread safe mode processes have to use process.workdir
+        if config.get_config_value('server', 'threadsafe') is True:
+            return self._parse_and_execute(process, wps_request, uuid)
+
         olddir = os.path.abspath(os.curdir)
         try:
             os.chdir(process.workdir)
@@ -319,29 +390,36 @@ class Service(object):
 
         LOGGER.debug('Checking if all mandatory inputs have been passed')
         data_inputs = {}
-        for inpt in process.inputs:
-            if inpt.identifier not in wps_request.inputs:
-                if inpt.min_occurs > 0:
-                    LOGGER.error('Missing parameter value: %s', inpt.identifier)
-                    raise MissingParameterValue(
-                        inpt.identifier, inpt.identifier)
+        # references are downloaded concurrently, while the other inputs are
+        # parsed
+        fetcher = Fetcher()
+        try:
+            for inpt in process.inputs:
+                if inpt.identifier not in wps_request.inputs:
+                    if inpt.min_occurs > 0:
+                        LOGGER.error('Missing parameter value: %s', inpt.identifier)
+                        raise MissingParameterValue(
+                            inpt.identifier, inpt.identifier)
+                    else:
+                        # inputs = deque(maxlen=inpt.max_occurs)
+                        # inputs.append(inpt.clone())
+                        # data_inputs[inpt.identifier] = inputs
+                        pass
                 else:
-                    # inputs = deque(maxlen=inpt.max_occurs)
-                    # inputs.append(inpt.clone())
-                    # data_inputs[inpt.identifier] = inputs
-                    pass
-            else:
-                # Replace the dicts with the dict of Literal/Complex inputs
-                # set the input to the type defined in the process.
-                if isinstance(inpt, ComplexInput):
-                    data_inputs[inpt.identifier] = self.create_complex_inputs(
-                        inpt, wps_request.inputs[inpt.identifier])
-                elif isinstance(inpt, LiteralInput):
-                    data_inputs[inpt.identifier] = self.create_literal_inputs(
-                        inpt, wps_request.inputs[inpt.identifier])
-                elif isinstance(inpt, BoundingBoxInput):
-                    data_inputs[inpt.identifier] = self.create_bbox_inputs(
-                        inpt, wps_request.inputs[inpt.identifier])
+                    # Replace the dicts with the dict of Literal/Complex inputs
+                    # set the input to the type defined in the process.
+                    if isinstance(inpt, ComplexInput):
+                        data_inputs[inpt.identifier] = self.create_complex_inputs(
+                            inpt, wps_request.inputs[inpt.identifier], fetcher)
+                    elif isinstance(inpt, LiteralInput):
+                        data_inputs[inpt.identifier] = self.create_literal_inputs(
+                            inpt, wps_request.inputs[inpt.identifier])
+                    elif isinstance(inpt, BoundingBoxInput):
+                        data_inputs[inpt.identifier] = self.create_bbox_inputs(
+                            inpt, wps_request.inputs[inpt.identifier])
+            fetcher.wait()
+        finally:
+            fetcher.cancel()
 
         wps_request.inputs = data_inputs
 
@@ -379,7 +457,11 @@ class Service(object):
             for outpt in wps_request.outputs:
                 for proc_outpt in process.outputs:
                     if outpt == proc_outpt.identifier:
-                        resp = Response(proc_outpt.data)
+                        try:
+                            resp = self._get_raw_response(proc_outpt, wps_request.http_request)
+                        except Exception:
+                            process.clean()
+                            raise
                         resp.call_on_close(process.clean)
                         return resp
 
@@ -388,12 +470,23 @@ class Service(object):
 
         return wps_response
 
+    def _get_raw_response(self, outpt, http_request):
+        """Return response with value of the output as RawDataOutput
+
+        Files of complex outputs are streamed, not read to memory.
+        """
+
+        if isinstance(outpt, ComplexOutput) and outpt.source_type is not None:
+            content_type = outpt.data_format.mime_type if outpt.data_format else None
+            return file_response(outpt.file, content_type or 'application/octet-stream', http_request)
+        return Response(text_type(outpt.data))
+
     def _get_complex_input_handler(self, href):
         """Return function for parsing and storing complexdata
         :param href: href object yes or not
         """
 
-        def href_handler(complexinput, datain):
+        def href_handler(complexinput, datain, fetcher=None):
             """<wps:Reference /> handler"""
             # save the reference input in workdir
             extension = None
@@ -403,50 +496,71 @@ class Service(object):
                 href=datain.get('href'),
                 workdir=complexinput.workdir,
                 extension=extension)
+            # reserve the file name, other references are downloaded
+            # concurrently
+            open(tmp_file, 'a').close()
 
-            try:
-                (reference_file, reference_file_data) = _openurl(datain)
-                data_size = reference_file.headers.get('Content-Length', 0)
-            except Exception as e:
-                raise NoApplicableCode('File reference error: %s' % e)
-
-            # if the response did not return a 'Content-Length' header then
-            # calculate the size
-            if data_size == 0:
-                LOGGER.debug('no Content-Length, calculating size')
-                data_size = _get_datasize(reference_file_data)
-
-            # check if input file size was not exceeded
-            complexinput.calculate_max_input_size()
-            byte_size = complexinput.max_size * 1024 * 1024
-            if int(data_size) > int(byte_size):
-                raise FileSizeExceeded('File size for input exceeded.'
-                                       ' Maximum allowed: %i megabytes' %
-                                       complexinput.max_size, complexinput.identifier)
+            def fetch_reference():
+                # download is aborted, when the input is larger
+                complexinput.calculate_max_input_size()
+                max_bytes = int(complexinput.max_size * 1024 * 1024)
 
-            try:
-                with open(tmp_file, 'w') as f:
-                    f.write(reference_file_data)
-            except Exception as e:
-                raise NoApplicableCode(e)
+                cache = refcache.get_cache()
+                try:
+                    if cache is not None and refcache.is_cacheable(datain):
+                        cache.fetch(datain.get('href'), tmp_file, max_bytes)
+                    else:
+                        download(_openurl(datain), tmp_file, max_bytes)
+                except FileSizeExceeded:
+                    raise FileSizeExceeded('File size for input exceeded.'
+                                           ' Maximum allowed: %i megabytes' %
+                                           complexinput.max_size, complexinput.identifier)
+                except Exception as e:
+                    raise NoApplicableCode('File reference error: %s' % e)
+
+                complexinput.file = tmp_file
 
-            complexinput.file = tmp_file
             complexinput.url = datain.get('href')
             complexinput.as_reference = True
+            if fetcher is not None:
+                fetcher.submit(datain.get('href'), fetch_reference)
+            else:
+                fetch_reference()
 
-        def data_handler(complexinput, datain):
+        def data_handler(complexinput, datain, fetcher=None):
             """<wps:Data> ... </wps:Data> handler"""
 
-            complexinput.data = datain.get('data')
+            if 'file' in datain:
+                # inline data stored while the request was parsed
+                suffix = ''
+                if complexinput.data_format and complexinput.data_format.extension:
+                    suffix = complexinput.data_format.extension
+                file_name = os.path.join(complexinput.workdir, os.path.basename(datain['file']) + suffix)
+                shutil.move(datain['file'], file_name)
+                if datain.get('encoding') == 'base64':
+                    complexinput.set_binary_file(file_name)
+                else:
+                    complexinput.file = file_name
+            elif 'base64' in datain:
+                try:
+                    complexinput.base64 = datain['base64']
+                except (TypeError, ValueError):
+                    # binascii.Error is ValueError, Python 2 raises TypeError
+                    raise InvalidParameterValue('Invalid base64 encoded data', complexinput.identifier)
+            else:
+                complexinput.data = datain.get('data')
 
         if href:
             return href_handler
         else:
             return data_handler
 
-    def create_complex_inputs(self, source, inputs):
+    def create_complex_inputs(self, source, inputs, fetcher=None):
         """Create new ComplexInput as clone of original ComplexInput
         because of inputs can be more then one, take it just as Prototype
+
+        :param fetcher: :class:`pywps.app.fetcher.Fetcher`, references are
+                        downloaded by it, when given
         :return collections.deque:
         """
 
@@ -475,7 +589,7 @@ class Service(object):
             href = inpt.get('href', None)
 
             complex_data_handler = self._get_complex_input_handler(href)
-            complex_data_handler(data_input, inpt)
+            complex_data_handler(data_input, inpt, fetcher)
 
             outinputs.append(data_input)
         if len(outinputs) < source.min_occurs:
@@ -562,6 +676,10 @@ class Service(object):
     def __call__(self, http_request):
 
         request_uuid = uuid.uuid1()
+        # removal of expired outputs runs in background of each server
+        # process, imported here, so that it can be run as a script as well
+        from pywps.app import retention
+        retention.start()
 
         environ_cfg = http_request.environ.get('PYWPS_CFG')
         if 'PYWPS_CFG' not in os.environ and environ_cfg:
@@ -577,17 +695,21 @@ class Service(object):
                 log_request(request_uuid, wps_request)
                 response = None
                 if wps_request.operation == 'getcapabilities':
-                    response = self.get_capabilities()
+                    response = self.get_capabilities(http_request)
 
                 elif wps_request.operation == 'describeprocess':
-                    response = self.describe(wps_request.identifiers)
+                    response = self.describe(wps_request.identifiers, http_request)
 
                 elif wps_request.operation == 'execute':
-                    response = self.execute(
-                        wps_request.identifier,
-                        wps_request,
-                        request_uuid
-                    )
+                    try:
+                        response = self.execute(
+                            wps_request.identifier,
+                            wps_request,
+                            request_uuid
+                        )
+                    finally:
+                        # inline inputs not taken over by the process
+                        wps_request.clean()
                 update_response(request_uuid, response, close=True)
                 return response
             else:
@@ -614,11 +736,76 @@ class Service(object):
             return e
 
 
+class CachedDocument(object):
+    """Serialized XML document kept in memory together with validators
+    for conditional HTTP requests
+
+    :param key: key identifying the state the document was built from
+    :param doc: lxml element to be serialized or already serialized bytes
+    """
+
+    def __init__(self, key, doc):
+        self.key = key
+        if isinstance(doc, bytes):
+            self.body = doc
+        else:
+            self.body = xml_serialize(doc)
+        self.etag = hashlib.md5(self.body).hexdigest()
+        # HTTP dates have resolution of seconds
+        self.last_modified = datetime.datetime.utcnow().replace(microsecond=0)
+
+    def get_response(self, http_request=None):
+        """Return response with the document, or 304 Not Modified, if the
+        client already has it
+        """
+
+        response = xml_response(self.body)
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        if http_request is not None:
+            response.make_conditional(http_request)
+        return response
+
+
+_DESCRIBE_PLACEHOLDER = b'<DescribePlaceholder/>'
+_DESCRIBE_SEPARATOR = b'\n  '
+_DESCRIBE_TEMPLATE = None
+
+
+def _describe_doc(elements):
+    """Return ProcessDescriptions element with given ProcessDescription
+    elements
+    """
+
+    doc = WPS.ProcessDescriptions(*elements)
+    doc.attrib['{http://www.w3.org/2001/XMLSchema-instance}schemaLocation'] = \
+        'http://www.opengis.net/wps/1.0.0 http://schemas.opengis.net/wps/1.0.0/wpsDescribeProcess_response.xsd'
+    doc.attrib['service'] = 'WPS'
+    doc.attrib['version'] = '1.0.0'
+    doc.attrib['{http://www.w3.org/XML/1998/namespace}lang'] = 'en-US'
+    return doc
+
+
+def _get_describe_template():
+    """Return serialized ProcessDescriptions document split to the part
+    before and after the ProcessDescription elements
+    """
+
+    global _DESCRIBE_TEMPLATE
+
+    if _DESCRIBE_TEMPLATE is None:
+        body = xml_serialize(_describe_doc([E.DescribePlaceholder()]))
+        _DESCRIBE_TEMPLATE = tuple(body.split(_DESCRIBE_PLACEHOLDER))
+    return _DESCRIBE_TEMPLATE
+
+
 def _openurl(inpt):
-    """use urllib to open given href
+    """Open given href, HTTP references are opened using the session of the
+    server process, see :func:`pywps.app.fetcher.get_session`
+
+    :returns: response, its content is not read yet
     """
     data = None
-    reference_file = None
     href = inpt.get('href')
 
     LOGGER.debug('Fetching URL %s', href)
@@ -626,38 +813,26 @@ def _openurl(inpt):
         if 'body' in inpt:
             data = inpt.get('body')
         elif 'bodyreference' in inpt:
-            data = urlopen(url=inpt.get('bodyreference')).read()
-
-        reference_file = urlopen(url=href, data=data)
-    else:
-        reference_file = urlopen(url=href)
-
-    if PY2:
-        reference_file_data = reference_file.read()
-    else:
-        reference_file_data = reference_file.read().decode('utf-8')
-
-    return (reference_file, reference_file_data)
-
-
-def _get_datasize(reference_file_data):
-
-    tmp_sio = None
-    data_size = 0
+            bodyreference = _openurl({'href': inpt.get('bodyreference')})
+            try:
+                data = b''.join(iter_content(bodyreference))
+            finally:
+                bodyreference.close()
 
-    if PY2:
-        from StringIO import StringIO
+    if urlparse(href).scheme not in ('http', 'https'):
+        return urlopen(url=href, data=data)
 
-        tmp_sio = StringIO(reference_file_data)
-        data_size = tmp_sio.len
+    session = get_session()
+    if inpt.get('method') == 'POST':
+        response = session.post(href, data=data, stream=True, timeout=get_timeout())
     else:
-        from io import StringIO
-
-        tmp_sio = StringIO()
-        data_size = tmp_sio.write(reference_file_data)
-    tmp_sio.close()
-
-    return data_size
+        response = session.get(href, stream=True, timeout=get_timeout())
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    return response
 
 
 def _build_input_file_name(href, workdir, extension=None):
@@ -670,7 +845,8 @@ def _build_input_file_name(href, workdir, extension=None):
     input_file_name = os.path.join(workdir, file_name)
     # build tempfile in case of duplicates
     if os.path.exists(input_file_name):
-        input_file_name = tempfile.mkstemp(
+        (fd, input_file_name) = tempfile.mkstemp(
             suffix=suffix, prefix=prefix + '_',
-            dir=workdir)[1]
+            dir=workdir)
+        os.close(fd)
     return input_file_name
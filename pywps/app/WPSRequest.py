@@ -6,15 +6,17 @@
 
 
 import logging
+import os
+import tempfile
 import lxml
 import lxml.etree
 from werkzeug.exceptions import MethodNotAllowed
 import base64
 import datetime
-from pywps import WPS
+from pywps import WPS, OWS
 from pywps._compat import text_type, PY2
-from pywps.app.basic import xpath_ns
-from pywps.inout.basic import LiteralInput, ComplexInput, BBoxInput
+from pywps.app.basic import xpath_ns, BLOCK_SIZE
+from pywps.inout.basic import LiteralInput, ComplexInput, BBoxInput, Base64Decoder
 from pywps.exceptions import NoApplicableCode, OperationNotSupported, MissingParameterValue, VersionNegotiationFailed, \
     InvalidParameterValue, FileSizeExceeded
 from pywps import configuration
@@ -37,17 +39,30 @@ class WPSRequest(object):
         self.version = None
         self.language = None
         self.identifiers = None
+        self.identifier = None
         self.store_execute = None
         self.status = None
         self.lineage = None
         self.inputs = None
         self.outputs = None
         self.raw = None
+        # files of inline complex inputs stored while parsing
+        self.spooled_files = []
 
         if self.http_request:
             request_parser = self._get_request_parser_method(http_request.method)
             request_parser()
 
+    def clean(self):
+        """Remove files of inline complex inputs, which were not taken over
+        by inputs of the process
+        """
+
+        for file_name in self.spooled_files:
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        self.spooled_files = []
+
     def _get_request_parser_method(self, method):
 
         if method == 'GET':
@@ -76,26 +91,47 @@ class WPSRequest(object):
         request_parser(self.http_request)
 
     def _post_request(self):
-        """HTTP GET request parser
+        """HTTP POST request parser
+
+        The request body is parsed in blocks as it is read, inputs of Execute
+        request are taken from the document one by one, see
+        :class:`_RequestTarget`
         """
         # check if input file size was not exceeded
         maxsize = configuration.get_config_value('server', 'maxrequestsize')
         maxsize = configuration.get_size_mb(maxsize) * 1024 * 1024
         if self.http_request.content_length > maxsize:
             raise FileSizeExceeded('File size for input exceeded.'
-                                   ' Maximum request size allowed: %i megabytes' % maxsize / 1024 / 1024)
+                                   ' Maximum request size allowed: %i megabytes' % (maxsize / 1024 / 1024))
+
+        if configuration.get_config_value('server', 'spoolinputs') is not False:
+            # inline complex inputs are stored to files
+            target = _RequestTarget(spool_dir=os.path.abspath(configuration.get_config_value('server', 'workdir')))
+        else:
+            # base64 encoded inputs are decoded to files of the process
+            target = _RequestTarget(decode_base64=False)
 
+        self.spooled_files = target.spooled_files
         try:
-            doc = lxml.etree.fromstring(self.http_request.get_data())
-        except Exception as e:
-            if PY2:
-                raise NoApplicableCode(e.message)
-            else:
-                raise NoApplicableCode(e.msg)
+            parser = lxml.etree.XMLParser(target=target)
+            try:
+                for block in iter(lambda: self.http_request.stream.read(BLOCK_SIZE), b''):
+                    parser.feed(block)
+                doc = parser.close()
+            except lxml.etree.XMLSyntaxError as e:
+                if PY2:
+                    raise NoApplicableCode(e.message)
+                else:
+                    raise NoApplicableCode(e.msg)
 
-        operation = doc.tag
-        request_parser = self._post_request_parser(operation)
-        request_parser(doc)
+            operation = doc.tag
+            request_parser = self._post_request_parser(operation)
+            if self.operation == 'execute':
+                self.inputs = target.inputs
+            request_parser(doc)
+        except Exception:
+            self.clean()
+            raise
 
     def _get_request_parser(self, operation):
         """Factory function returing propper parsing function
@@ -223,7 +259,7 @@ class WPSRequest(object):
             wpsrequest.lineage = 'false'
             wpsrequest.store_execute = 'false'
             wpsrequest.status = 'false'
-            wpsrequest.inputs = get_inputs_from_xml(doc)
+            # inputs were taken from the document while parsing
             wpsrequest.outputs = get_output_from_xml(doc)
             wpsrequest.raw = False
             if xpath_ns(doc, '/wps:Execute/wps:ResponseForm/wps:RawDataOutput'):
@@ -317,6 +353,7 @@ class WPSRequest(object):
             'version': self.version,
             'language': self.language,
             'identifiers': self.identifiers,
+            'identifier': self.identifier,
             'store_execute': self.store_execute,
             'status': self.status,
             'lineage': self.lineage,
@@ -338,6 +375,7 @@ class WPSRequest(object):
         self.version = value['version']
         self.language = value['language']
         self.identifiers = value['identifiers']
+        self.identifier = value.get('identifier')
         self.store_execute = value['store_execute']
         self.status = value['status']
         self.lineage = value['lineage']
@@ -426,82 +464,104 @@ class WPSRequest(object):
                 self.inputs[identifier] = [inpt]
 
 
-def get_inputs_from_xml(doc):
+def get_inputs_from_xml(doc, decode_base64=True):
+    """Return inputs of Execute request document
+
+    :param decode_base64: decode base64 encoded complex data, otherwise the
+                          encoded text is returned under `base64` key, so
+                          that it can be decoded to file by
+                          :meth:`pywps.inout.basic.IOHandler.set_base64`
+    """
+
     the_inputs = {}
     for input_el in xpath_ns(doc, '/wps:Execute/wps:DataInputs/wps:Input'):
-        [identifier_el] = xpath_ns(input_el, './ows:Identifier')
-        identifier = identifier_el.text
-
-        if identifier not in the_inputs:
-            the_inputs[identifier] = []
-
-        literal_data = xpath_ns(input_el, './wps:Data/wps:LiteralData')
-        if literal_data:
-            value_el = literal_data[0]
-            inpt = {}
-            inpt['identifier'] = identifier_el.text
-            inpt['data'] = text_type(value_el.text)
-            inpt['uom'] = value_el.attrib.get('uom', '')
-            inpt['datatype'] = value_el.attrib.get('datatype', '')
-            the_inputs[identifier].append(inpt)
-            continue
-
-        complex_data = xpath_ns(input_el, './wps:Data/wps:ComplexData')
-        if complex_data:
-
-            complex_data_el = complex_data[0]
-            inpt = {}
-            inpt['identifier'] = identifier_el.text
-            inpt['mimeType'] = complex_data_el.attrib.get('mimeType', '')
-            inpt['encoding'] = complex_data_el.attrib.get(
-                'encoding', '').lower()
-            inpt['schema'] = complex_data_el.attrib.get('schema', '')
-            inpt['method'] = complex_data_el.attrib.get('method', 'GET')
-            if len(complex_data_el.getchildren()) > 0:
-                value_el = complex_data_el[0]
-                inpt['data'] = _get_dataelement_value(value_el)
-            else:
-                inpt['data'] = _get_rawvalue_value(
-                    complex_data_el.text, inpt['encoding'])
-            the_inputs[identifier].append(inpt)
-            continue
-
-        reference_data = xpath_ns(input_el, './wps:Reference')
-        if reference_data:
-            reference_data_el = reference_data[0]
-            inpt = {}
-            inpt['identifier'] = identifier_el.text
-            inpt[identifier_el.text] = reference_data_el.text
-            inpt['href'] = reference_data_el.attrib.get(
-                '{http://www.w3.org/1999/xlink}href', '')
-            inpt['mimeType'] = reference_data_el.attrib.get('mimeType', '')
-            inpt['method'] = reference_data_el.attrib.get('method', 'GET')
-            header_element = xpath_ns(reference_data_el, './wps:Header')
-            if header_element:
-                inpt['header'] = _get_reference_header(header_element)
-            body_element = xpath_ns(reference_data_el, './wps:Body')
-            if body_element:
-                inpt['body'] = _get_reference_body(body_element[0])
-            bodyreference_element = xpath_ns(reference_data_el,
-                                             './wps:BodyReference')
-            if bodyreference_element:
-                inpt['bodyreference'] = _get_reference_bodyreference(
-                    bodyreference_element[0])
-            the_inputs[identifier].append(inpt)
-            continue
-
-        # OWSlib is not python 3 compatible yet
-        if PY2:
-            from owslib.ows import BoundingBox
-            bbox_datas = xpath_ns(input_el, './wps:Data/wps:BoundingBoxData')
-            if bbox_datas:
-                for bbox_data in bbox_datas:
-                    bbox_data_el = bbox_data
-                    bbox = BoundingBox(bbox_data_el)
-                    the_inputs[identifier].append(bbox)
+        _add_input_from_xml(input_el, the_inputs, decode_base64)
     return the_inputs
 
 
+def _add_input_from_xml(input_el, the_inputs, decode_base64, file_name=None):
+    """Add input of wps:Input element to the_inputs
+
+    :param file_name: file with content of inline complex data, which was
+                      removed from the element
+    """
+
+    [identifier_el] = xpath_ns(input_el, './ows:Identifier')
+    identifier = identifier_el.text
+
+    if identifier not in the_inputs:
+        the_inputs[identifier] = []
+
+    literal_data = xpath_ns(input_el, './wps:Data/wps:LiteralData')
+    if literal_data:
+        value_el = literal_data[0]
+        inpt = {}
+        inpt['identifier'] = identifier_el.text
+        inpt['data'] = text_type(value_el.text)
+        inpt['uom'] = value_el.attrib.get('uom', '')
+        inpt['datatype'] = value_el.attrib.get('datatype', '')
+        the_inputs[identifier].append(inpt)
+        return
+
+    complex_data = xpath_ns(input_el, './wps:Data/wps:ComplexData')
+    if complex_data:
+
+        complex_data_el = complex_data[0]
+        inpt = {}
+        inpt['identifier'] = identifier_el.text
+        inpt['mimeType'] = complex_data_el.attrib.get('mimeType', '')
+        inpt['encoding'] = complex_data_el.attrib.get(
+            'encoding', '').lower()
+        inpt['schema'] = complex_data_el.attrib.get('schema', '')
+        inpt['method'] = complex_data_el.attrib.get('method', 'GET')
+        if file_name is not None:
+            inpt['file'] = file_name
+        elif len(complex_data_el.getchildren()) > 0:
+            value_el = complex_data_el[0]
+            inpt['data'] = _get_dataelement_value(value_el)
+        elif inpt['encoding'] == 'base64' and not decode_base64:
+            inpt['base64'] = complex_data_el.text or ''
+        else:
+            inpt['data'] = _get_rawvalue_value(
+                complex_data_el.text, inpt['encoding'])
+        the_inputs[identifier].append(inpt)
+        return
+
+    reference_data = xpath_ns(input_el, './wps:Reference')
+    if reference_data:
+        reference_data_el = reference_data[0]
+        inpt = {}
+        inpt['identifier'] = identifier_el.text
+        inpt[identifier_el.text] = reference_data_el.text
+        inpt['href'] = reference_data_el.attrib.get(
+            '{http://www.w3.org/1999/xlink}href', '')
+        inpt['mimeType'] = reference_data_el.attrib.get('mimeType', '')
+        inpt['method'] = reference_data_el.attrib.get('method', 'GET')
+        header_element = xpath_ns(reference_data_el, './wps:Header')
+        if header_element:
+            inpt['header'] = _get_reference_header(header_element)
+        body_element = xpath_ns(reference_data_el, './wps:Body')
+        if body_element:
+            inpt['body'] = _get_reference_body(body_element[0])
+        bodyreference_element = xpath_ns(reference_data_el,
+                                         './wps:BodyReference')
+        if bodyreference_element:
+            inpt['bodyreference'] = _get_reference_bodyreference(
+                bodyreference_element[0])
+        the_inputs[identifier].append(inpt)
+        return
+
+    # OWSlib is not python 3 compatible yet
+    if PY2:
+        from owslib.ows import BoundingBox
+        bbox_datas = xpath_ns(input_el, './wps:Data/wps:BoundingBoxData')
+        if bbox_datas:
+            for bbox_data in bbox_datas:
+                bbox_data_el = bbox_data
+                bbox = BoundingBox(bbox_data_el)
+                the_inputs[identifier].append(bbox)
+
+
 def get_output_from_xml(doc):
     the_output = {}
 
@@ -628,6 +688,241 @@ def _get_rawvalue_value(data, encoding=None):
         return data
 
 
+class _RequestTarget(object):
+    """Parser target building document of POST request
+
+    Each wps:Input of Execute request is added to `inputs` as soon as it is
+    parsed and removed from the document, so that only one input is held in
+    memory at once. With `spool_dir`, content of inline complex data is not
+    held in memory at all, it is written to file in spool_dir while parsed
+    (XML content as it is, base64 encoded data decoded), the file names are
+    added to `spooled_files` and returned under `file` key of the inputs.
+    Other requests are built as they are.
+
+    :param decode_base64: see :func:`get_inputs_from_xml`
+    :param spool_dir: directory of files of inline complex data
+    """
+
+    def __init__(self, decode_base64=True, spool_dir=None):
+        self.decode_base64 = decode_base64
+        self.spool_dir = spool_dir
+        self.inputs = {}
+        self.spooled_files = []
+        self._builder = lxml.etree.TreeBuilder()
+        # tags and namespaces in scope of the open elements
+        self._path = []
+        self._nsmaps = [{}]
+        self._spool = None
+        self._file_name = None
+        self._closed = False
+
+    def start(self, tag, attrib, nsmap=None):
+        # default namespace has empty prefix in parser events
+        nsmap = dict((prefix or None, uri) for (prefix, uri) in (nsmap or {}).items())
+        if self._spool is not None:
+            self._spool.start(tag, attrib, nsmap)
+            return
+
+        self._path.append(tag)
+        self._nsmaps.append(_merge_nsmaps(self._nsmaps[-1], nsmap))
+        element = self._builder.start(tag, attrib, nsmap)
+        if self.spool_dir is not None and tuple(self._path) == _COMPLEX_DATA_PATH:
+            identifier = element.getparent().getparent().findtext(_IDENTIFIER_TAG)
+            self._spool = _ComplexDataSpool(
+                element.attrib.get('encoding', '').lower(), self._nsmaps[-1], self.spool_dir,
+                identifier, self.spooled_files)
+
+    def end(self, tag):
+        if self._spool is not None:
+            if self._spool.depth > 0:
+                self._spool.end()
+                return
+            (spool, self._spool) = (self._spool, None)
+            self._file_name = spool.close()
+
+        self._path.pop()
+        self._nsmaps.pop()
+        element = self._builder.end(tag)
+        if tuple(self._path) == _DATA_INPUTS_PATH and tag == _INPUT_TAG:
+            (file_name, self._file_name) = (self._file_name, None)
+            _add_input_from_xml(element, self.inputs, self.decode_base64, file_name)
+            element.getparent().remove(element)
+        elif not self._path:
+            self._closed = True
+
+    def data(self, data):
+        if self._spool is not None:
+            self._spool.data(data)
+        else:
+            self._builder.data(data)
+
+    def comment(self, text):
+        if self._spool is not None:
+            self._spool.write(lxml.etree.Comment(text))
+
+    def pi(self, target, data=None):
+        if self._spool is not None:
+            self._spool.write(lxml.etree.PI(target, data))
+
+    def close(self):
+        if self._spool is not None:
+            # parsing failed in complex data
+            self._spool.abort()
+            self._spool = None
+        if not self._closed:
+            # the parser raises its error
+            return None
+        return self._builder.close()
+
+
+_IDENTIFIER_TAG = OWS.Identifier().tag
+_INPUT_TAG = WPS.Input().tag
+_DATA_INPUTS_PATH = (WPS.Execute().tag, WPS.DataInputs().tag)
+_COMPLEX_DATA_PATH = _DATA_INPUTS_PATH + (_INPUT_TAG, WPS.Data().tag, WPS.ComplexData().tag)
+
+
+class _ComplexDataSpool(object):
+    """Writer of content of wps:ComplexData element to file, fed by parser
+    events
+
+    The first child element is written (without XML declaration), or the
+    text, if there is no child element.
+
+    :param encoding: encoding of the complex data
+    :param nsmap: namespaces in scope of the element
+    :param identifier: identifier of the input
+    :param spooled_files: list, to which the file is added, as soon as it is
+                          created
+    """
+
+    def __init__(self, encoding, nsmap, spool_dir, identifier, spooled_files):
+        self.encoding = encoding
+        self.nsmap = nsmap
+        self.spool_dir = spool_dir
+        self.identifier = identifier
+        self.spooled_files = spooled_files
+        self.file_name = None
+        self._file = None
+        self._decoder = Base64Decoder() if encoding == 'base64' else None
+        # leading white space and text of other encodings
+        self._text = []
+        self._has_text = False
+        self._xml_file = None
+        self._xml = None
+        self._elements = []
+        self._done = False
+        # depth of ignored elements after the first child
+        self._skipped = 0
+
+    @property
+    def depth(self):
+        """Depth of elements opened in the complex data"""
+
+        return len(self._elements) + self._skipped
+
+    def start(self, tag, attrib, nsmap):
+        if self._done or self._skipped:
+            self._skipped += 1
+            return
+
+        if not self._elements:
+            # text before the first child is not written
+            self._open()
+            self._file.seek(0)
+            self._file.truncate()
+            self._xml_file = lxml.etree.xmlfile(self._file, encoding='utf-8')
+            self._xml = self._xml_file.__enter__()
+            nsmap = _merge_nsmaps(self.nsmap, nsmap)
+        element = self._xml.element(tag, attrib, nsmap)
+        element.__enter__()
+        self._elements.append(element)
+
+    def end(self):
+        if self._skipped:
+            self._skipped -= 1
+            return
+
+        self._elements.pop().__exit__(None, None, None)
+        if not self._elements:
+            self._xml_file.__exit__(None, None, None)
+            self._xml_file = None
+            self._done = True
+
+    def data(self, data):
+        if self._elements:
+            self._xml.write(data)
+        elif self._done or self._skipped:
+            pass
+        elif self._has_text or data.strip():
+            self._has_text = True
+            self._write_text(data)
+        else:
+            self._text.append(data)
+
+    def write(self, node):
+        """Write comment or processing instruction"""
+
+        if self._elements:
+            self._xml.write(node)
+
+    def close(self):
+        """Finish the file, return its name or None, if the element was empty
+        """
+
+        try:
+            if self._file is None and self._text:
+                # only white space
+                self._has_text = True
+                self._write_text('')
+            if self._file is not None and not self._done and self._has_text:
+                if self._decoder is not None:
+                    self._file.write(self._decoded(self._decoder.flush))
+                elif self.encoding:
+                    data = _get_rawvalue_value(''.join(self._text), self.encoding)
+                    self._file.write(data.encode('utf-8') if isinstance(data, text_type) else data)
+        finally:
+            if self._file is not None:
+                self._file.close()
+        return self.file_name
+
+    def abort(self):
+        """Close the file, when parsing failed"""
+
+        if self._file is not None:
+            self._file.close()
+
+    def _open(self):
+        if self._file is None:
+            (opening, self.file_name) = tempfile.mkstemp(prefix='pywps_input_', dir=self.spool_dir)
+            self.spooled_files.append(self.file_name)
+            self._file = os.fdopen(opening, 'wb')
+
+    def _write_text(self, data):
+        self._open()
+        if self._text and (self._decoder is not None or not self.encoding):
+            data = ''.join(self._text) + data
+            self._text = []
+        if self._decoder is not None:
+            self._file.write(self._decoded(self._decoder.decode, data))
+        elif self.encoding:
+            # decoded by _get_rawvalue_value at the end
+            self._text.append(data)
+        else:
+            self._file.write(data.encode('utf-8'))
+
+    def _decoded(self, function, *args):
+        try:
+            return function(*args)
+        except (TypeError, ValueError):
+            # binascii.Error is ValueError, Python 2 raises TypeError
+            raise InvalidParameterValue('Invalid base64 encoded data', self.identifier)
+
+def _merge_nsmaps(nsmap, other):
+    merged = dict(nsmap)
+    merged.update(other)
+    return merged
+
+
 def _get_reference_header(header_element):
     """Parses ReferenceInput Header element
     """
@@ -6,15 +6,17 @@
 
 
 import os
-from lxml import etree
+import uuid
 import time
 from werkzeug.wrappers import Request
 from werkzeug.exceptions import HTTPException
 from pywps import WPS, OWS
-from pywps.app.basic import xml_response
+from pywps.app.basic import xml_response, xml_stream
 from pywps.exceptions import NoApplicableCode
+from pywps.inout.outputs import ComplexOutput
 import pywps.configuration as config
 from pywps.dblog import update_response
+from pywps._compat import replace
 from collections import namedtuple
 
 _STATUS = namedtuple('Status', 'ERROR_STATUS, NO_STATUS, STORE_STATUS,'
@@ -41,6 +43,8 @@ class WPSResponse(object):
         self.status_percentage = 0
         self.doc = None
         self.uuid = uuid
+        # (time, status, percentage) of the last written status document
+        self._status_written = None
 
     def update_status(self, message=None, status_percentage=None, status=None,
                       clean=True):
@@ -62,8 +66,10 @@ class WPSResponse(object):
         if status_percentage:
             self.status_percentage = status_percentage
 
-        # check if storing of the status is requested
-        if self.status >= STATUS.STORE_AND_UPDATE_STATUS:
+        # check if storing of the status is requested, outputs requested as
+        # raw data are sent without response document
+        if self.status >= STATUS.STORE_AND_UPDATE_STATUS and not self.wps_request.raw and \
+                self._status_changed():
 
             # rebuild the doc and update the status xml file
             self.doc = self._construct_doc()
@@ -71,19 +77,60 @@ class WPSResponse(object):
 
         update_response(self.uuid, self)
 
+    def _is_final(self):
+        return self.status >= STATUS.DONE_STATUS or self.status_percentage == -1
+
+    def _status_changed(self):
+        """Return True, if the status document should be written
+
+        Intermediate progress is written at most every `statusinterval`
+        seconds and only after it changed by `statusdelta` percents, the
+        first status, change of the status and the final status are always
+        written.
+        """
+
+        if self._status_written is None or self._is_final():
+            return True
+
+        (written_at, status, percentage) = self._status_written
+        if status != self.status:
+            return True
+
+        interval = float(config.get_config_value('server', 'statusinterval'))
+        delta = float(config.get_config_value('server', 'statusdelta'))
+        return time.time() - written_at >= interval and \
+            abs(self.status_percentage - percentage) >= delta
+
     def write_response_doc(self, doc, clean=True):
-        # TODO: check if file/directory is still present, maybe deleted in mean time
+        """Write status document to status location
+
+        The document is written to temporary file, which replaces the status
+        document, so that clients never read partially written document.
+        Only the final document is synced to the disk.
+        """
+
+        final = self._is_final()
+        self._status_written = (time.time(), self.status, self.status_percentage)
+        tmp_location = '{}.{}.tmp'.format(self.process.status_location, uuid.uuid4().hex)
 
         try:
-            with open(self.process.status_location, 'w') as f:
-                f.write(etree.tostring(doc, pretty_print=True, encoding='utf-8').decode('utf-8'))
-                f.flush()
-                os.fsync(f.fileno())
+            try:
+                with open(tmp_location, 'wb') as f:
+                    for block in xml_stream(doc):
+                        f.write(block)
+                    if final:
+                        f.flush()
+                        os.fsync(f.fileno())
+                replace(tmp_location, self.process.status_location)
+            except Exception:
+                if os.path.exists(tmp_location):
+                    os.remove(tmp_location)
+                raise
 
             if self.status >= STATUS.DONE_STATUS and clean:
                 self.process.clean()
 
-        except IOError as e:
+        except (IOError, OSError) as e:
             raise NoApplicableCode('Writing Response Document failed with : %s' % e)
 
     def _process_accepted(self):
@@ -195,8 +242,12 @@ class WPSResponse(object):
                 output_definitions = [self.outputs[o].execute_xml_lineage() for o in self.outputs]
                 doc.append(WPS.OutputDefinitions(*output_definitions))
 
-            # Process outputs XML
-            output_elements = [self.outputs[o].execute_xml() for o in self.outputs]
+            # Process outputs XML, files of complex outputs are copied to
+            # the document, when it is serialized
+            output_elements = [
+                self.outputs[o].execute_xml(stream=True) if isinstance(self.outputs[o], ComplexOutput)
+                else self.outputs[o].execute_xml()
+                for o in self.outputs]
             doc.append(WPS.ProcessOutputs(*output_elements))
         return doc
 
@@ -216,7 +267,8 @@ class WPSResponse(object):
         except Exception as exp:
             raise NoApplicableCode(exp)
 
+        response = xml_response(doc)
         if self.status >= STATUS.DONE_STATUS:
-            self.process.clean()
-
-        return xml_response(doc)
+            # files of the outputs are read, while the response is sent
+            response.call_on_close(self.process.clean)
+        return response
@@ -5,25 +5,154 @@
 ##################################################################
 
 
+import binascii
+import datetime
 import logging
+import os
+import re
 import lxml
 from werkzeug.wrappers import Response
+from werkzeug.wsgi import FileWrapper
 from pywps import __version__, NAMESPACES
+import pywps.configuration as config
 
 LOGGER = logging.getLogger('PYWPS')
 
+# size of the blocks, in which files are sent
+BLOCK_SIZE = 64 * 1024
+
+# processing instruction standing for content of file in the document
+_FILE_TARGET = 'pywps-file'
+_FILE_RE = re.compile(br'\s*<\?pywps-file (xml|text|base64) ([0-9a-f]+)\?>\s*')
+# XML declaration and document type of embedded XML document
+_PROLOG_RE = re.compile(br'^(\xef\xbb\xbf)?\s*(<\?xml[^>]*\?>)?\s*(<!DOCTYPE[^>\[]*>)?')
+
 
 def xpath_ns(el, path):
     return el.xpath(path, namespaces=NAMESPACES)
 
 
+def xml_serialize(doc):
+    """Serialize XML document to bytes, prefixed with PyWPS version comment"""
+
+    return b''.join(xml_stream(doc))
+
+
+def xml_stream(doc):
+    """Serialize XML document to blocks of bytes, prefixed with PyWPS version
+    comment
+
+    Placeholders created by :func:`file_placeholder` are replaced by content
+    of their files, which is copied in blocks, so that neither the tree of
+    the embedded document, nor the whole serialized document is held in
+    memory. The document is pretty printed according to `prettyprint`
+    configuration value.
+    """
+
+    yield ('<!-- PyWPS %s -->\n' % __version__).encode('utf8')
+
+    pretty_print = config.get_config_value('server', 'prettyprint') is not False
+    xml = lxml.etree.tostring(doc, pretty_print=pretty_print)
+    position = 0
+    for match in _FILE_RE.finditer(xml):
+        yield xml[position:match.start()]
+        file_name = binascii.unhexlify(match.group(2)).decode('utf-8')
+        for block in _iter_file(file_name, match.group(1).decode('ascii')):
+            yield block
+        position = match.end()
+    yield xml[position:]
+
+
+def file_placeholder(file_name, mode):
+    """Return processing instruction standing for content of the file in
+    document serialized by :func:`xml_stream`
+
+    :param mode: ``xml`` for XML document in UTF-8 or ASCII, which is
+                 embedded without its XML declaration, ``text`` for text
+                 in UTF-8, which is escaped, ``base64`` for any content,
+                 which is encoded in base64
+    """
+
+    file_name = binascii.hexlify(file_name.encode('utf-8')).decode('ascii')
+    return lxml.etree.ProcessingInstruction(_FILE_TARGET, '{} {}'.format(mode, file_name))
+
+
+def has_placeholders(doc):
+    """Return True, if XML document contains file placeholders"""
+
+    return bool(doc.xpath('//processing-instruction("{}")'.format(_FILE_TARGET)))
+
+
+def _iter_file(file_name, mode):
+    """Iterate over content of the file in blocks, formatted according to
+    the mode of :func:`file_placeholder`
+    """
+
+    if mode == 'base64':
+        # imported here, pywps.inout is not initialized yet, when this
+        # module is imported
+        from pywps.inout.basic import iter_base64_encoded
+        for block in iter_base64_encoded(file_name):
+            yield block
+        return
+
+    with open(file_name, 'rb') as f:
+        first = True
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            if mode == 'xml':
+                if first:
+                    block = _PROLOG_RE.sub(b'', block, count=1)
+            else:
+                block = block.replace(b'&', b'&amp;').replace(b'<', b'&lt;').replace(b'>', b'&gt;') \
+                    .replace(b'\r', b'&#13;')
+            first = False
+            yield block
+
+
 def xml_response(doc):
-    """XML response serializer"""
+    """XML response serializer
+
+    Documents with file placeholders are streamed, see :func:`xml_stream`.
+
+    :param doc: lxml element or already serialized document (bytes)
+    """
 
     LOGGER.debug('Serializing XML response')
-    pywps_version_comment = '<!-- PyWPS %s -->\n' % __version__
-    xml = lxml.etree.tostring(doc, pretty_print=True)
-    response = Response(pywps_version_comment.encode('utf8') + xml,
-                        content_type='text/xml')
+    if isinstance(doc, bytes):
+        xml = doc
+    elif has_placeholders(doc):
+        xml = xml_stream(doc)
+    else:
+        xml = xml_serialize(doc)
+    response = Response(xml, content_type='text/xml')
+    response.status_percentage = 100
+    return response
+
+
+def file_response(file_name, content_type, http_request=None):
+    """Response streaming content of the file
+
+    The file is sent in blocks of `BLOCK_SIZE`, it is never read to memory
+    as a whole. Byte ranges of GET requests are supported.
+
+    :param http_request: request of the client, the whole file is sent, if
+                         not given
+    """
+
+    stat = os.stat(file_name)
+    stream = open(file_name, 'rb')
+    try:
+        # functions registered by call_on_close are not called for direct
+        # passthrough responses, the blocks are passed through as they are
+        # anyway
+        response = Response(FileWrapper(stream, BLOCK_SIZE), content_type=content_type)
+        response.content_length = stat.st_size
+        response.last_modified = datetime.datetime.utcfromtimestamp(int(stat.st_mtime))
+        if http_request is not None:
+            # ranges are sent by seeking in the file
+            response.make_conditional(http_request, accept_ranges=True, complete_length=stat.st_size)
+    except Exception:
+        stream.close()
+        raise
     response.status_percentage = 100
     return response
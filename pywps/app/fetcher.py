@@ -0,0 +1,223 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Concurrent download of reference inputs
+
+References of one Execute request are downloaded by bounded number of
+threads (`referencethreads`), number of concurrent downloads from one host
+is limited by `referencehostlimit` for the whole server process.
+
+HTTP references are downloaded using one session of the server process,
+which keeps the connections to the data servers open between the requests
+and retries failed requests.
+"""
+
+import logging
+import os
+import sys
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import pywps.configuration as config
+from pywps.exceptions import FileSizeExceeded
+from pywps._compat import urlparse, queue
+
+LOGGER = logging.getLogger("PYWPS")
+
+# size of the blocks, in which references are downloaded
+CHUNK_SIZE = 64 * 1024
+
+# host: semaphore limiting concurrent downloads from the host
+_HOST_LIMITS = {}
+_HOST_LIMITS_LOCK = threading.Lock()
+
+_SESSION = None
+_SESSION_PID = None
+_SESSION_LOCK = threading.Lock()
+
+
+class Fetcher(object):
+    """Run download functions of reference inputs in pool of threads
+
+    Downloads start as soon as they are submitted, :meth:`wait` waits for
+    all of them and raises the exception of the first failed one (in order
+    of submission), as if they were run one by one. Downloads not started
+    before the first failure are skipped.
+
+    :param threads: maximal number of threads, `referencethreads` by
+                    default; with 1 the downloads run directly in
+                    :meth:`submit`
+    """
+
+    def __init__(self, threads=None):
+        if threads is None:
+            threads = int(config.get_config_value('server', 'referencethreads'))
+        self.max_threads = threads
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._submitted = 0
+        self._errors = []
+        self._lock = threading.Lock()
+        self._cancelled = False
+
+    def submit(self, href, function):
+        """Download reference
+
+        :param href: URL of the reference
+        :param function: function without arguments, which downloads it
+        """
+
+        if self.max_threads <= 1:
+            with _host_limit(href):
+                function()
+            return
+
+        self._tasks.put((self._submitted, href, function))
+        self._submitted += 1
+        if len(self._threads) < min(self.max_threads, self._submitted):
+            thread = threading.Thread(target=self._run, name='pywps-fetcher')
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def wait(self):
+        """Wait for all submitted downloads
+
+        :raises: exception of the first failed download
+        """
+
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self._errors:
+            (_, error) = min(self._errors, key=lambda index_error: index_error[0])
+            self._errors = []
+            raise error
+
+    def cancel(self):
+        """Skip downloads not started yet and wait for the running ones
+        """
+
+        self._cancelled = True
+        try:
+            self.wait()
+        except Exception:
+            pass
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            (index, href, function) = task
+            if self._cancelled or self._errors:
+                continue
+            try:
+                with _host_limit(href):
+                    function()
+            except Exception:
+                LOGGER.debug('Download of %s failed', href)
+                with self._lock:
+                    self._errors.append((index, sys.exc_info()[1]))
+
+
+def _host_limit(href):
+    """Return semaphore limiting concurrent downloads from host of href
+    """
+
+    host = urlparse(href or '').netloc
+    with _HOST_LIMITS_LOCK:
+        if host not in _HOST_LIMITS:
+            limit = int(config.get_config_value('server', 'referencehostlimit'))
+            _HOST_LIMITS[host] = threading.BoundedSemaphore(limit)
+        return _HOST_LIMITS[host]
+
+
+def get_session():
+    """Return HTTP session of the server process
+
+    Connections of the session are kept alive and reused by all downloads;
+    requests failed on connection errors or with 502, 503 and 504 status
+    are retried `referenceretries` times with exponential backoff.
+    """
+
+    global _SESSION
+    global _SESSION_PID
+
+    with _SESSION_LOCK:
+        # connections opened before fork of the server process belong to the
+        # parent
+        if _SESSION is None or _SESSION_PID != os.getpid():
+            retry = Retry(total=int(config.get_config_value('server', 'referenceretries')),
+                          backoff_factor=float(config.get_config_value('server', 'referencebackoff')),
+                          status_forcelist=(502, 503, 504))
+            # one pooled connection for each allowed concurrent download
+            adapter = HTTPAdapter(max_retries=retry,
+                                  pool_maxsize=int(config.get_config_value('server', 'referencehostlimit')))
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _SESSION = session
+            _SESSION_PID = os.getpid()
+
+    return _SESSION
+
+
+def get_timeout():
+    """Return timeout of connection to and of reading from data server
+    """
+
+    return float(config.get_config_value('server', 'referencetimeout'))
+
+
+def iter_content(reference_file):
+    """Iterate over content of the opened reference in chunks
+    """
+
+    if hasattr(reference_file, 'iter_content'):
+        return reference_file.iter_content(CHUNK_SIZE)
+    return iter(lambda: reference_file.read(CHUNK_SIZE), b'')
+
+
+def download(reference_file, file_name, max_bytes, hasher=None):
+    """Copy content of opened reference to given file in chunks
+
+    Download is aborted (and the partial file removed) as soon as it is
+    larger than max_bytes, or when the announced Content-Length is.
+
+    :param hasher: hashlib object updated with the content
+    :returns: size of the content
+    :raises FileSizeExceeded: the reference is larger than max_bytes
+    """
+
+    try:
+        data_size = int(reference_file.headers.get('Content-Length') or 0)
+        if data_size > max_bytes:
+            raise FileSizeExceeded('File size for input exceeded.')
+
+        size = 0
+        with open(file_name, 'wb') as f:
+            for chunk in iter_content(reference_file):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise FileSizeExceeded('File size for input exceeded.')
+                if hasher is not None:
+                    hasher.update(chunk)
+                f.write(chunk)
+    except Exception:
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        raise
+    finally:
+        reference_file.close()
+
+    return size
@@ -0,0 +1,143 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Pool of worker processes for asynchronous Execute requests
+
+Instead of starting new process for each asynchronous request, the request
+is serialized and sent to pool of long running worker processes. Workers
+keep their state (imported modules, opened data sets, ...) between
+requests; with `maxtasksperchild` configured, each worker is replaced by
+fresh one after given number of requests, so that memory leaks of the
+processes are bounded.
+
+Worker processes are forked from the server process, processes have to be
+registered using :func:`pywps.app.scheduler.register` before the pool is
+started.
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.pool
+import os
+
+import pywps.configuration as config
+from pywps import dblog
+
+LOGGER = logging.getLogger("PYWPS")
+
+_POOL = None
+_POOL_PID = None
+_IN_WORKER = False
+
+
+class _Process(multiprocessing.Process):
+    """Process, which is not forked during database access of another
+    thread
+    """
+
+    def start(self):
+        with dblog.FORK_LOCK.fork():
+            super(_Process, self).start()
+
+
+class _Pool(multiprocessing.pool.Pool):
+    """Pool forking its workers using :class:`_Process`
+
+    Workers are forked also by internal thread of the pool, when it
+    replaces finished ones.
+    """
+
+    def Process(self, *args, **kwds):
+        return _Process(*args, **kwds)
+
+
+def is_enabled():
+    """Return True, if asynchronous requests should run in the worker pool
+    """
+
+    return config.get_config_value('server', 'workerpool') is True
+
+
+def in_worker():
+    """Return True, if called from worker process of the pool
+    """
+
+    return _IN_WORKER
+
+
+def get_pool():
+    """Return pool of worker processes, start it if needed
+    """
+
+    global _POOL
+    global _POOL_PID
+
+    # pool started before fork of the server process can not be used
+    if _POOL is None or _POOL_PID != os.getpid():
+        processes = int(config.get_config_value('server', 'parallelprocesses'))
+        if processes < 1:
+            processes = None  # number of CPUs
+        maxtasks = int(config.get_config_value('server', 'maxtasksperchild'))
+        if maxtasks < 1:
+            maxtasks = None  # workers live as long as the pool
+
+        LOGGER.info('Starting pool of %s worker processes', processes or multiprocessing.cpu_count())
+        _POOL = _Pool(processes, initializer=_init_worker, maxtasksperchild=maxtasks)
+        _POOL_PID = os.getpid()
+
+    return _POOL
+
+
+def close():
+    """Stop accepting new jobs and wait for the running ones
+    """
+
+    global _POOL
+
+    if _POOL is not None and _POOL_PID == os.getpid():
+        _POOL.close()
+        _POOL.join()
+    _POOL = None
+
+
+def submit(function, job, callback=None):
+    """Run function with given job in the worker pool
+
+    :param function: module level function, which executes the job
+    :param job: picklable job description
+    :param callback: function called in this process, when the job is
+                     finished
+    """
+
+    get_pool().apply_async(function, (job,), callback=callback)
+
+
+def start_process(function, job):
+    """Run function with given job in new process
+
+    :param function: function, which executes the job
+    :param job: job description
+    """
+
+    process = _Process(target=function, args=(job,))
+    process.start()
+
+
+def _get_basedir():
+    return os.path.abspath(config.get_config_value('server', 'workdir'))
+
+
+def _init_worker():
+    global _IN_WORKER
+    _IN_WORKER = True
+    # locks of the logging handlers may be held by another thread of the
+    # server process at the moment of fork
+    for logger in [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values()):
+        for handler in getattr(logger, 'handlers', []):
+            handler.createLock()
+    # worker may be forked from server process running in working
+    # directory of some request, which will be removed
+    os.chdir(_get_basedir())
@@ -0,0 +1,280 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Local cache of HTTP reference inputs
+
+Downloaded references are stored in `referencecache` directory under hash
+of their content (``objects/``), the URLs point to the contents together
+with their validators and expiration (``urls/``), so that the same content
+referenced by more URLs is stored once.
+
+Cached reference is used without network access until it expires
+(`Cache-Control: max-age` or `Expires`), then it is revalidated using
+`ETag` / `Last-Modified`. Responses with `Cache-Control: no-store` or
+`private` are not cached. Least recently used contents are removed, when
+the cache grows over `referencecachesize`.
+
+Contents are handed to working directories of the processes by hard link,
+they are read-only and processes must not modify them.
+"""
+
+import calendar
+import email.utils
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import pywps.configuration as config
+from pywps.app.fetcher import download, get_session, get_timeout
+from pywps.exceptions import FileSizeExceeded
+from pywps._compat import urlparse, replace
+
+LOGGER = logging.getLogger("PYWPS")
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_cache():
+    """Return cache of reference inputs or None, if it is not configured
+    """
+
+    global _CACHE
+
+    directory = config.get_config_value('server', 'referencecache')
+    if not directory:
+        return None
+
+    with _CACHE_LOCK:
+        if _CACHE is None or _CACHE.directory != os.path.abspath(directory):
+            max_size = config.get_size_mb(config.get_config_value('server', 'referencecachesize'))
+            _CACHE = ReferenceCache(directory, int(max_size * 1024 * 1024))
+    return _CACHE
+
+
+def is_cacheable(datain):
+    """Return True, if given reference input can be served from cache
+    """
+
+    return datain.get('method', 'GET') == 'GET' and \
+        urlparse(datain.get('href') or '').scheme in ('http', 'https')
+
+
+class ReferenceCache(object):
+    """Content addressed cache of reference inputs
+
+    :param directory: directory of the cache
+    :param max_size: maximal size of the cached contents in bytes
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self._evict_lock = threading.Lock()
+        for name in ('objects', 'urls', 'tmp'):
+            _makedirs(os.path.join(self.directory, name))
+
+    def fetch(self, href, file_name, max_bytes):
+        """Store content of given URL to given file
+
+        :raises FileSizeExceeded: the content is larger than max_bytes
+        """
+
+        entry = self._load(href)
+        if entry is not None and entry['expires'] > time.time() and \
+                self._link(entry, file_name, max_bytes):
+            LOGGER.debug('Reference %s served from cache', href)
+            return
+
+        headers = {}
+        if entry is not None and os.path.isfile(self._get_object_path(entry['sha256'])):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = get_session().get(href, headers=headers, stream=True, timeout=get_timeout())
+        if response.status_code == 304 and headers:
+            response.close()
+            entry['expires'] = _get_expires(response.headers)
+            self._save(href, entry)
+            if self._link(entry, file_name, max_bytes):
+                LOGGER.debug('Reference %s revalidated', href)
+                return
+            # content was evicted in the meantime
+            response = get_session().get(href, stream=True, timeout=get_timeout())
+
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+
+        cache_control = _get_cache_control(response.headers)
+        expires = _get_expires(response.headers)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if 'no-store' in cache_control or 'private' in cache_control or \
+                not (etag or last_modified or expires > time.time()):
+            download(response, file_name, max_bytes)
+            return
+
+        tmp_file = os.path.join(self.directory, 'tmp', uuid.uuid4().hex)
+        hasher = hashlib.sha256()
+        size = download(response, tmp_file, max_bytes, hasher)
+
+        digest = hasher.hexdigest()
+        object_path = self._get_object_path(digest)
+        _makedirs(os.path.dirname(object_path))
+        if os.path.exists(object_path):
+            os.remove(tmp_file)
+        else:
+            os.chmod(tmp_file, 0o444)
+            replace(tmp_file, object_path)
+
+        entry = {
+            'url': href,
+            'sha256': digest,
+            'size': size,
+            'etag': etag,
+            'last_modified': last_modified,
+            'expires': expires
+        }
+        self._save(href, entry)
+        if not self._link(entry, file_name, max_bytes):
+            raise IOError('Cached reference %s was removed' % href)
+        self._evict()
+
+    def _link(self, entry, file_name, max_bytes):
+        """Hand cached content to given file, return False, if the content
+        is not in the cache
+        """
+
+        object_path = self._get_object_path(entry['sha256'])
+        try:
+            size = os.path.getsize(object_path)
+        except OSError:
+            return False
+        if size > max_bytes:
+            raise FileSizeExceeded('File size for input exceeded.')
+
+        if os.path.exists(file_name):
+            os.remove(file_name)
+        try:
+            os.link(object_path, file_name)
+        except (OSError, AttributeError):
+            # different file system or no hard links
+            try:
+                shutil.copyfile(object_path, file_name)
+            except (IOError, OSError):
+                return False
+
+        try:
+            # mark the content as recently used
+            os.utime(object_path, None)
+        except OSError:
+            pass
+        return True
+
+    def _evict(self):
+        """Remove least recently used contents over the size limit
+        """
+
+        if not self._evict_lock.acquire(False):
+            return
+        try:
+            objects = []
+            total = 0
+            for (dirpath, _, filenames) in os.walk(os.path.join(self.directory, 'objects')):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    objects.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            for (_, size, path) in sorted(objects):
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        finally:
+            self._evict_lock.release()
+
+    def _get_object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def _get_url_path(self, href):
+        digest = hashlib.sha256(href.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'urls', digest + '.json')
+
+    def _load(self, href):
+        try:
+            with open(self._get_url_path(href)) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if entry.get('url') != href:
+            return None
+        return entry
+
+    def _save(self, href, entry):
+        url_path = self._get_url_path(href)
+        tmp_file = os.path.join(self.directory, 'tmp', uuid.uuid4().hex)
+        with open(tmp_file, 'w') as f:
+            json.dump(entry, f)
+        replace(tmp_file, url_path)
+
+
+def _get_cache_control(headers):
+    """Return dictionary of Cache-Control directives
+    """
+
+    directives = {}
+    for directive in headers.get('Cache-Control', '').split(','):
+        (name, _, value) = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = value.strip('"')
+    return directives
+
+
+def _get_expires(headers):
+    """Return time (seconds since epoch), until which the response is fresh
+    """
+
+    now = time.time()
+    cache_control = _get_cache_control(headers)
+    if 'no-cache' in cache_control:
+        return now
+    if 'max-age' in cache_control:
+        try:
+            return now + int(cache_control['max-age']) - int(headers.get('Age') or 0)
+        except ValueError:
+            return now
+    if headers.get('Expires'):
+        expires = email.utils.parsedate(headers['Expires'])
+        if expires:
+            return calendar.timegm(expires)
+    return now
+
+
+def _makedirs(directory):
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
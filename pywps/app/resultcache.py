@@ -0,0 +1,260 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Cache of results of deterministic processes
+
+Outputs of processes created with `cache_ttl` are stored in `resultcache`
+directory under key computed from identifier and version of the process,
+values of literal and bounding box inputs, hashes of contents of complex
+inputs and from the requested outputs. Execute request with the same key
+gets the stored outputs, without invoking the handler of the process, for
+`cache_ttl` seconds. The oldest results are removed, when the cache grows
+over `resultcachesize`.
+
+Each result is a directory with ``result.json`` describing the outputs and
+with files of the complex outputs.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import pywps.configuration as config
+from pywps.inout import basic
+from pywps.inout.formats import Format
+from pywps._compat import text_type
+
+LOGGER = logging.getLogger("PYWPS")
+
+_EVICT_LOCK = threading.Lock()
+
+
+def get_key(process, wps_request):
+    """Return cache key of the Execute request of given process
+
+    :param process: :class:`pywps.app.Process.Process`
+    :param wps_request: :class:`pywps.app.WPSRequest.WPSRequest` with parsed
+                        inputs
+    """
+
+    inputs = []
+    for identifier in sorted(wps_request.inputs or {}):
+        inputs.append([identifier, [_describe_input(inpt) for inpt in wps_request.inputs[identifier]]])
+
+    key = {
+        'identifier': process.identifier,
+        'version': process.version,
+        'inputs': inputs,
+        'outputs': wps_request.outputs or {}
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def load(key, process):
+    """Set outputs of the process from the cache
+
+    :returns: True, if the result was found
+    """
+
+    result_dir = _get_result_dir(key)
+    try:
+        with open(os.path.join(result_dir, 'result.json')) as f:
+            result = json.load(f)
+    except (IOError, OSError, ValueError):
+        return False
+
+    if result['expires'] < time.time():
+        LOGGER.debug('Cached result %s expired', key)
+        shutil.rmtree(result_dir, ignore_errors=True)
+        return False
+
+    try:
+        for outpt in process.outputs:
+            if outpt.identifier in result['outputs']:
+                _restore_output(outpt, result['outputs'][outpt.identifier], result_dir)
+        # mark the result as recently used
+        os.utime(os.path.join(result_dir, 'result.json'), None)
+    except (IOError, OSError):
+        # evicted in the meantime
+        return False
+
+    LOGGER.info('Outputs of process %s taken from cache', process.identifier)
+    return True
+
+
+def store(key, process, ttl):
+    """Store outputs of the process to the cache for ttl seconds
+    """
+
+    cache_dir = _get_cache_dir()
+    tmp_dir = tempfile.mkdtemp(prefix='tmp', dir=cache_dir)
+    try:
+        outputs = {}
+        for outpt in process.outputs:
+            if outpt.source_type is not None:
+                outputs[outpt.identifier] = _save_output(outpt, tmp_dir)
+
+        with open(os.path.join(tmp_dir, 'result.json'), 'w') as f:
+            json.dump({
+                'identifier': process.identifier,
+                'expires': time.time() + ttl,
+                'outputs': outputs
+            }, f)
+
+        result_dir = _get_result_dir(key)
+        if os.path.isdir(result_dir):
+            # replace expired result
+            shutil.rmtree(result_dir, ignore_errors=True)
+        os.rename(tmp_dir, result_dir)
+    except (IOError, OSError) as e:
+        # the same result was stored concurrently, or the cache is not
+        # writable - the request is answered anyway
+        LOGGER.warning('Storing result of process %s to cache failed: %s', process.identifier, e)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return
+
+    _evict(cache_dir)
+
+
+def _describe_input(inpt):
+    """Return JSON serializable description of input value
+    """
+
+    if isinstance(inpt, basic.ComplexInput):
+        hasher = hashlib.sha256()
+        with open(inpt.file, 'rb') as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                hasher.update(chunk)
+        return {
+            'sha256': hasher.hexdigest(),
+            'format': [inpt.data_format.mime_type, inpt.data_format.encoding, inpt.data_format.schema]
+        }
+    elif isinstance(inpt, basic.BBoxInput):
+        return {'data': inpt.data, 'crs': inpt.crs}
+    else:
+        return {'data': text_type(inpt.data), 'uom': _get_uom(inpt.uom)}
+
+
+def _save_output(outpt, result_dir):
+    """Save value of the output to the result directory, return its
+    JSON description
+    """
+
+    if isinstance(outpt, basic.ComplexOutput):
+        file_name = outpt.file
+        if outpt.source_type == basic.SOURCE_TYPE.STREAM:
+            # the stream is consumed now
+            outpt.file = file_name
+        _link(file_name, os.path.join(result_dir, outpt.identifier))
+        return {
+            'type': 'complex',
+            'file': os.path.basename(file_name),
+            'data_format': outpt.data_format.json if outpt.data_format else None
+        }
+    elif isinstance(outpt, basic.BBoxInput):
+        return {'type': 'bbox', 'data': outpt.data, 'crs': outpt.crs}
+    else:
+        # literal values are converted back by data type of the output
+        return {'type': 'literal', 'data': text_type(outpt.data), 'uom': _get_uom(outpt.uom)}
+
+
+def _restore_output(outpt, value, result_dir):
+    """Set output from its JSON description
+    """
+
+    if value['type'] == 'complex':
+        if value['data_format']:
+            data_format = Format(
+                value['data_format']['mime_type'],
+                schema=value['data_format'].get('schema'),
+                encoding=value['data_format'].get('encoding'),
+                extension=value['data_format'].get('extension'))
+            if outpt._is_supported(data_format):
+                outpt.data_format = data_format
+        file_name = os.path.join(outpt.workdir, value['file'])
+        _link(os.path.join(result_dir, outpt.identifier), file_name)
+        outpt.file = file_name
+    elif value['type'] == 'bbox':
+        outpt.data = value['data']
+        outpt.crs = value['crs']
+    else:
+        outpt.data = value['data']
+        for uom in outpt.uoms:
+            if uom.uom == value['uom']:
+                outpt.uom = uom
+
+
+def _evict(cache_dir):
+    """Remove expired results and the least recently used ones over the
+    size limit
+    """
+
+    if not _EVICT_LOCK.acquire(False):
+        return
+    try:
+        max_size = config.get_size_mb(config.get_config_value('server', 'resultcachesize')) * 1024 * 1024
+        results = []
+        total = 0
+        for name in os.listdir(cache_dir):
+            result_dir = os.path.join(cache_dir, name)
+            try:
+                with open(os.path.join(result_dir, 'result.json')) as f:
+                    expires = json.load(f)['expires']
+                used = os.path.getmtime(os.path.join(result_dir, 'result.json'))
+                size = sum(os.path.getsize(os.path.join(result_dir, file_name))
+                           for file_name in os.listdir(result_dir))
+            except (IOError, OSError, ValueError):
+                # result being stored
+                continue
+            if expires < time.time():
+                shutil.rmtree(result_dir, ignore_errors=True)
+                continue
+            results.append((used, size, result_dir))
+            total += size
+
+        for (_, size, result_dir) in sorted(results):
+            if total <= max_size:
+                break
+            shutil.rmtree(result_dir, ignore_errors=True)
+            total -= size
+    finally:
+        _EVICT_LOCK.release()
+
+
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except (OSError, AttributeError):
+        shutil.copyfile(source, target)
+
+
+def _get_uom(uom):
+    if isinstance(uom, basic.UOM):
+        return uom.uom
+    return uom
+
+
+def _get_result_dir(key):
+    return os.path.join(_get_cache_dir(), key)
+
+
+def _get_cache_dir():
+    cache_dir = config.get_config_value('server', 'resultcache')
+    if not cache_dir:
+        cache_dir = os.path.join(config.get_config_value('server', 'workdir'), 'pywps_results')
+    cache_dir = os.path.abspath(cache_dir)
+    try:
+        os.makedirs(cache_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    return cache_dir
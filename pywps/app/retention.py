@@ -0,0 +1,221 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Removal of old outputs, status documents and working directories
+
+Outputs (``outputpath/<uuid>/``) and status documents
+(``outputpath/<uuid>.xml``) of one request are removed together, when they
+were not accessed for `outputretention` days, and the least recently
+accessed ones are removed, while `outputpath` is larger than
+`outputmaxsize`. Working directories (``workdir/pywps_process_*``) and
+inline inputs (``workdir/pywps_input_*``) left behind by killed processes
+are removed after `workdirretention` hours.
+
+Files of requests, which are running or waiting in the queue according to
+the logging database, are never removed.
+
+Removal runs every `retentioninterval` seconds in a background thread of
+the server process, or from command line::
+
+    python -m pywps.app.retention -c pywps.cfg [--dry-run]
+"""
+
+from __future__ import print_function
+
+import logging
+import os
+import re
+import shutil
+import stat
+import threading
+import time
+
+import pywps.configuration as config
+from pywps import dblog
+
+LOGGER = logging.getLogger("PYWPS")
+
+_OUTPUT_RE = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})(\.xml)?$')
+_WORKDIR_RE = re.compile(r'^pywps_(?:process_(?:([0-9a-f-]{36})_)?|input_)')
+
+_THREAD = None
+_THREAD_PID = None
+_THREAD_LOCK = threading.Lock()
+
+
+def collect(dry_run=False):
+    """Remove expired outputs, status documents and working directories
+
+    :param dry_run: only report, what would be removed
+    :returns: tuple (list of removed paths, number of freed bytes)
+    """
+
+    now = time.time()
+    active = dblog.get_active()
+    removed = []
+    freed = 0
+
+    retention = float(config.get_config_value('server', 'outputretention')) * 86400
+    max_size = config.get_size_mb(config.get_config_value('server', 'outputmaxsize')) * 1024 * 1024
+    if retention > 0 or max_size > 0:
+        outputs = []
+        total = 0
+        for (request_uuid, (accessed, size, paths)) in _get_outputs().items():
+            if request_uuid in active:
+                continue
+            if retention > 0 and accessed < now - retention:
+                removed.extend(paths)
+                freed += size
+            else:
+                outputs.append((accessed, size, paths))
+                total += size
+
+        if max_size > 0:
+            for (_, size, paths) in sorted(outputs):
+                if total <= max_size:
+                    break
+                removed.extend(paths)
+                freed += size
+                total -= size
+
+    retention = float(config.get_config_value('server', 'workdirretention')) * 3600
+    if retention > 0:
+        workdir = os.path.abspath(config.get_config_value('server', 'workdir'))
+        for name in _listdir(workdir):
+            match = _WORKDIR_RE.match(name)
+            path = os.path.join(workdir, name)
+            if not match or match.group(1) in active:
+                continue
+            (accessed, size) = _get_usage(path)
+            if accessed < now - retention:
+                removed.append(path)
+                freed += size
+
+    if not dry_run:
+        for path in removed:
+            LOGGER.debug('Removing expired %s', path)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        if removed:
+            LOGGER.info('Removed %s expired outputs and working directories, %s bytes', len(removed), freed)
+
+    return (removed, freed)
+
+
+def start():
+    """Start background thread removing expired files every
+    `retentioninterval` seconds, if any retention is configured
+
+    The thread is started once in each server process.
+    """
+
+    global _THREAD
+    global _THREAD_PID
+
+    if not _is_enabled():
+        return
+
+    with _THREAD_LOCK:
+        # threads do not survive fork
+        if _THREAD is not None and _THREAD_PID == os.getpid():
+            return
+        _THREAD = threading.Thread(target=_run, name='pywps-retention')
+        _THREAD.daemon = True
+        _THREAD_PID = os.getpid()
+        _THREAD.start()
+
+
+def _run():
+    while True:
+        try:
+            collect()
+        except Exception:
+            LOGGER.exception('Removal of expired outputs failed')
+        time.sleep(float(config.get_config_value('server', 'retentioninterval')))
+
+
+def _is_enabled():
+    return float(config.get_config_value('server', 'outputretention')) > 0 or \
+        config.get_size_mb(config.get_config_value('server', 'outputmaxsize')) > 0 or \
+        float(config.get_config_value('server', 'workdirretention')) > 0
+
+
+def _get_outputs():
+    """Return outputs and status documents in outputpath
+
+    :returns: dictionary uuid: (last access, size, list of paths)
+    """
+
+    outputpath = os.path.abspath(config.get_config_value('server', 'outputpath'))
+    outputs = {}
+    for name in _listdir(outputpath):
+        match = _OUTPUT_RE.match(name)
+        if not match:
+            continue
+        path = os.path.join(outputpath, name)
+        (accessed, size) = _get_usage(path)
+        (last_accessed, total, paths) = outputs.get(match.group(1), (0, 0, []))
+        outputs[match.group(1)] = (max(accessed, last_accessed), total + size, paths + [path])
+    return outputs
+
+
+def _get_usage(path):
+    """Return time of the last access and size of the file or directory
+
+    Access time is not updated on file systems mounted with noatime, the
+    modification time is taken then.
+    """
+
+    accessed = 0
+    size = 0
+    for file_name in _walk(path):
+        try:
+            file_stat = os.stat(file_name)
+        except OSError:
+            continue
+        accessed = max(accessed, file_stat.st_atime, file_stat.st_mtime)
+        if not stat.S_ISDIR(file_stat.st_mode):
+            size += file_stat.st_size
+    return (accessed, size)
+
+
+def _walk(path):
+    yield path
+    if os.path.isdir(path):
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            for name in dirnames + filenames:
+                yield os.path.join(dirpath, name)
+
+
+def _listdir(folder):
+    try:
+        return os.listdir(folder)
+    except OSError:
+        return []
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Remove expired PyWPS outputs and working directories')
+    parser.add_argument('-c', '--config', action='append', help='PyWPS configuration file')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only print, what would be removed')
+    args = parser.parse_args(argv)
+
+    config.load_configuration(args.config)
+    (removed, freed) = collect(args.dry_run)
+    for path in removed:
+        print(path)
+    print('%s %i paths, %i bytes' % ('Would remove' if args.dry_run else 'Removed', len(removed), freed))
+
+
+if __name__ == '__main__':
+    main()
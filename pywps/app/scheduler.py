@@ -0,0 +1,224 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Scheduler of asynchronous Execute requests
+
+Asynchronous requests are put into queue in the logging database (see
+:class:`pywps.dblog.RequestInstance`) and started, as soon as number of
+running processes is below `parallelprocesses`. Requests are started in
+order of priority of the process and time, when they were queued.
+
+Request is claimed by the process executing it (atomic conditional UPDATE)
+for `leasetime` seconds, the lease is renewed with each status update. When
+the executing process dies, its request is returned to the queue - either
+when the lease expires, or immediately, when the process was running on the
+same host.
+
+New requests are dispatched whenever a request is queued and whenever some
+request finishes. The queue is shared by all processes using the same
+database, so the database must not be the in-memory one, if more server
+processes are used.
+"""
+
+import errno
+import json
+import logging
+import os
+import socket
+import tempfile
+
+import pywps.configuration as config
+from pywps import dblog
+from pywps.app import pool
+from pywps.app.WPSRequest import WPSRequest
+from pywps.app.WPSResponse import WPSResponse, STATUS
+from pywps.exceptions import ServerBusy
+from pywps._compat import PY2
+
+LOGGER = logging.getLogger("PYWPS")
+
+# processes known to the scheduler, identifier: process
+_PROCESSES = {}
+
+
+def register(processes):
+    """Register processes, which can be executed by the scheduler
+
+    Processes have to be registered before the worker pool is started.
+
+    :param processes: list of :class:`pywps.app.Process.Process`
+    """
+
+    for process in processes:
+        _PROCESSES[process.identifier] = process
+
+
+def enqueue(process, wps_request):
+    """Put request into the queue
+
+    :param process: :class:`pywps.app.Process.Process` instance with uuid
+                    and workdir set
+    :param wps_request: :class:`pywps.app.WPSRequest.WPSRequest`
+    """
+
+    maxprocesses = int(config.get_config_value('server', 'maxprocesses'))
+
+    if dblog.count_stored() >= maxprocesses:
+        raise ServerBusy('Maximum number of parallel running processes reached. Please try later.')
+
+    dblog.store_process(process.uuid, wps_request, process.workdir, process.priority)
+
+
+def dispatch():
+    """Start queued requests, while there are free slots
+    """
+
+    for job in _claim_jobs():
+        _start(job)
+
+
+def run_job(job):
+    """Execute queued request
+
+    :param job: tuple (uuid, workdir, request json)
+    """
+
+    (uuid, workdir, request_json) = job
+
+    try:
+        dblog.renew_lease(uuid, _get_owner(os.getpid()), int(config.get_config_value('server', 'leasetime')))
+
+        wps_request = WPSRequest()
+        wps_request.json = json.loads(request_json)
+        process = _PROCESSES[wps_request.identifier].new_instance()
+
+        if not workdir or not os.path.isdir(workdir):
+            workdir = tempfile.mkdtemp(prefix='pywps_process_{}_'.format(uuid), dir=_get_basedir())
+        process.set_workdir(workdir)
+        process._set_uuid(uuid)
+        process.async = True
+
+        for outpt in process.outputs:
+            if outpt.identifier in wps_request.outputs:
+                is_reference = wps_request.outputs[outpt.identifier].get('asReference', 'false')
+                outpt.as_reference = is_reference.lower() == 'true'
+
+        wps_response = WPSResponse(process, wps_request, uuid)
+        wps_response.status = STATUS.STORE_AND_UPDATE_STATUS
+
+        if config.get_config_value('server', 'threadsafe') is True:
+            process._run_process(wps_request, wps_response)
+        else:
+            try:
+                os.chdir(process.workdir)
+                process._run_process(wps_request, wps_response)
+            finally:
+                # working directory of the process is removed by now
+                os.chdir(_get_basedir())
+    except Exception:
+        # there is nobody to report the error to
+        LOGGER.exception('Request %s failed', uuid)
+    finally:
+        dblog.remove_stored(uuid)
+
+    if pool.in_worker():
+        # next requests are claimed by the worker, so that the server process
+        # only hands them over to the pool, see _job_done
+        return _claim_jobs()
+
+
+def _claim_jobs():
+    """Claim queued requests, which fit into free slots
+
+    :returns: list of jobs (uuid, workdir, request json)
+    """
+
+    maxparallel = int(config.get_config_value('server', 'parallelprocesses'))
+    lease = int(config.get_config_value('server', 'leasetime'))
+    if pool.in_worker():
+        # claimed requests are started by the server process
+        owner = _get_owner(os.getppid())
+    else:
+        owner = _get_owner(os.getpid())
+
+    _requeue_dead()
+
+    jobs = []
+    while maxparallel == -1 or dblog.count_running() < maxparallel:
+        stored_request = dblog.claim_stored(owner, lease)
+        if stored_request is None:
+            break
+
+        request_json = stored_request.request
+        if not PY2:
+            request_json = request_json.decode('utf-8')
+        jobs.append((stored_request.uuid, stored_request.workdir, request_json))
+
+    return jobs
+
+
+def _start(job):
+    """Start claimed request in the worker pool or in new process
+    """
+
+    LOGGER.debug('Starting queued request %s', job[0])
+    if pool.is_enabled():
+        pool.submit(run_job, job, callback=_job_done)
+    else:
+        pool.start_process(_run_and_dispatch, job)
+
+
+def _run_and_dispatch(job):
+    """Execute queued request in separate process and start next one
+    """
+
+    run_job(job)
+    dispatch()
+
+
+def _job_done(jobs):
+    """Called by the worker pool, when the job is finished, with list of
+    requests claimed by the worker
+
+    It runs in thread of the pool, which must not use the database: worker
+    processes may be forked from the pool in the meantime and SQLite does
+    not survive fork with locks held by another thread.
+    """
+
+    for job in jobs:
+        _start(job)
+
+
+def _requeue_dead():
+    """Return requests claimed by processes, which died, back to the queue
+
+    Only processes running on this host can be checked, requests of the
+    other hosts are returned to the queue, when their lease expires.
+    """
+
+    hostname = socket.gethostname()
+    for stored_request in dblog.get_claimed():
+        (host, _, pid) = stored_request.lease_owner.rpartition(':')
+        if host == hostname and not _is_alive(int(pid)):
+            LOGGER.warning('Process %s executing request %s died, returning request to the queue',
+                           pid, stored_request.uuid)
+            dblog.requeue(stored_request.uuid, stored_request.lease_owner)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno != errno.ESRCH
+    return True
+
+
+def _get_owner(pid):
+    return '%s:%s' % (socket.gethostname(), pid)
+
+
+def _get_basedir():
+    return os.path.abspath(config.get_config_value('server', 'workdir'))
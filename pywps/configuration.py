@@ -25,6 +25,7 @@ __author__ = "Calin Ciociu"
 RAW_OPTIONS = [('logging', 'format'), ]
 
 CONFIG = None
+_GENERATION = 0
 LOGGER = logging.getLogger("PYWPS")
 
 
@@ -57,6 +58,21 @@ def get_config_value(section, option):
     return value
 
 
+def get_config_generation():
+    """Get number of times the configuration has been loaded. Objects
+    derived from configuration values can compare it to find out, whether
+    they are outdated.
+
+    :returns: configuration generation
+    :rtype: int
+    """
+
+    if not CONFIG:
+        load_configuration()
+
+    return _GENERATION
+
+
 def load_configuration(cfgfiles=None):
     """Load PyWPS configuration from configuration files.
     The later configuration file in the array overwrites configuration
@@ -66,8 +82,10 @@ def load_configuration(cfgfiles=None):
     """
 
     global CONFIG
+    global _GENERATION
 
     LOGGER.info('loading configuration')
+    _GENERATION += 1
     if PY2:
         CONFIG = ConfigParser.SafeConfigParser()
     else:
@@ -81,6 +99,41 @@ def load_configuration(cfgfiles=None):
     CONFIG.set('server', 'maxprocesses', '30')
     CONFIG.set('server', 'maxsingleinputsize', '1mb')
     CONFIG.set('server', 'maxrequestsize', '3mb')
+    # Reference inputs of one request are downloaded by referencethreads
+    # threads, at most referencehostlimit downloads run concurrently from one
+    # host.
+    CONFIG.set('server', 'referencethreads', '4')
+    CONFIG.set('server', 'referencehostlimit', '4')
+    # References are downloaded with referencetimeout seconds timeout, failed
+    # downloads are retried referenceretries times, with exponential backoff
+    # starting at referencebackoff seconds.
+    CONFIG.set('server', 'referencetimeout', '30')
+    CONFIG.set('server', 'referenceretries', '3')
+    CONFIG.set('server', 'referencebackoff', '0.5')
+    # HTTP references are cached in referencecache directory (disabled, if
+    # empty), least recently used ones are removed over referencecachesize.
+    CONFIG.set('server', 'referencecache', '')
+    CONFIG.set('server', 'referencecachesize', '1gb')
+    # Results of processes with cache_ttl are cached in resultcache
+    # directory (pywps_results in workdir, if empty), the oldest ones are
+    # removed over resultcachesize.
+    CONFIG.set('server', 'resultcache', '')
+    CONFIG.set('server', 'resultcachesize', '100mb')
+    # Free space in outputpath is read at most every storagerefresh seconds,
+    # in the meantime it is estimated from the stored outputs.
+    CONFIG.set('server', 'storagerefresh', '10')
+    # Reference outputs are stored by storage registered under storagetype
+    # name ('file' or 's3') or by class given by its dotted path.
+    CONFIG.set('server', 'storagetype', 'file')
+    # Outputs and status documents not accessed for outputretention days are
+    # removed, as well as the least recently accessed ones over
+    # outputmaxsize, working directories of dead processes are removed after
+    # workdirretention hours. Checked every retentioninterval seconds, 0
+    # disables the removal.
+    CONFIG.set('server', 'outputretention', '0')
+    CONFIG.set('server', 'outputmaxsize', '0')
+    CONFIG.set('server', 'workdirretention', '0')
+    CONFIG.set('server', 'retentioninterval', '3600')
     CONFIG.set('server', 'temp_path', tempfile.gettempdir())
     CONFIG.set('server', 'processes_path', '')
     outputpath = tempfile.gettempdir()
@@ -88,15 +141,52 @@ def load_configuration(cfgfiles=None):
     CONFIG.set('server', 'outputpath', outputpath)
     CONFIG.set('server', 'workdir', tempfile.gettempdir())
     CONFIG.set('server', 'parallelprocesses', '2')
+    # If this flag is enabled, asynchronous requests are executed by pool of
+    # parallelprocesses worker processes instead of new process for each
+    # request. Each worker is replaced after maxtasksperchild requests
+    # (0 for no limit).
+    CONFIG.set('server', 'workerpool', 'false')
+    CONFIG.set('server', 'maxtasksperchild', '0')
+    # Queued request is claimed by the process executing it for leasetime
+    # seconds, the lease is renewed with each status update. Requests with
+    # expired lease are executed again.
+    CONFIG.set('server', 'leasetime', '3600')
+    # Intermediate status documents of asynchronous requests are written at
+    # most every statusinterval seconds and only when the progress changed
+    # by statusdelta percents.
+    CONFIG.set('server', 'statusinterval', '0')
+    CONFIG.set('server', 'statusdelta', '0')
+    # Inline complex inputs of Execute requests are stored to files in
+    # workdir while the request is parsed, when spoolinputs is enabled.
+    CONFIG.set('server', 'spoolinputs', 'true')
+    # XML documents are indented, when prettyprint is enabled.
+    CONFIG.set('server', 'prettyprint', 'true')
     # If this flag is enabled it will set the HOME environment
     # for each process to its current workdir (a temp folder).
     CONFIG.set('server', 'sethomedir', 'false')
+    # If this flag is enabled, PyWPS does not change current working
+    # directory nor environment variables of the server process, so that
+    # more requests can be executed in threads of one process.
+    CONFIG.set('server', 'threadsafe', 'false')
 
     CONFIG.add_section('logging')
     CONFIG.set('logging', 'file', '')
     CONFIG.set('logging', 'level', 'DEBUG')
     CONFIG.set('logging', 'database', 'sqlite:///:memory:')
     CONFIG.set('logging', 'prefix', 'pywps_')
+    # Connections to the database are kept open in pool of db_pool_size
+    # connections, up to db_max_overflow more are opened under load.
+    # db_echo logs all SQL statements.
+    CONFIG.set('logging', 'db_pool_size', '5')
+    CONFIG.set('logging', 'db_max_overflow', '10')
+    CONFIG.set('logging', 'db_echo', 'false')
+    # Intermediate status updates of running requests are written to the
+    # database in batches every db_flush_interval seconds (0 writes each
+    # update immediately).
+    CONFIG.set('logging', 'db_flush_interval', '0')
+    # Requests finished more than db_retention days ago are moved to the
+    # archive table (0 keeps all requests).
+    CONFIG.set('logging', 'db_retention', '0')
     CONFIG.set('logging', 'format', '%(asctime)s] [%(levelname)s] file=%(pathname)s line=%(lineno)s module=%(module)s function=%(funcName)s %(message)s')  # noqa
 
     CONFIG.add_section('metadata:main')
@@ -126,6 +216,19 @@ def load_configuration(cfgfiles=None):
     CONFIG.add_section('grass')
     CONFIG.set('grass', 'gisbase', '')
 
+    # S3 compatible object store used with storagetype = s3, files larger
+    # than part_size are uploaded in parts, upload_threads at once.
+    CONFIG.add_section('s3')
+    CONFIG.set('s3', 'endpoint', 'https://s3.amazonaws.com')
+    CONFIG.set('s3', 'bucket', '')
+    CONFIG.set('s3', 'region', 'us-east-1')
+    CONFIG.set('s3', 'access_key', '')
+    CONFIG.set('s3', 'secret_key', '')
+    CONFIG.set('s3', 'prefix', '')
+    CONFIG.set('s3', 'public_url', '')
+    CONFIG.set('s3', 'part_size', '8mb')
+    CONFIG.set('s3', 'upload_threads', '4')
+
     if not cfgfiles:
         cfgfiles = _get_default_config_files_location()
 
@@ -18,15 +18,78 @@ import datetime
 import pickle
 import json
 import os
+import threading
+import time
+import functools
+import contextlib
+import multiprocessing.util
 
 import sqlalchemy
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, VARCHAR, Float, DateTime, BLOB
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, String, VARCHAR, Float, DateTime, BLOB, Index, or_, and_, func
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
 
 LOGGER = logging.getLogger('PYWPS')
+# registry of sessions, one for each thread
 _SESSION_MAKER = None
-_LAST_SESSION = None
+
+
+class _ForkLock(object):
+    """Lock preventing fork of the process during database access
+
+    Child process forked while another thread was accessing the database
+    could not use the database at all (locks of the SQLite library would be
+    held forever). Threads can access the database in parallel, but the
+    process does not fork meanwhile.
+    """
+
+    def __init__(self):
+        self._reset()
+        # the lock is held by the forking thread, which does not exist in
+        # the child
+        multiprocessing.util.register_after_fork(self, _ForkLock._reset)
+
+    def _reset(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._accessing = 0
+
+    @contextlib.contextmanager
+    def access(self):
+        """Access the database"""
+
+        with self._condition:
+            self._accessing += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._accessing -= 1
+                if not self._accessing:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def fork(self):
+        """Fork the process, wait for the running database access"""
+
+        with self._condition:
+            while self._accessing:
+                self._condition.wait()
+            yield
+
+
+FORK_LOCK = _ForkLock()
+
+
+def _locked(function):
+    """Decorator of functions accessing the database, see :class:`_ForkLock`
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with FORK_LOCK.access():
+            return function(*args, **kwargs)
+    return wrapper
 
 
 _tableprefix = configuration.get_config_value('logging', 'prefix')
@@ -35,28 +98,66 @@ _schema = configuration.get_config_value('logging', 'schema')
 Base = declarative_base()
 
 
-class ProcessInstance(Base):
-    __tablename__ = '{}requests'.format(_tableprefix)
+class _RequestColumns(object):
+    """Columns of logged request, shared by the hot and the archive table
+    """
 
     uuid = Column(VARCHAR(255), primary_key=True, nullable=False)
     pid = Column(Integer, nullable=False)
     operation = Column(VARCHAR(30), nullable=False)
     version = Column(VARCHAR(5), nullable=False)
     time_start = Column(DateTime(), nullable=False)
-    time_end = Column(DateTime(), nullable=True)
+    time_end = Column(DateTime(), nullable=True, index=True)
     identifier = Column(VARCHAR(255), nullable=True)
     message = Column(String, nullable=True)
-    percent_done = Column(Float, nullable=True)
+    percent_done = Column(Float, nullable=True, index=True)
     status = Column(Integer, nullable=True)
 
 
+class ProcessInstance(_RequestColumns, Base):
+    __tablename__ = '{}requests'.format(_tableprefix)
+
+
+class ArchivedProcessInstance(_RequestColumns, Base):
+    """Finished request moved out of the requests table, see
+    :func:`archive_requests`
+    """
+    __tablename__ = '{}requests_archive'.format(_tableprefix)
+
+
+class ActiveRequest(Base):
+    """Request, which is running or waiting in the queue
+
+    The table is maintained on status transitions of the requests, so that
+    running requests are counted without scanning all logged requests.
+    """
+    __tablename__ = '{}active_requests'.format(_tableprefix)
+
+    uuid = Column(VARCHAR(255), primary_key=True, nullable=False)
+
+
 class RequestInstance(Base):
+    """Queued asynchronous request
+
+    Request is claimed by the process executing it for limited time (lease),
+    when the lease expires, the request can be claimed again.
+    """
     __tablename__ = '{}stored_requests'.format(_tableprefix)
 
     uuid = Column(VARCHAR(255), primary_key=True, nullable=False)
     request = Column(BLOB, nullable=False)
+    workdir = Column(VARCHAR(255), nullable=True)
+    priority = Column(Integer, nullable=False, default=0)
+    time_queued = Column(DateTime(), nullable=False)
+    lease_owner = Column(VARCHAR(255), nullable=True)
+    lease_expires = Column(DateTime(), nullable=True, index=True)
+
+    __table_args__ = (
+        Index('ix_{}stored_requests_order'.format(_tableprefix), 'priority', 'time_queued'),
+    )
 
 
+@_locked
 def log_request(uuid, request):
     """Write OGC WPS request (only the necessary parts) to database logging
     system
@@ -78,46 +179,180 @@ def log_request(uuid, request):
     session.close()
     # NoApplicableCode("Could commit to database: {}".format(e.message))
 
+    _archive_periodically()
 
+
+@_locked
 def get_running():
-    """Returns running processes ids
+    """Returns running processes ids, requests waiting in the queue are not
+    included
     """
 
     session = get_session()
     running = session.query(ProcessInstance).filter(
-        ProcessInstance.percent_done < 100).filter(
-            ProcessInstance.percent_done > -1)
+        ProcessInstance.uuid.in_(session.query(ActiveRequest.uuid))).filter(
+            ~ProcessInstance.uuid.in_(_queued(session))).all()
 
     session.close()
     return running
 
 
+@_locked
+def count_running():
+    """Returns number of running processes, requests waiting in the queue
+    are not included
+    """
+
+    session = get_session()
+    count = session.query(func.count(ActiveRequest.uuid)).filter(
+        ~ActiveRequest.uuid.in_(_queued(session))).scalar()
+
+    session.close()
+    return count
+
+
+@_locked
+def get_active():
+    """Returns set of uuids of requests, which are running or waiting in the
+    queue
+    """
+
+    session = get_session()
+    active = set(uuid for (uuid,) in session.query(ActiveRequest.uuid))
+    active.update(uuid for (uuid,) in session.query(RequestInstance.uuid))
+
+    session.close()
+    return active
+
+
+@_locked
 def get_stored():
-    """Returns running processes ids
+    """Returns requests waiting in the queue
     """
 
     session = get_session()
-    stored = session.query(RequestInstance)
+    stored = session.query(RequestInstance).filter(_unclaimed()).all()
 
     session.close()
     return stored
 
 
-def get_first_stored():
-    """Returns running processes ids
+@_locked
+def count_stored():
+    """Returns number of requests waiting in the queue
+    """
+
+    session = get_session()
+    count = session.query(func.count(RequestInstance.uuid)).filter(_unclaimed()).scalar()
+
+    session.close()
+    return count
+
+
+def _queued(session):
+    """Query of uuids of the requests waiting in the queue
+    """
+
+    return session.query(RequestInstance.uuid).filter(_unclaimed())
+
+
+@_locked
+def get_claimed():
+    """Returns requests claimed by some process, with valid lease
     """
 
     session = get_session()
-    request = session.query(RequestInstance).first()
+    claimed = session.query(RequestInstance).filter(~_unclaimed()).all()
+
+    session.close()
+    return claimed
 
+
+@_locked
+def claim_stored(owner, lease):
+    """Claim first request from the queue
+
+    Requests are ordered by priority and time, when they were queued.
+    Claiming is atomic (conditional UPDATE), so that each request is
+    claimed by one process only.
+
+    :param owner: identification of the claiming process
+    :param lease: number of seconds, for which the request is claimed
+    :returns: claimed RequestInstance or None, if the queue is empty
+    """
+
+    session = get_session()
+    request = None
+    candidates = session.query(RequestInstance.uuid).filter(_unclaimed()).order_by(
+        RequestInstance.priority.desc(), RequestInstance.time_queued).limit(10).all()
+
+    for (uuid,) in candidates:
+        now = datetime.datetime.now()
+        claimed = session.query(RequestInstance).filter(
+            RequestInstance.uuid == uuid).filter(_unclaimed(now)).update({
+                RequestInstance.lease_owner: owner,
+                RequestInstance.lease_expires: now + datetime.timedelta(seconds=lease)
+            }, synchronize_session=False)
+        session.commit()
+
+        # someone else was faster
+        if claimed:
+            request = session.query(RequestInstance).filter_by(uuid=uuid).one()
+            break
+
+    session.close()
     return request
 
 
+@_locked
+def renew_lease(uuid, owner, lease):
+    """Claim given request for next lease seconds by given owner
+    """
+
+    session = get_session()
+    session.query(RequestInstance).filter(RequestInstance.uuid == str(uuid)).update({
+        RequestInstance.lease_owner: owner,
+        RequestInstance.lease_expires: datetime.datetime.now() + datetime.timedelta(seconds=lease)
+    }, synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+@_locked
+def requeue(uuid, owner):
+    """Return request claimed by given owner back to the queue
+    """
+
+    session = get_session()
+    session.query(RequestInstance).filter(RequestInstance.uuid == str(uuid)).filter(
+        RequestInstance.lease_owner == owner).update({
+            RequestInstance.lease_owner: None,
+            RequestInstance.lease_expires: None
+        }, synchronize_session=False)
+    session.commit()
+    session.close()
+
+
+def _unclaimed(now=None):
+    """Filter for requests, which are not claimed or their lease expired
+    """
+
+    if now is None:
+        now = datetime.datetime.now()
+    return or_(RequestInstance.lease_owner == None,  # noqa
+               RequestInstance.lease_expires < now)
+
+
 def update_response(uuid, response, close=False):
     """Writes response to database
+
+    With `db_flush_interval` configured, intermediate status updates of
+    running requests are only buffered and written in batches, see
+    :class:`_StatusBuffer`. Terminal states (finished or failed request,
+    `close`) are always written immediately, together with the buffered
+    updates.
     """
 
-    session = get_session()
     message = None
     status_percentage = None
     status = None
@@ -129,20 +364,132 @@ def update_response(uuid, response, close=False):
     if hasattr(response, 'status'):
         status = response.status
 
-        if status == '200 OK':
+        if status in ('200 OK', '206 PARTIAL CONTENT'):
             status = 3
         elif status == 400:
             status = 0
 
-    requests = session.query(ProcessInstance).filter_by(uuid=str(uuid))
-    if requests.count():
-        request = requests.one()
+    update = (str(uuid), message, status_percentage, status)
+    interval = float(configuration.get_config_value('logging', 'db_flush_interval'))
+    if interval > 0 and not close and status_percentage not in (100, -1):
+        if STATUS_BUFFER.put(update, interval):
+            return
+    STATUS_BUFFER.flush([update])
+
+
+@_locked
+def _write_responses(updates):
+    """Write status updates (uuid, message, percentage, status) in one
+    transaction
+    """
+
+    session = get_session()
+    try:
+        _update_requests(session, updates)
+        session.commit()
+    except sqlalchemy.exc.IntegrityError:
+        # request was marked active by another process in the meantime,
+        # the second attempt sees its status
+        session.rollback()
+        _update_requests(session, updates)
+        session.commit()
+    finally:
+        session.close()
+
+
+def _update_requests(session, updates):
+    lease = int(configuration.get_config_value('server', 'leasetime'))
+    for (uuid, message, status_percentage, status) in updates:
+        request = session.query(ProcessInstance).filter_by(uuid=uuid).one_or_none()
+        if request is None:
+            continue
+        if request.percent_done in (100, -1) and status_percentage not in (100, -1):
+            # finished by the process executing the request in the meantime
+            continue
+        if status_percentage in (100, -1):
+            session.query(ActiveRequest).filter(ActiveRequest.uuid == uuid).delete(synchronize_session=False)
+        elif status_percentage is not None and request.percent_done is None:
+            session.add(ActiveRequest(uuid=uuid))
         request.time_end = datetime.datetime.now()
         request.message = message
         request.percent_done = status_percentage
         request.status = status
-        session.commit()
-    session.close()
+        # process executing queued request is alive, extend its lease
+        session.query(RequestInstance).filter(RequestInstance.uuid == uuid).filter(
+            RequestInstance.lease_owner != None).update({  # noqa
+                RequestInstance.lease_expires: datetime.datetime.now() + datetime.timedelta(seconds=lease)
+            }, synchronize_session=False)
+
+
+class _StatusBuffer(object):
+    """Write-behind buffer of status updates
+
+    Only the last update of each request is kept, pending updates are written
+    by background thread every `db_flush_interval` seconds, so that reporting
+    progress does not cost a transaction. First update of each request is
+    written immediately, so that the request is counted as running.
+    """
+
+    def __init__(self):
+        self._reset()
+        # pending updates belong to the parent process
+        multiprocessing.util.register_after_fork(self, _StatusBuffer._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        # flushes are serialized, so that older update is never written
+        # after newer one
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._written = set()
+        self._thread = None
+        # write pending updates at exit of the process
+        multiprocessing.util.Finalize(self, self.flush, exitpriority=10)
+
+    def put(self, update, interval):
+        """Buffer update, return False, if it has to be written immediately
+        """
+
+        with self._lock:
+            if update[0] not in self._written:
+                return False
+            self._pending[update[0]] = update
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, args=(interval,),
+                                                name='pywps-status-buffer')
+                self._thread.daemon = True
+                self._thread.start()
+        return True
+
+    def flush(self, updates=()):
+        """Write pending updates together with given ones
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                for update in updates:
+                    if update[2] in (100, -1):
+                        self._written.discard(update[0])
+                    else:
+                        self._written.add(update[0])
+            # given updates are newer than the pending ones
+            for update in updates:
+                pending[update[0]] = update
+            if pending:
+                _write_responses(list(pending.values()))
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception:
+                LOGGER.exception('Writing of status updates failed')
+
+
+STATUS_BUFFER = _StatusBuffer()
 
 
 def _get_identifier(request):
@@ -162,41 +509,73 @@ def _get_identifier(request):
 
 def get_session():
     """Get Connection for database
+
+    The session belongs to the current thread and it is reused by all calls
+    from the thread, its connection is returned to the pool of the engine
+    when the session is closed.
     """
 
-    LOGGER.debug('Initializing database connection')
     global _SESSION_MAKER
-    global _LAST_SESSION
-
-    if _LAST_SESSION:
-        _LAST_SESSION.close()
 
     if _SESSION_MAKER:
-        _SESSION_MAKER.close_all()
-        _LAST_SESSION = _SESSION_MAKER()
-        return _LAST_SESSION
+        return _SESSION_MAKER()
 
-    database = configuration.get_config_value('logging', 'database')
-    echo = True
-    level = configuration.get_config_value('logging', 'level')
-    if level in ['INFO']:
-        echo = False
+    LOGGER.debug('Initializing database connection')
     try:
-        engine = sqlalchemy.create_engine(database, echo=echo)
+        engine = _create_engine()
     except sqlalchemy.exc.SQLAlchemyError as e:
-        raise NoApplicableCode("Could not connect to database: {}".format(e.message))
+        raise NoApplicableCode("Could not connect to database: {}".format(e))
 
-    Session = sessionmaker(bind=engine)
-    ProcessInstance.metadata.create_all(engine)
-    RequestInstance.metadata.create_all(engine)
+    Base.metadata.create_all(engine)
 
-    _SESSION_MAKER = Session
+    _SESSION_MAKER = scoped_session(sessionmaker(bind=engine))
+    return _SESSION_MAKER()
 
-    _LAST_SESSION = _SESSION_MAKER()
-    return _LAST_SESSION
 
+def _create_engine():
+    """Create engine with pool of connections configured in the [logging]
+    section
+    """
 
-def store_process(uuid, request):
+    database = configuration.get_config_value('logging', 'database')
+    echo = configuration.get_config_value('logging', 'db_echo') is True
+    url = sqlalchemy.engine.url.make_url(database)
+
+    if url.drivername.startswith('sqlite') and url.database in (None, '', ':memory:'):
+        # in-memory database exists only in its single connection
+        return sqlalchemy.create_engine(url, echo=echo)
+
+    kwargs = {}
+    if url.drivername.startswith('sqlite'):
+        # connections are used by one thread at a time, but not always by
+        # the thread which opened them
+        kwargs['connect_args'] = {'check_same_thread': False}
+
+    engine = sqlalchemy.create_engine(
+        url, echo=echo, poolclass=QueuePool,
+        pool_size=int(configuration.get_config_value('logging', 'db_pool_size')),
+        max_overflow=int(configuration.get_config_value('logging', 'db_max_overflow')),
+        **kwargs)
+
+    @sqlalchemy.event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        connection_record.info['pid'] = os.getpid()
+
+    @sqlalchemy.event.listens_for(engine, 'checkout')
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        # connections inherited from parent process must not be used (nor
+        # closed) by the forked child, the pool opens new ones
+        if connection_record.info['pid'] != os.getpid():
+            connection_record.connection = connection_proxy.connection = None
+            raise sqlalchemy.exc.DisconnectionError(
+                'Connection record belongs to pid {}, attempting to check out in pid {}'.format(
+                    connection_record.info['pid'], os.getpid()))
+
+    return engine
+
+
+@_locked
+def store_process(uuid, request, workdir=None, priority=0):
     """Save given request under given UUID for later usage
     """
 
@@ -205,18 +584,69 @@ def store_process(uuid, request):
     if not PY2:
         # the BLOB type requires bytes on Python 3
         request_json = request_json.encode('utf-8')
-    request = RequestInstance(uuid=str(uuid), request=request_json)
+    request = RequestInstance(uuid=str(uuid), request=request_json, workdir=workdir,
+                              priority=priority, time_queued=datetime.datetime.now())
     session.add(request)
     session.commit()
     session.close()
 
 
+@_locked
 def remove_stored(uuid):
     """Remove given request from stored requests
     """
 
     session = get_session()
-    request = session.query(RequestInstance).filter_by(name='uuid').first()
-    session.delete(request)
+    session.query(RequestInstance).filter_by(uuid=str(uuid)).delete(synchronize_session=False)
     session.commit()
     session.close()
+
+
+@_locked
+def archive_requests(days):
+    """Move requests finished more than given number of days ago from the
+    requests table to the archive table
+
+    :param days: age of the requests in days
+    :returns: number of archived requests
+    """
+
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    session = get_session()
+    finished = and_(
+        or_(ProcessInstance.time_end < cutoff,
+            and_(ProcessInstance.time_end == None, ProcessInstance.time_start < cutoff)),  # noqa
+        ~ProcessInstance.uuid.in_(session.query(ActiveRequest.uuid)))
+
+    columns = [column.name for column in ProcessInstance.__table__.columns]
+    session.execute(ArchivedProcessInstance.__table__.insert().from_select(
+        columns, session.query(*[getattr(ProcessInstance, column) for column in columns]).filter(finished)))
+    count = session.query(ProcessInstance).filter(finished).delete(synchronize_session=False)
+    session.commit()
+    session.close()
+
+    if count:
+        LOGGER.info('Archived %s finished requests', count)
+    return count
+
+
+# time of last archiving by this process
+_ARCHIVED = [None]
+
+
+def _archive_periodically():
+    """Archive old requests once an hour, if `db_retention` is configured
+    """
+
+    days = float(configuration.get_config_value('logging', 'db_retention'))
+    if days <= 0:
+        return
+    now = time.time()
+    if _ARCHIVED[0] is not None and now - _ARCHIVED[0] < 3600:
+        return
+    _ARCHIVED[0] = now
+    try:
+        archive_requests(days)
+    except sqlalchemy.exc.SQLAlchemyError:
+        # another process may be archiving the same requests
+        LOGGER.exception('Archiving of requests failed')
@@ -6,7 +6,9 @@
 
 
 from pywps._compat import text_type, StringIO
+import mmap
 import os
+import re
 import tempfile
 from pywps.inout.literaltypes import (LITERAL_DATA_TYPES, convert,
                                       make_allowedvalues, is_anyvalue)
@@ -25,6 +27,66 @@ from io import BytesIO
 _SOURCE_TYPE = namedtuple('SOURCE_TYPE', 'MEMORY, FILE, STREAM, DATA')
 SOURCE_TYPE = _SOURCE_TYPE(0, 1, 2, 3)
 
+# size of the blocks, in which data are encoded to and decoded from base64,
+# multiple of 3 and 4, so that the blocks are encoded without padding
+BASE64_BLOCK_SIZE = 48 * 1024
+_NOT_BASE64_RE = re.compile(b'[^A-Za-z0-9+/=]')
+
+
+def iter_base64_encoded(file_name):
+    """Iterate over content of the file encoded in base64 in blocks
+    """
+
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(BASE64_BLOCK_SIZE), b''):
+            yield base64.b64encode(block)
+
+
+def iter_base64_decoded(data):
+    """Iterate over blocks of decoded base64 data
+
+    Characters outside of base64 alphabet (line breaks) are ignored.
+
+    :raises binascii.Error: the data are not valid base64
+    """
+
+    decoder = Base64Decoder()
+    for start in range(0, len(data), BASE64_BLOCK_SIZE):
+        yield decoder.decode(data[start:start + BASE64_BLOCK_SIZE])
+    yield decoder.flush()
+
+
+class Base64Decoder(object):
+    """Incremental decoder of base64 data split to arbitrary pieces
+
+    Characters outside of base64 alphabet (line breaks) are ignored.
+    """
+
+    def __init__(self):
+        self._remainder = b''
+
+    def decode(self, data):
+        """Return decoded part of data, the rest is kept for the next call
+
+        :raises binascii.Error: the data are not valid base64
+        """
+
+        if isinstance(data, text_type):
+            data = data.encode('ascii', 'ignore')
+        data = self._remainder + _NOT_BASE64_RE.sub(b'', data)
+        size = len(data) // 4 * 4
+        self._remainder = data[size:]
+        return base64.b64decode(data[:size])
+
+    def flush(self):
+        """Return decoded rest of the data
+
+        :raises binascii.Error: the data are not valid base64
+        """
+
+        (remainder, self._remainder) = (self._remainder, b'')
+        return base64.b64decode(remainder)
+
 
 class IOHandler(object):
     """Basic IO class. Provides functions, to accept input data in file,
@@ -86,6 +148,10 @@ class IOHandler(object):
         self.workdir = workdir
         self.uuid = None  # request identifier
         self._stream = None
+        # content of the file is binary (decoded from base64)
+        self._binary = False
+        # (file name, mmap) of the last mapped file
+        self._memory_map = None
 
         self.valid_mode = mode
 
@@ -100,11 +166,24 @@ class IOHandler(object):
                                         'mode %s' % (self.valid_mode))
 
     def set_file(self, filename):
-        """Set source as file name"""
+        """Set source as file name
+
+        Relative file name is taken relative to the working directory
+        """
+        if self.workdir and not os.path.isabs(filename):
+            filename = os.path.join(self.workdir, filename)
         self.source_type = SOURCE_TYPE.FILE
         self.source = os.path.abspath(filename)
+        self._binary = False
         self._check_valid()
 
+    def set_binary_file(self, filename):
+        """Set source as file name of file with binary content, e.g.
+        decoded from base64, its data are bytes
+        """
+        self.set_file(filename)
+        self._binary = True
+
     def set_workdir(self, workdirpath):
         """Set working temporary directory for files to be stored in"""
 
@@ -114,8 +193,10 @@ class IOHandler(object):
         self._workdir = workdirpath
 
     def set_memory_object(self, memory_object):
-        """Set source as in memory object"""
+        """Set source as in memory object supporting buffer protocol (bytes,
+        bytearray, numpy array, ...)"""
         self.source_type = SOURCE_TYPE.MEMORY
+        self.source = memoryview(memory_object)
         self._check_valid()
 
     def set_stream(self, stream):
@@ -131,17 +212,30 @@ class IOHandler(object):
         self._check_valid()
 
     def set_base64(self, data):
-        """Set data encoded in base64"""
+        """Set data encoded in base64
 
-        self.data = base64.b64decode(data)
-        self._check_valid()
+        The data are decoded in blocks to file in the working directory.
+        """
+
+        suffix = ''
+        if hasattr(self, 'data_format') and self.data_format and self.data_format.extension:
+            suffix = self.data_format.extension
+        (opening, file_name) = tempfile.mkstemp(dir=self.workdir, suffix=suffix)
+        try:
+            with os.fdopen(opening, 'wb') as f:
+                for block in iter_base64_decoded(data):
+                    f.write(block)
+        except Exception:
+            os.remove(file_name)
+            raise
+        self.set_binary_file(file_name)
 
     def get_file(self):
         """Get source as file name"""
         if self.source_type == SOURCE_TYPE.FILE:
             return self.source
 
-        elif self.source_type == SOURCE_TYPE.STREAM or self.source_type == SOURCE_TYPE.DATA:
+        elif self.source_type in (SOURCE_TYPE.STREAM, SOURCE_TYPE.DATA, SOURCE_TYPE.MEMORY):
             if self._tempfile:
                 return self._tempfile
             else:
@@ -151,7 +245,7 @@ class IOHandler(object):
                 (opening, stream_file_name) = tempfile.mkstemp(
                     dir=self.workdir, suffix=suffix)
                 openmode = 'w'
-                if not PY2 and isinstance(self.source, bytes):
+                if self.source_type == SOURCE_TYPE.MEMORY or (not PY2 and isinstance(self.source, bytes)):
                     # on Python 3 open the file in binary mode if the source is
                     # bytes, which happens when the data was base64-decoded
                     openmode += 'b'
@@ -172,9 +266,30 @@ class IOHandler(object):
         return self._workdir
 
     def get_memory_object(self):
-        """Get source as memory object"""
-        # TODO: Soeren promissed to implement at WPS Workshop on 23rd of January 2014
-        raise NotImplementedError("setmemory_object not implemented")
+        """Get source as read-only object supporting buffer protocol
+
+        Files are memory mapped and bytes are viewed without copying, so
+        that large sources can be accessed randomly (e.g. by
+        ``numpy.frombuffer``) without reading them to memory. Streams and
+        text are stored to file first.
+        """
+        if self.source_type is None:
+            return None
+        elif self.source_type == SOURCE_TYPE.MEMORY:
+            return self.source
+        elif self.source_type == SOURCE_TYPE.DATA and isinstance(self.source, bytes):
+            return memoryview(self.source)
+
+        file_name = self.file
+        if self._memory_map is None or self._memory_map[0] != file_name:
+            with open(file_name, 'rb') as f:
+                try:
+                    memory_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:
+                    # empty file cannot be mapped
+                    return memoryview(b'')
+            self._memory_map = (file_name, memory_map)
+        return self._memory_map[1]
 
     def get_stream(self):
         """Get source as stream object"""
@@ -186,6 +301,8 @@ class IOHandler(object):
             return self._stream
         elif self.source_type == SOURCE_TYPE.STREAM:
             return self.source
+        elif self.source_type == SOURCE_TYPE.MEMORY:
+            return BytesIO(self.source.tobytes())
         elif self.source_type == SOURCE_TYPE.DATA:
             if not PY2 and isinstance(self.source, bytes):
                 return BytesIO(self.source)
@@ -196,10 +313,11 @@ class IOHandler(object):
         """Get source as simple data object"""
         if self.source_type == SOURCE_TYPE.FILE:
             openmode = 'r'
-            if (not PY2 and hasattr(self, 'data_format') and
-                    self.data_format.encoding == 'base64'):
-                # on Python 3, when the data is to be encoded to base64, we
-                # need to open the file in binary mode
+            if not PY2 and (self._binary or (hasattr(self, 'data_format') and
+                                             self.data_format.encoding == 'base64')):
+                # on Python 3, when the data is to be encoded to base64 or
+                # was decoded from base64, we need to open the file in binary
+                # mode
                 openmode += 'b'
             file_handler = open(self.source, mode=openmode)
             content = file_handler.read()
@@ -207,6 +325,8 @@ class IOHandler(object):
             return content
         elif self.source_type == SOURCE_TYPE.STREAM:
             return self.source.read()
+        elif self.source_type == SOURCE_TYPE.MEMORY:
+            return self.source.tobytes()
         elif self.source_type == SOURCE_TYPE.DATA:
             return self.source
 
@@ -221,6 +341,10 @@ class IOHandler(object):
         return emptyvalidator
 
     def get_base64(self):
+        """Get source encoded in base64, files are encoded in blocks"""
+
+        if self.source_type == SOURCE_TYPE.FILE:
+            return b''.join(iter_base64_encoded(self.source))
         return base64.b64encode(self.data)
 
     # Properties
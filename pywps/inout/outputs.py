@@ -5,15 +5,21 @@
 ##################################################################
 
 
+import re
+
 from pywps._compat import text_type
 from pywps import E, WPS, OWS, OGCTYPE, NAMESPACES
+from pywps.app.basic import file_placeholder
 from pywps.inout import basic
-from pywps.inout.storage import FileStorage
+from pywps.inout.storage import get_storage
 from pywps.inout.formats import Format
 from pywps.validator.mode import MODE
 import lxml.etree as etree
 import six
 
+# encoding declared by XML declaration
+_XML_ENCODING_RE = re.compile(br'^(?:\xef\xbb\xbf)?\s*<\?xml[^>]*encoding=["\']([^"\']+)')
+
 
 class BoundingBoxOutput(basic.BBoxInput):
     """
@@ -167,20 +173,22 @@ class ComplexOutput(basic.ComplexOutput):
 
         return doc
 
-    def execute_xml(self):
+    def execute_xml(self, stream=False):
         """Render Execute response XML node
 
+        :param stream: content of the output file is represented by
+                       placeholder, which is replaced by the content, when
+                       the document is serialized by
+                       :func:`pywps.app.basic.xml_stream`
         :return: node
         :rtype: ElementMaker
         """
 
-        self.identifier
-
         node = None
         if self.as_reference:
             node = self._execute_xml_reference()
         else:
-            node = self._execute_xml_data()
+            node = self._execute_xml_data(stream)
 
         doc = WPS.Output(
             OWS.Identifier(self.identifier),
@@ -198,7 +206,8 @@ class ComplexOutput(basic.ComplexOutput):
         doc = WPS.Reference()
 
         # get_url will create the file and return the url for it
-        self.storage = FileStorage()
+        if self.storage is None:
+            self.storage = get_storage()
         doc.attrib['{http://www.w3.org/1999/xlink}href'] = self.get_url()
 
         if self.data_format:
@@ -210,15 +219,19 @@ class ComplexOutput(basic.ComplexOutput):
                 doc.attrib['schema'] = self.data_format.schema
         return doc
 
-    def _execute_xml_data(self):
+    def _execute_xml_data(self, stream=False):
         """Return Data node
         """
         doc = WPS.Data()
 
-        if self.data is None:
-            complex_doc = WPS.ComplexData()
-        else:
-            complex_doc = WPS.ComplexData()
+        complex_doc = WPS.ComplexData()
+        mode = None
+        if stream and self.source_type is not None:
+            mode = self._get_stream_mode()
+
+        if mode is not None:
+            complex_doc.append(file_placeholder(self.file, mode))
+        elif self.source_type is not None:
             try:
                 data_doc = etree.parse(self.file)
                 complex_doc.append(data_doc.getroot())
@@ -239,6 +252,47 @@ class ComplexOutput(basic.ComplexOutput):
         doc.append(complex_doc)
         return doc
 
+    def _get_stream_mode(self):
+        """Return mode of the placeholder of the output file, see
+        :func:`pywps.app.basic.file_placeholder`, or None, if the file has to
+        be embedded as parsed tree
+
+        Well-formed XML documents are embedded, they are checked by parser
+        without building the tree. Documents in other encodings than UTF-8
+        and with internal DTD subset are embedded as parsed tree.
+        """
+
+        if self.data_format and self.data_format.encoding == 'base64':
+            return 'base64'
+
+        with open(self.file, 'rb') as f:
+            head = f.read(4096)
+            if not head.lstrip(b'\xef\xbb\xbf \t\r\n').startswith(b'<'):
+                return 'text'
+            parser = etree.XMLParser(target=_NullTarget())
+            try:
+                parser.feed(head)
+                for block in iter(lambda: f.read(64 * 1024), b''):
+                    parser.feed(block)
+                parser.close()
+            except etree.XMLSyntaxError:
+                return 'text'
+
+        match = _XML_ENCODING_RE.match(head)
+        if match and match.group(1).lower() not in (b'utf-8', b'utf8', b'us-ascii', b'ascii'):
+            return None
+        if b'<!DOCTYPE' in head and b'[' in head.split(b'<!DOCTYPE', 1)[1].split(b'>', 1)[0]:
+            return None
+        return 'xml'
+
+
+class _NullTarget(object):
+    """Parser target discarding the document, only well-formedness is
+    checked"""
+
+    def close(self):
+        pass
+
 
 class LiteralOutput(basic.LiteralOutput):
     """
@@ -0,0 +1,204 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Storage of outputs in S3 compatible object store
+
+Outputs are uploaded to `bucket` of the object store at `endpoint`
+(Amazon S3, MinIO, Ceph, ...) under ``<prefix><uuid>/<file name>`` and
+their URLs point to the object store (`public_url`), so that the clients
+download them directly. Files larger than `part_size` are uploaded by
+multipart upload, `upload_threads` parts at once, only these parts are
+held in memory.
+
+Requests are signed by AWS Signature Version 4, the objects have to be
+readable by the clients by the policy of the bucket.
+"""
+
+import datetime
+import hashlib
+import hmac
+import logging
+import os
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from lxml import etree
+
+import pywps.configuration as config
+from pywps.app.fetcher import get_session, get_timeout
+from pywps.exceptions import NoApplicableCode
+from pywps.inout.storage import StorageAbstract, STORE_TYPE
+from pywps._compat import quote, urlparse
+
+LOGGER = logging.getLogger('PYWPS')
+
+_S3_NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+
+
+class S3Storage(StorageAbstract):
+    """Storage of outputs in S3 compatible object store configured in `s3`
+    section of the configuration
+    """
+
+    def __init__(self):
+        self.endpoint = config.get_config_value('s3', 'endpoint').rstrip('/')
+        self.bucket = config.get_config_value('s3', 'bucket')
+        self.region = config.get_config_value('s3', 'region')
+        self.access_key = config.get_config_value('s3', 'access_key')
+        self.secret_key = config.get_config_value('s3', 'secret_key')
+        self.prefix = config.get_config_value('s3', 'prefix')
+        self.public_url = config.get_config_value('s3', 'public_url').rstrip('/') or \
+            '{}/{}'.format(self.endpoint, self.bucket)
+        self.part_size = int(config.get_size_mb(config.get_config_value('s3', 'part_size')) * 1024 * 1024)
+        self.upload_threads = int(config.get_config_value('s3', 'upload_threads'))
+
+    def store(self, output):
+        file_name = output.file
+        request_uuid = output.uuid or uuid.uuid1()
+        key = '{}{}/{}'.format(self.prefix, request_uuid, os.path.basename(file_name))
+
+        headers = {}
+        if getattr(output, 'data_format', None) and output.data_format.mime_type:
+            headers['Content-Type'] = output.data_format.mime_type
+
+        size = os.path.getsize(file_name)
+        LOGGER.info('Storing file output to s3://%s/%s', self.bucket, key)
+        try:
+            if size <= self.part_size:
+                with open(file_name, 'rb') as f:
+                    self._request('PUT', key, data=f.read(), headers=headers)
+            else:
+                self._upload_multipart(file_name, key, size, headers)
+        except IOError as e:
+            # requests exceptions are IOErrors as well
+            raise NoApplicableCode('Storing of output {} failed: {}'.format(output.identifier, e))
+
+        url = '{}/{}'.format(self.public_url, quote(key))
+        LOGGER.info('File output URI: %s', url)
+        return (STORE_TYPE.S3, key, url)
+
+    def _upload_multipart(self, file_name, key, size, headers):
+        """Upload file in parts of `part_size`, `upload_threads` at once
+        """
+
+        response = self._request('POST', key, {'uploads': ''}, headers=headers)
+        upload_id = _find(response.content, 'UploadId')
+
+        def upload_part(part_number):
+            with open(file_name, 'rb') as f:
+                f.seek((part_number - 1) * self.part_size)
+                data = f.read(self.part_size)
+            response = self._request('PUT', key, {'partNumber': str(part_number), 'uploadId': upload_id},
+                                     data=data)
+            return response.headers['ETag']
+
+        parts = range(1, (size + self.part_size - 1) // self.part_size + 1)
+        pool = ThreadPool(min(self.upload_threads, len(parts)))
+        try:
+            etags = pool.map(upload_part, parts)
+
+            complete = etree.Element('CompleteMultipartUpload')
+            for (part_number, etag) in zip(parts, etags):
+                part = etree.SubElement(complete, 'Part')
+                etree.SubElement(part, 'PartNumber').text = str(part_number)
+                etree.SubElement(part, 'ETag').text = etag
+            response = self._request('POST', key, {'uploadId': upload_id}, data=etree.tostring(complete))
+            # completion can fail after the response status was sent
+            if _find(response.content, 'Code') is not None:
+                raise IOError('Completing multipart upload failed: {}'.format(_find(response.content, 'Message')))
+        except Exception:
+            try:
+                self._request('DELETE', key, {'uploadId': upload_id})
+            except IOError:
+                LOGGER.warning('Aborting multipart upload %s failed', upload_id)
+            raise
+        finally:
+            pool.close()
+
+    def _request(self, method, key, params=None, data=b'', headers=None):
+        """Send signed request for given object, raise IOError on failure
+        """
+
+        url = '{}/{}/{}'.format(self.endpoint, self.bucket, quote(key))
+        query = '&'.join('{}={}'.format(quote(name, safe='-_.~'), quote(value, safe='-_.~'))
+                         for (name, value) in sorted((params or {}).items()))
+        if query:
+            url += '?' + query
+
+        headers = dict(headers or {})
+        headers['x-amz-date'] = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+        headers['x-amz-content-sha256'] = hashlib.sha256(data).hexdigest()
+        headers['Authorization'] = sign(method, url, headers, self.access_key, self.secret_key, self.region)
+
+        response = get_session().request(method, url, data=data, headers=headers, timeout=get_timeout())
+        if response.status_code >= 300:
+            raise IOError('{} {} failed with {}: {}'.format(method, key, response.status_code,
+                                                            _find(response.content, 'Message')))
+        return response
+
+
+def sign(method, url, headers, access_key, secret_key, region, service='s3'):
+    """Return Authorization header of the request signed by AWS Signature
+    Version 4
+
+    :param headers: headers of the request including `x-amz-date` and
+                    `x-amz-content-sha256`, all of them are signed
+    """
+
+    parsed = urlparse(url)
+    amz_date = headers['x-amz-date']
+    scope = '{}/{}/{}/aws4_request'.format(amz_date[:8], region, service)
+
+    signed_headers = dict((name.lower(), ' '.join(value.split())) for (name, value) in headers.items())
+    signed_headers['host'] = parsed.netloc
+    header_names = sorted(signed_headers)
+
+    query = []
+    for param in parsed.query.split('&') if parsed.query else []:
+        (name, _, value) = param.partition('=')
+        query.append((name, value))
+
+    canonical_request = '\n'.join([
+        method,
+        parsed.path or '/',
+        '&'.join('{}={}'.format(name, value) for (name, value) in sorted(query)),
+        ''.join('{}:{}\n'.format(name, signed_headers[name]) for name in header_names),
+        ';'.join(header_names),
+        headers['x-amz-content-sha256']
+    ])
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        amz_date,
+        scope,
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+    ])
+
+    key = ('AWS4' + secret_key).encode('utf-8')
+    for part in (amz_date[:8], region, service, 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    return 'AWS4-HMAC-SHA256 Credential={}/{}, SignedHeaders={}, Signature={}'.format(
+        access_key, scope, ';'.join(header_names), signature)
+
+
+def _find(content, tag):
+    """Return text of the first element with given tag in S3 response
+    """
+
+    if not content:
+        return None
+    try:
+        doc = etree.fromstring(content)
+    except etree.XMLSyntaxError:
+        return None
+    for namespace in ('{%s}' % _S3_NAMESPACE, ''):
+        element = doc.find('.//{}{}'.format(namespace, tag))
+        if element is not None:
+            return element.text
+    if doc.tag in (tag, '{%s}%s' % (_S3_NAMESPACE, tag)):
+        return doc.text
+    return None
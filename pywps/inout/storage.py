@@ -7,19 +7,36 @@
 
 import logging
 import os
+import threading
+import time
 from abc import ABCMeta, abstractmethod
-from pywps._compat import urljoin
-from pywps.exceptions import NotEnoughStorage
+from pywps._compat import urljoin, replace
+from pywps.exceptions import NotEnoughStorage, NoApplicableCode
 from pywps import configuration as config
 
 LOGGER = logging.getLogger('PYWPS')
 
+# ioctl cloning file on Linux
+_FICLONE = 0x40049409
+
+# folder: StorageQuota
+_QUOTAS = {}
+_QUOTAS_LOCK = threading.Lock()
+
 
 class STORE_TYPE:
     PATH = 0
+    S3 = 1
 # TODO: cover with tests
 
 
+# storagetype: storage class or its dotted path
+STORAGES = {
+    'file': 'pywps.inout.storage.FileStorage',
+    's3': 'pywps.inout.s3.S3Storage'
+}
+
+
 class StorageAbstract(object):
     """Data storage abstract class
     """
@@ -58,6 +75,10 @@ class DummyStorage(StorageAbstract):
 class FileStorage(StorageAbstract):
     """File storage implementation, stores data to file system
 
+    Output files are hard linked or cloned to `outputpath`, when possible,
+    see :func:`store_file`; :attr:`strategy` says, how the last one was
+    stored.
+
     >>> import ConfigParser
     >>> config = ConfigParser.RawConfigParser()
     >>> config.add_section('FileStorage')
@@ -85,27 +106,16 @@ class FileStorage(StorageAbstract):
         """
         self.target = config.get_config_value('server', 'outputpath')
         self.output_url = config.get_config_value('server', 'outputurl')
+        # how the last output was stored, see store_file
+        self.strategy = None
 
     def store(self, output):
-        import math
-        import shutil
         import tempfile
         import uuid
 
         file_name = output.file
         request_uuid = output.uuid or uuid.uuid1()
 
-        file_block_size = os.stat(file_name).st_blksize
-        # get_free_space delivers the numer of free blocks, not the available size!
-        avail_size = get_free_space(self.target) * file_block_size
-        file_size = os.stat(file_name).st_size
-
-        # calculate space used according to block size
-        actual_file_size = math.ceil(file_size / float(file_block_size)) * file_block_size
-
-        if avail_size < actual_file_size:
-            raise NotEnoughStorage('Not enough space in {} to store {}'.format(self.target, file_name))
-
         # create a target folder for each request
         target = os.path.join(self.target, str(request_uuid))
         if not os.path.exists(target):
@@ -123,8 +133,24 @@ class FileStorage(StorageAbstract):
                                            dir=target)[1]
 
         full_output_name = os.path.join(target, output_name)
-        LOGGER.info('Storing file output to %s', full_output_name)
-        shutil.copy2(output.file, full_output_name)
+        quota = get_quota(self.target)
+        size = os.path.getsize(output.file)
+        reserved = []
+
+        def reserve():
+            # only copies need space
+            quota.reserve(request_uuid, size)
+            reserved.append(size)
+
+        try:
+            self.strategy = store_file(output.file, full_output_name, reserve)
+        except Exception:
+            if reserved:
+                quota.release(request_uuid, size)
+            raise
+        if reserved:
+            quota.commit(request_uuid, size)
+        LOGGER.info('Stored file output to %s (%s)', full_output_name, self.strategy)
 
         just_file_name = os.path.basename(output_name)
 
@@ -137,8 +163,193 @@ class FileStorage(StorageAbstract):
         return (STORE_TYPE.PATH, output_name, url)
 
 
+def register_storage(name, storage_class):
+    """Register storage, which can be selected by `storagetype`
+    configuration value
+
+    :param storage_class: subclass of :class:`StorageAbstract` or its
+                          dotted path
+    """
+
+    STORAGES[name] = storage_class
+
+
+def get_storage():
+    """Return instance of the storage of reference outputs configured by
+    `storagetype`, which is name of registered storage or dotted path of
+    storage class
+    """
+    import importlib
+
+    storage_type = config.get_config_value('server', 'storagetype')
+    storage_class = STORAGES.get(storage_type, storage_type)
+    if not isinstance(storage_class, type):
+        try:
+            (module_name, _, class_name) = storage_class.rpartition('.')
+            storage_class = getattr(importlib.import_module(module_name), class_name)
+        except (ImportError, AttributeError, ValueError):
+            raise NoApplicableCode('Unknown storage type {}'.format(storage_type))
+    return storage_class()
+
+
+def store_file(source, target, check_space=None):
+    """Store file to target path without copying its data, if possible
+
+    The file is hard linked, when source and target are on the same file
+    system, cloned (reflink), when the file system supports it, and copied
+    otherwise. The target is replaced atomically.
+
+    :param check_space: function called before the data are copied, which
+                        should raise :class:`NotEnoughStorage`, when there
+                        is not enough space
+    :returns: used strategy - 'link', 'reflink' or 'copy'
+    """
+    import shutil
+    import uuid
+
+    tmp_target = '{}.{}.tmp'.format(target, uuid.uuid4().hex)
+    try:
+        try:
+            os.link(source, tmp_target)
+            strategy = 'link'
+        except (OSError, AttributeError):
+            # different file system or no hard links
+            if _reflink(source, tmp_target):
+                strategy = 'reflink'
+            else:
+                if check_space:
+                    check_space()
+                shutil.copy2(source, tmp_target)
+                strategy = 'copy'
+        replace(tmp_target, target)
+    except Exception:
+        if os.path.exists(tmp_target):
+            os.remove(tmp_target)
+        raise
+
+    return strategy
+
+
+def _reflink(source, target):
+    """Clone source file to target sharing its data blocks (btrfs, xfs),
+    return False, if it is not supported
+    """
+    import shutil
+
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(source, 'rb') as source_file:
+            with open(target, 'wb') as target_file:
+                fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+    except (IOError, OSError):
+        if os.path.exists(target):
+            os.remove(target)
+        return False
+
+    shutil.copystat(source, target)
+    return True
+
+
+class StorageQuota(object):
+    """Accounting of free space in folder
+
+    Free space of the file system is read at most every `storagerefresh`
+    seconds. Space needed by the outputs is reserved before they are
+    written, written outputs are counted as used until the next refresh,
+    so that the check is cheap and concurrent requests can not reserve the
+    same space.
+
+    :param folder: folder, where the outputs are stored
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._lock = threading.Lock()
+        self._free = 0
+        self._refreshed = None
+        # request uuid: bytes reserved and not written yet
+        self._reserved = {}
+        self._reserved_total = 0
+        # bytes written since the last refresh
+        self._committed = 0
+
+    def reserve(self, request_uuid, size):
+        """Reserve space for output of given request
+
+        :raises NotEnoughStorage: there is not enough free space
+        """
+
+        with self._lock:
+            self._refresh()
+            if size > self._free - self._reserved_total - self._committed:
+                raise NotEnoughStorage('Not enough space in {} to store {} bytes'.format(self.folder, size))
+            self._reserved[request_uuid] = self._reserved.get(request_uuid, 0) + size
+            self._reserved_total += size
+
+    def commit(self, request_uuid, size):
+        """Mark reserved space as written
+        """
+
+        with self._lock:
+            self._release(request_uuid, size)
+            self._committed += size
+
+    def release(self, request_uuid, size=None):
+        """Release reserved space, which was not used, all space reserved by
+        the request by default
+        """
+
+        with self._lock:
+            self._release(request_uuid, size)
+
+    def get_reserved(self, request_uuid=None):
+        """Return space reserved by given request, or by all requests
+        """
+
+        if request_uuid is None:
+            return self._reserved_total
+        return self._reserved.get(request_uuid, 0)
+
+    def _release(self, request_uuid, size):
+        reserved = self._reserved.get(request_uuid, 0)
+        if size is None or size >= reserved:
+            size = reserved
+            self._reserved.pop(request_uuid, None)
+        else:
+            self._reserved[request_uuid] = reserved - size
+        self._reserved_total -= size
+
+    def _refresh(self):
+        interval = float(config.get_config_value('server', 'storagerefresh'))
+        now = time.time()
+        if self._refreshed is None or now - self._refreshed >= interval:
+            self._free = get_free_space(self.folder)
+            self._committed = 0
+            self._refreshed = now
+
+
+def get_quota(folder):
+    """Return :class:`StorageQuota` of given folder shared by the server
+    process
+    """
+
+    folder = os.path.abspath(folder)
+    with _QUOTAS_LOCK:
+        # reservations made before fork belong to the parent
+        key = (folder, os.getpid())
+        if key not in _QUOTAS:
+            for old_key in [k for k in _QUOTAS if k[0] == folder]:
+                del _QUOTAS[old_key]
+            _QUOTAS[key] = StorageQuota(folder)
+        return _QUOTAS[key]
+
+
 def get_free_space(folder):
-    """ Return folder/drive free space (in bytes)
+    """ Return folder/drive free space (in bytes) available to the server
     """
     import platform
 
@@ -149,7 +360,10 @@ def get_free_space(folder):
         ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(folder), None, None, ctypes.pointer(free_bytes))
         free_space = free_bytes.value
     else:
-        free_space = os.statvfs(folder).f_bfree
+        stat = os.statvfs(folder)
+        # f_bfree includes blocks reserved for root, the blocks are of
+        # fragment size
+        free_space = stat.f_bavail * stat.f_frsize
 
     LOGGER.debug('Free space: %s', free_space)
     return free_space
@@ -10,6 +10,7 @@ import lxml.etree
 from pywps.app import Process, Service
 from pywps.app.Common import Metadata
 from pywps import WPS, OWS
+from pywps import configuration
 from pywps.tests import assert_pywps_version, client_for
 
 class BadRequestTest(unittest.TestCase):
@@ -103,11 +104,58 @@ class CapabilitiesTest(unittest.TestCase):
         assert_pywps_version(resp)
 
 
+class CapabilitiesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        def pr1(): pass
+        self.service = Service(processes=[Process(pr1, 'pr1', 'Process 1')])
+        self.client = client_for(self.service)
+
+    def test_etag(self):
+        resp = self.client.get('?service=WPS&request=GetCapabilities')
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+        assert resp.headers['Last-Modified']
+
+        resp = self.client.get('?service=WPS&request=GetCapabilities',
+                               headers=[('If-None-Match', etag)])
+        assert resp.status_code == 304
+
+    def test_cached(self):
+        self.client.get('?service=WPS&request=GetCapabilities')
+        cached = self.service._capabilities
+        self.client.get('?service=WPS&request=GetCapabilities')
+        assert self.service._capabilities is cached
+
+    def test_invalidate_processes(self):
+        resp = self.client.get('?service=WPS&request=GetCapabilities')
+        etag = resp.headers['ETag']
+
+        def pr2(): pass
+        self.service.processes['pr2'] = Process(pr2, 'pr2', 'Process 2')
+        resp = self.client.get('?service=WPS&request=GetCapabilities',
+                               headers=[('If-None-Match', etag)])
+        assert resp.status_code == 200
+        names = resp.xpath_text('/wps:Capabilities'
+                                '/wps:ProcessOfferings'
+                                '/wps:Process'
+                                '/ows:Identifier')
+        assert sorted(names.split()) == ['pr1', 'pr2']
+
+    def test_invalidate_configuration(self):
+        self.client.get('?service=WPS&request=GetCapabilities')
+        cached = self.service._capabilities
+        configuration.load_configuration()
+        self.client.get('?service=WPS&request=GetCapabilities')
+        assert self.service._capabilities is not cached
+
+
 def load_tests(loader=None, tests=None, pattern=None):
     if not loader:
         loader = unittest.TestLoader()
     suite_list = [
         loader.loadTestsFromTestCase(BadRequestTest),
         loader.loadTestsFromTestCase(CapabilitiesTest),
+        loader.loadTestsFromTestCase(CapabilitiesCacheTest),
     ]
     return unittest.TestSuite(suite_list)
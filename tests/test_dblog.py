@@ -8,10 +8,16 @@
 """
 
 import unittest
+import datetime
+import threading
+import time
+import uuid
 
 from pywps import configuration
+from pywps import dblog
+from pywps.app import WPSRequest
 from pywps.dblog import get_session
-from pywps.dblog import ProcessInstance
+from pywps.dblog import ProcessInstance, ArchivedProcessInstance, RequestInstance
 
 
 class DBLogTest(unittest.TestCase):
@@ -27,6 +33,15 @@ class DBLogTest(unittest.TestCase):
         session = get_session()
         self.assertTrue(session)
 
+    def test_session_per_thread(self):
+        session = get_session()
+        self.assertIs(get_session(), session)
+        sessions = []
+        thread = threading.Thread(target=lambda: sessions.append(get_session()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(sessions[0], session)
+
     def test_db_content(self):
         session = get_session()
         null_time_end = session.query(ProcessInstance).filter(ProcessInstance.time_end == None)
@@ -41,12 +56,194 @@ class DBLogTest(unittest.TestCase):
         self.assertEqual(null_percent.count(), 0,
                          'There are no processes without percent loged')
 
+
+class QueueTest(unittest.TestCase):
+    """Queue of asynchronous requests test cases"""
+
+    def tearDown(self):
+        session = get_session()
+        session.query(RequestInstance).delete()
+        session.commit()
+        session.close()
+
+    def store(self, priority=0):
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.inputs = {}
+        request_uuid = str(uuid.uuid1())
+        dblog.store_process(request_uuid, request, priority=priority)
+        return request_uuid
+
+    def test_order(self):
+        first = self.store()
+        second = self.store()
+        important = self.store(priority=1)
+        self.assertEqual(len(dblog.get_stored()), 3)
+        self.assertEqual([dblog.claim_stored('owner', 60).uuid for _ in range(3)],
+                         [important, first, second])
+        self.assertIsNone(dblog.claim_stored('owner', 60))
+        self.assertEqual(len(dblog.get_stored()), 0)
+        self.assertEqual(len(dblog.get_claimed()), 3)
+
+    def test_lease_expired(self):
+        request_uuid = self.store()
+        self.assertEqual(dblog.claim_stored('dead', 0).uuid, request_uuid)
+        time.sleep(0.01)
+        self.assertEqual(len(dblog.get_stored()), 1)
+        claimed = dblog.claim_stored('owner', 60)
+        self.assertEqual(claimed.uuid, request_uuid)
+        self.assertEqual(claimed.lease_owner, 'owner')
+
+    def test_requeue(self):
+        request_uuid = self.store()
+        dblog.claim_stored('owner', 60)
+        dblog.requeue(request_uuid, 'other')
+        self.assertEqual(len(dblog.get_stored()), 0)
+        dblog.requeue(request_uuid, 'owner')
+        self.assertEqual(len(dblog.get_stored()), 1)
+        dblog.remove_stored(request_uuid)
+        self.assertEqual(len(dblog.get_stored()), 0)
+
+    def test_running(self):
+        class FakeResponse:
+            message = 'accepted'
+            status = 30
+            status_percentage = 0
+
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.version = '1.0.0'
+        request.identifier = 'queued'
+        request.inputs = {}
+        request_uuid = str(uuid.uuid1())
+        dblog.log_request(request_uuid, request)
+        dblog.update_response(request_uuid, FakeResponse)
+        running = len(dblog.get_running())
+
+        self.assertEqual(dblog.count_running(), running)
+
+        dblog.store_process(request_uuid, request)
+        self.assertEqual(len(dblog.get_running()), running - 1)
+        self.assertEqual(dblog.count_running(), running - 1)
+        self.assertEqual(dblog.count_stored(), 1)
+        dblog.claim_stored('owner', 60)
+        self.assertEqual(len(dblog.get_running()), running)
+        self.assertEqual(dblog.count_stored(), 0)
+
+        FakeResponse.status_percentage = 100
+        dblog.update_response(request_uuid, FakeResponse)
+        self.assertEqual(len(dblog.get_running()), running - 1)
+        self.assertEqual(dblog.count_running(), running - 1)
+
+        # late update of the status does not overwrite finished request
+        FakeResponse.status_percentage = 0
+        dblog.update_response(request_uuid, FakeResponse)
+        self.assertEqual(len(dblog.get_running()), running - 1)
+
+
+class ArchiveTest(unittest.TestCase):
+    """Archiving of finished requests test cases"""
+
+    def log(self, percentage, days):
+        class FakeResponse:
+            message = 'finished'
+            status = 30
+            status_percentage = percentage
+
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.version = '1.0.0'
+        request.identifier = 'archived'
+        request_uuid = str(uuid.uuid1())
+        dblog.log_request(request_uuid, request)
+        dblog.update_response(request_uuid, FakeResponse)
+
+        session = get_session()
+        instance = session.query(ProcessInstance).filter_by(uuid=request_uuid).one()
+        instance.time_start = instance.time_end = datetime.datetime.now() - datetime.timedelta(days=days)
+        session.commit()
+        session.close()
+        return request_uuid
+
+    def test_archive(self):
+        old = self.log(100, 10)
+        running = self.log(50, 10)
+        recent = self.log(100, 1)
+        dblog.archive_requests(5)
+
+        session = get_session()
+        self.assertEqual(session.query(ProcessInstance).filter(
+            ProcessInstance.uuid.in_([old, running, recent])).count(), 2)
+        [archived] = session.query(ArchivedProcessInstance).filter(
+            ArchivedProcessInstance.uuid.in_([old, running, recent])).all()
+        self.assertEqual(archived.uuid, old)
+        self.assertEqual(archived.percent_done, 100)
+        session.close()
+
+        # finish the request, so that it does not occupy the slot
+        class FakeResponse:
+            status_percentage = 100
+        dblog.update_response(running, FakeResponse)
+
+
+class StatusBufferTest(unittest.TestCase):
+    """Write-behind buffer of status updates test cases"""
+
+    def setUp(self):
+        configuration.CONFIG.set('logging', 'db_flush_interval', '3600')
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.version = '1.0.0'
+        request.identifier = 'buffered'
+        self.uuid = str(uuid.uuid1())
+        dblog.log_request(self.uuid, request)
+
+    def tearDown(self):
+        configuration.CONFIG.set('logging', 'db_flush_interval', '0')
+
+    def update(self, percentage):
+        class FakeResponse:
+            message = 'running'
+            status = 30
+            status_percentage = percentage
+        dblog.update_response(self.uuid, FakeResponse)
+
+    def get_percentage(self):
+        session = get_session()
+        percentage = session.query(ProcessInstance).filter_by(uuid=self.uuid).one().percent_done
+        session.close()
+        return percentage
+
+    def test_buffered(self):
+        self.update(0)
+        self.assertEqual(self.get_percentage(), 0)
+        self.update(10)
+        self.update(20)
+        self.assertEqual(self.get_percentage(), 0)
+        dblog.STATUS_BUFFER.flush()
+        self.assertEqual(self.get_percentage(), 20)
+        self.update(100)
+
+    def test_terminal(self):
+        self.update(0)
+        self.update(50)
+        self.update(100)
+        self.assertEqual(self.get_percentage(), 100)
+        # the request is finished, nothing is left in the buffer
+        self.update(60)
+        dblog.STATUS_BUFFER.flush()
+        self.assertEqual(self.get_percentage(), 100)
+
+
 def load_tests(loader=None, tests=None, pattern=None):
     """Load local tests
     """
     if not loader:
         loader = unittest.TestLoader()
     suite_list = [
-        loader.loadTestsFromTestCase(DBLogTest)
+        loader.loadTestsFromTestCase(DBLogTest),
+        loader.loadTestsFromTestCase(QueueTest),
+        loader.loadTestsFromTestCase(ArchiveTest),
+        loader.loadTestsFromTestCase(StatusBufferTest)
     ]
     return unittest.TestSuite(suite_list)
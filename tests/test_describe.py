@@ -131,6 +131,54 @@ class DescribeProcessTest(unittest.TestCase):
         assert [pr.identifier for pr in result] == ['hello', 'ping']
 
 
+class DescribeProcessCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        def hello(request):
+            pass
+
+        self.processes = [
+            Process(hello, 'hello', 'Process Hello',
+                    inputs=[LiteralInput('name', 'Input name', data_type='string')],
+                    outputs=[LiteralOutput('output', 'Output', data_type='string')]),
+            Process(hello, 'hello2', 'Process Hello 2', version='1.0'),
+        ]
+        self.service = Service(processes=self.processes)
+        self.client = client_for(self.service)
+
+    def test_same_as_tree(self):
+        """Response assembled from fragments equals to serialized tree"""
+        from pywps.app.Service import _describe_doc
+        from pywps.app.basic import xml_serialize
+
+        expected = xml_serialize(_describe_doc([p.describe_xml() for p in self.processes]))
+        resp = self.service.describe(['hello', 'hello2'])
+        self.assertEqual(resp.get_data(), expected)
+
+    def test_fragment_cache(self):
+        self.service.describe(['hello'])
+        fragment = self.service._descriptions[('hello', 'None')][1]
+        self.service.describe(['hello', 'hello2'])
+        self.assertIs(self.service._descriptions[('hello', 'None')][1], fragment)
+        self.assertIn(('hello2', '1.0'), self.service._descriptions)
+
+    def test_all(self):
+        resp = self.client.get('?Request=DescribeProcess&service=wps&version=1.0.0&identifier=all')
+        result = get_describe_result(resp)
+        assert [pr.identifier for pr in result] == ['hello', 'hello2']
+
+        resp = self.client.get('?Request=DescribeProcess&service=wps&version=1.0.0&identifier=all',
+                               headers=[('If-None-Match', resp.headers['ETag'])])
+        assert resp.status_code == 304
+
+        def ping(request):
+            pass
+        self.service.processes['ping'] = Process(ping, 'ping', 'Process Ping')
+        resp = self.client.get('?Request=DescribeProcess&service=wps&version=1.0.0&identifier=all')
+        result = get_describe_result(resp)
+        assert [pr.identifier for pr in result] == ['hello', 'hello2', 'ping']
+
+
 class DescribeProcessInputTest(unittest.TestCase):
 
     def describe_process(self, process):
@@ -298,6 +346,7 @@ def load_tests(loader=None, tests=None, pattern=None):
         loader = unittest.TestLoader()
     suite_list = [
         loader.loadTestsFromTestCase(DescribeProcessTest),
+        loader.loadTestsFromTestCase(DescribeProcessCacheTest),
         loader.loadTestsFromTestCase(DescribeProcessInputTest),
         loader.loadTestsFromTestCase(InputDescriptionTest),
     ]
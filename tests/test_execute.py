@@ -5,17 +5,29 @@
 ##################################################################
 
 import unittest
+import base64
+import io
+import threading
 import lxml.etree
 import json
+import re
+import shutil
 import tempfile
+import time
+import uuid
 import os.path
 from pywps import Service, Process, LiteralOutput, LiteralInput,\
     BoundingBoxOutput, BoundingBoxInput, Format, ComplexInput, ComplexOutput
 from pywps.validator.base import emptyvalidator
 from pywps.validator.complexvalidator import validategml
-from pywps.exceptions import InvalidParameterValue
+from pywps.exceptions import InvalidParameterValue, FileSizeExceeded, NoApplicableCode
 from pywps import get_inputs_from_xml, get_output_from_xml
 from pywps import E, WPS, OWS
+from pywps import configuration, dblog
+from pywps.app import WPSRequest, WPSResponse
+from pywps.app import fetcher, refcache, scheduler
+from pywps.app.fetcher import Fetcher
+from pywps.app.WPSResponse import STATUS
 from pywps.app.basic import xpath_ns
 from pywps._compat import text_type
 from pywps.tests import client_for, assert_response_success
@@ -24,6 +36,9 @@ from pywps._compat import PY2
 from pywps._compat import StringIO
 if PY2:
     from owslib.ows import BoundingBox
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+else:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
 
 
 def create_ultimate_question():
@@ -227,6 +242,671 @@ class ExecuteTest(unittest.TestCase):
             './wps:Data/ows:BoundingBox/ows:LowerCorner')[0].text)
 
 
+class ProcessInstanceTest(unittest.TestCase):
+    """Tests for per request process instances"""
+
+    def test_new_instance(self):
+        process = create_greeter()
+        instance = process.new_instance()
+        self.assertIsNot(instance, process)
+        self.assertIs(instance.handler, process.handler)
+        self.assertIs(instance.metadata, process.metadata)
+        self.assertIsNot(instance.outputs[0], process.outputs[0])
+        self.assertIs(instance.inputs[0].allowed_values, process.inputs[0].allowed_values)
+
+        instance.set_workdir(tempfile.mkdtemp())
+        instance.outputs[0].data = 'hello'
+        self.assertIsNone(process.workdir)
+        self.assertIsNone(process.inputs[0].workdir)
+        self.assertIsNone(process.outputs[0].data)
+
+    def test_new_instance_method_handler(self):
+        class Greeter(Process):
+            def __init__(self):
+                Process.__init__(self, self._handler, identifier='greeter', title='Greeter',
+                                 outputs=[LiteralOutput('workdir', 'Workdir', data_type='string')])
+
+            def _handler(self, request, response):
+                response.outputs['workdir'].data = self.workdir
+                return response
+
+        process = Greeter()
+        instance = process.new_instance()
+        self.assertIs(instance.handler.__self__, instance)
+        self.assertIs(process.handler.__self__, process)
+
+        client = client_for(Service(processes=[process]))
+        resp = client.get('?service=wps&version=1.0.0&Request=Execute&identifier=greeter')
+        assert_response_success(resp)
+        workdir = get_output(resp.xml)['workdir']
+        self.assertTrue(os.path.basename(workdir).startswith('pywps_process_'))
+        self.assertIsNone(process.workdir)
+
+
+class ThreadSafeExecuteTest(unittest.TestCase):
+    """Tests for Execute without changes of process global state"""
+
+    def setUp(self):
+        configuration.get_config_value('server', 'threadsafe')
+        configuration.CONFIG.set('server', 'threadsafe', 'true')
+        configuration.CONFIG.set('server', 'sethomedir', 'true')
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'threadsafe', 'false')
+        configuration.CONFIG.set('server', 'sethomedir', 'false')
+
+    def test_execute(self):
+        def handler(request, response):
+            workdir = response.process.workdir
+            with open(os.path.join(workdir, 'output.txt'), 'w') as f:
+                f.write('hello')
+            # relative file names are taken relative to workdir
+            response.outputs['text'].file = 'output.txt'
+            assert response.outputs['text'].file == os.path.join(workdir, 'output.txt')
+            response.outputs['cwd'].data = os.getcwd()
+            response.outputs['home'].data = response.process.environ['HOME']
+            return response
+
+        process = Process(handler=handler, identifier='threadsafe', title='Thread safe',
+                          outputs=[LiteralOutput('cwd', 'Current directory', data_type='string'),
+                                   LiteralOutput('home', 'Home directory', data_type='string'),
+                                   ComplexOutput('text', 'Text', supported_formats=[Format('text/plain')])])
+        home = os.environ.get('HOME')
+        client = client_for(Service(processes=[process]))
+        resp = client.get('?service=wps&version=1.0.0&Request=Execute&identifier=threadsafe')
+        assert_response_success(resp)
+        [cwd] = xpath_ns(resp.xml, '//wps:Output[ows:Identifier="cwd"]/wps:Data/wps:LiteralData')
+        [process_home] = xpath_ns(resp.xml, '//wps:Output[ows:Identifier="home"]/wps:Data/wps:LiteralData')
+        self.assertEqual(cwd.text, os.getcwd())
+        self.assertTrue(os.path.basename(process_home.text).startswith('pywps_process_'))
+        self.assertEqual(os.environ.get('HOME'), home)
+
+
+class StatusDocumentTest(unittest.TestCase):
+    """Tests for writing of the status document"""
+
+    def setUp(self):
+        self.outputpath = configuration.get_config_value('server', 'outputpath')
+        self.tmpdir = tempfile.mkdtemp()
+        configuration.CONFIG.set('server', 'outputpath', self.tmpdir)
+        configuration.CONFIG.set('server', 'statusdelta', '50')
+
+        self.process = create_greeter().new_instance()
+        self.process._set_uuid(str(uuid.uuid1()))
+        self.process.set_workdir(tempfile.mkdtemp(dir=self.tmpdir))
+        request = WPSRequest()
+        request.lineage = 'false'
+        self.response = WPSResponse(self.process, request, self.process.uuid)
+        self.response.status = STATUS.STORE_AND_UPDATE_STATUS
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'outputpath', self.outputpath)
+        configuration.CONFIG.set('server', 'statusdelta', '0')
+        shutil.rmtree(self.tmpdir)
+
+    def get_status(self):
+        with open(self.process.status_location, 'rb') as f:
+            doc = lxml.etree.fromstring(f.read())
+        [status] = xpath_ns(doc, '/wps:ExecuteResponse/wps:Status/*')
+        return (lxml.etree.QName(status).localname, status.get('percentCompleted'))
+
+    def test_throttled(self):
+        self.response.update_status('started', 10)
+        self.assertEqual(self.get_status(), ('ProcessStarted', '10'))
+        self.response.update_status('running', 20)
+        self.assertEqual(self.get_status(), ('ProcessStarted', '10'))
+        self.response.update_status('running', 60)
+        self.assertEqual(self.get_status(), ('ProcessStarted', '60'))
+
+        # the final status is always written
+        self.response.update_status('finished', 70, STATUS.DONE_STATUS, clean=False)
+        self.assertEqual(self.get_status(), ('ProcessSucceeded', None))
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([os.path.basename(self.process.workdir),
+                                                                  os.path.basename(self.process.status_location)]))
+
+
+class ResultCacheTest(unittest.TestCase):
+    """Tests for cache of results of deterministic processes"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outputpath = configuration.get_config_value('server', 'outputpath')
+        configuration.CONFIG.set('server', 'outputpath', self.tmpdir)
+        configuration.CONFIG.set('server', 'resultcache', os.path.join(self.tmpdir, 'cache'))
+        self.calls = []
+
+        def handler(request, response):
+            self.calls.append(request.inputs['name'][0].data)
+            response.outputs['message'].data = 'Hello %s!' % request.inputs['name'][0].data
+            with open(os.path.join(response.process.workdir, 'message.txt'), 'w') as f:
+                f.write('Hello %s!' % request.inputs['name'][0].data)
+            response.outputs['text'].file = 'message.txt'
+            return response
+
+        self.process = Process(handler=handler, identifier='cached', title='Cached',
+                               inputs=[LiteralInput('name', 'Input name', data_type='string')],
+                               outputs=[LiteralOutput('message', 'Output message', data_type='string'),
+                                        ComplexOutput('text', 'Text', supported_formats=[Format('text/plain')])],
+                               store_supported=True, status_supported=True, cache_ttl=60)
+        self.client = client_for(Service(processes=[self.process]))
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'outputpath', self.outputpath)
+        configuration.CONFIG.set('server', 'resultcache', '')
+        configuration.CONFIG.set('server', 'resultcachesize', '100mb')
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, name):
+        resp = self.client.get('?service=wps&version=1.0.0&Request=Execute&identifier=cached'
+                               '&datainputs=name=%s' % name)
+        assert_response_success(resp)
+        [message] = xpath_ns(resp.xml, '//wps:Output[ows:Identifier="message"]/wps:Data/wps:LiteralData')
+        [text] = xpath_ns(resp.xml, '//wps:Output[ows:Identifier="text"]/wps:Data/wps:ComplexData')
+        self.assertEqual(message.text, 'Hello %s!' % name)
+        self.assertEqual(text.text, 'Hello %s!' % name)
+
+    def test_cached(self):
+        self.execute('foo')
+        self.execute('foo')
+        self.execute('bar')
+        self.assertEqual(self.calls, ['foo', 'bar'])
+
+    def test_expired(self):
+        self.process.cache_ttl = 0.01
+        self.execute('foo')
+        time.sleep(0.02)
+        self.execute('foo')
+        self.assertEqual(self.calls, ['foo', 'foo'])
+
+    def test_evicted(self):
+        configuration.CONFIG.set('server', 'resultcachesize', '0')
+        self.execute('foo')
+        self.execute('foo')
+        self.assertEqual(self.calls, ['foo', 'foo'])
+        self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'cache')), [])
+
+    def test_async(self):
+        for _ in range(2):
+            request_uuid = str(uuid.uuid1())
+            request = WPSRequest()
+            request.operation = 'execute'
+            request.version = '1.0.0'
+            request.identifier = 'cached'
+            request.store_execute = 'true'
+            request.status = 'true'
+            request.lineage = 'false'
+            request.inputs = {'name': [LiteralInput('name', 'Input name', data_type='string')]}
+            request.inputs['name'][0].data = 'foo'
+            request.outputs = {}
+            request.raw = False
+            dblog.store_process(request_uuid, request)
+            scheduler.run_job((request_uuid, None, request.json))
+
+            instance = self.process.new_instance()
+            instance._set_uuid(request_uuid)
+            with open(instance.status_location, 'rb') as f:
+                doc = lxml.etree.fromstring(f.read())
+            [message] = xpath_ns(doc, '//wps:Output[ows:Identifier="message"]/wps:Data/wps:LiteralData')
+            self.assertEqual(message.text, 'Hello foo!')
+        self.assertEqual(self.calls, ['foo'])
+
+
+class RawDataOutputTest(unittest.TestCase):
+    """Tests for outputs requested as RawDataOutput"""
+
+    def setUp(self):
+        self.content = os.urandom(200000)
+        self.workdirs = []
+
+        def handler(request, response):
+            self.workdirs.append(response.process.workdir)
+            with open(os.path.join(response.process.workdir, 'raster.tif'), 'wb') as f:
+                f.write(self.content)
+            response.outputs['raster'].file = 'raster.tif'
+            response.outputs['size'].data = len(self.content)
+            return response
+
+        process = Process(handler=handler, identifier='raster', title='Raster',
+                          outputs=[ComplexOutput('raster', 'Raster', supported_formats=[Format('image/tiff')]),
+                                   LiteralOutput('size', 'Size', data_type='integer')])
+        self.client = client_for(Service(processes=[process]))
+
+    def execute(self, output, **kwargs):
+        return self.client.get('?service=wps&version=1.0.0&Request=Execute&identifier=raster'
+                               '&rawdataoutput=%s' % output, **kwargs)
+
+    def test_file(self):
+        resp = self.execute('raster')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Content-Type'], 'image/tiff')
+        self.assertEqual(resp.headers['Content-Length'], str(len(self.content)))
+        self.assertEqual(resp.headers['Accept-Ranges'], 'bytes')
+        self.assertEqual(resp.get_data(), self.content)
+        self.assertTrue(os.path.isdir(self.workdirs[0]))
+        resp.close()
+        self.assertFalse(os.path.isdir(self.workdirs[0]))
+
+    def test_range(self):
+        resp = self.execute('raster', headers={'Range': 'bytes=100000-100009'})
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers['Content-Length'], '10')
+        self.assertEqual(resp.headers['Content-Range'], 'bytes 100000-100009/200000')
+        self.assertEqual(resp.get_data(), self.content[100000:100010])
+        resp.close()
+        self.assertFalse(os.path.isdir(self.workdirs[0]))
+
+    def test_range_not_satisfiable(self):
+        resp = self.execute('raster', headers={'Range': 'bytes=300000-'})
+        self.assertEqual(resp.status_code, 416)
+        self.assertFalse(os.path.isdir(self.workdirs[0]))
+
+    def test_literal(self):
+        resp = self.execute('size')
+        self.assertEqual(resp.get_data(), b'200000')
+        resp.close()
+
+
+class StreamedResponseTest(unittest.TestCase):
+    """Tests for complex outputs embedded in the response document"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outputpath = configuration.get_config_value('server', 'outputpath')
+        configuration.CONFIG.set('server', 'outputpath', self.tmpdir)
+        self.binary = os.urandom(100000)
+        self.workdirs = []
+        self.encoding = 'UTF-8'
+        self.gml = ('<?xml version="1.0" encoding="%s"?>\n<gml:FeatureCollection '
+                    'xmlns:gml="http://www.opengis.net/gml">' +
+                    '<gml:featureMember>\u017elu\u0165ou\u010dk\u00fd</gml:featureMember>' * 10000 +
+                    '</gml:FeatureCollection>')
+
+        def handler(request, response):
+            self.workdirs.append(response.process.workdir)
+            with io.open(os.path.join(response.process.workdir, 'features.gml'), 'w',
+                         encoding=self.encoding) as f:
+                f.write(self.gml % self.encoding)
+            response.outputs['gml'].file = 'features.gml'
+            response.outputs['text'].data = 'a < b && c\r\n'
+            with open(os.path.join(response.process.workdir, 'image.png'), 'wb') as f:
+                f.write(self.binary)
+            response.outputs['binary'].file = 'image.png'
+            return response
+
+        process = Process(handler=handler, identifier='streamed', title='Streamed',
+                          outputs=[ComplexOutput('gml', 'GML', supported_formats=[Format('application/gml+xml')]),
+                                   ComplexOutput('text', 'Text', supported_formats=[Format('text/plain')]),
+                                   ComplexOutput('binary', 'Binary',
+                                                 supported_formats=[Format('image/png', encoding='base64')])])
+        self.client = client_for(Service(processes=[process]))
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'outputpath', self.outputpath)
+        configuration.CONFIG.set('server', 'prettyprint', 'true')
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self):
+        resp = self.client.get('?service=wps&version=1.0.0&Request=Execute&identifier=streamed')
+        assert_response_success(resp)
+        resp.close()
+        self.assertFalse(os.path.isdir(self.workdirs[-1]))
+        return resp
+
+    def get_data(self, doc, identifier):
+        [data] = xpath_ns(doc, '//wps:Output[ows:Identifier="%s"]/wps:Data/wps:ComplexData' % identifier)
+        return data
+
+    def test_outputs(self):
+        resp = self.execute()
+
+        [collection] = self.get_data(resp.xml, 'gml')
+        self.assertEqual(len(collection), 10000)
+        self.assertEqual(collection[-1].text, '\u017elu\u0165ou\u010dk\u00fd')
+        self.assertEqual(self.get_data(resp.xml, 'text').text, 'a < b && c\r\n')
+        self.assertEqual(base64.b64decode(self.get_data(resp.xml, 'binary').text), self.binary)
+
+        # the same document is stored as status document
+        [status_file] = [name for name in os.listdir(self.tmpdir) if name.endswith('.xml')]
+        with open(os.path.join(self.tmpdir, status_file), 'rb') as f:
+            doc = lxml.etree.fromstring(f.read())
+        self.assertEqual(base64.b64decode(self.get_data(doc, 'binary').text), self.binary)
+
+    def test_pretty_print(self):
+        self.assertIn(b'\n  <wps:Process', self.execute().data)
+        configuration.CONFIG.set('server', 'prettyprint', 'false')
+        self.assertNotIn(b'\n  <wps:Process', self.execute().data)
+
+    def test_parsed(self):
+        # documents in other encodings are embedded as parsed tree
+        self.encoding = 'ISO-8859-2'
+        resp = self.execute()
+        [collection] = self.get_data(resp.xml, 'gml')
+        self.assertEqual(len(collection), 10000)
+        self.assertEqual(collection[0].text, '\u017elu\u0165ou\u010dk\u00fd')
+
+
+class Base64InputTest(unittest.TestCase):
+    """Tests for base64 encoded complex inputs"""
+
+    def setUp(self):
+        self.inputs = []
+
+        def handler(request, response):
+            self.inputs.append((request.inputs['image'][0].file, request.inputs['image'][0].data))
+            response.outputs['size'].data = len(request.inputs['image'][0].data)
+            return response
+
+        process = Process(handler=handler, identifier='image', title='Image',
+                          inputs=[ComplexInput('image', 'Image', supported_formats=[Format('image/png')])],
+                          outputs=[LiteralOutput('size', 'Size', data_type='integer')])
+        self.client = client_for(Service(processes=[process]))
+
+    def execute(self, data):
+        request_doc = WPS.Execute(
+            OWS.Identifier('image'),
+            WPS.DataInputs(
+                WPS.Input(
+                    OWS.Identifier('image'),
+                    WPS.Data(WPS.ComplexData(data, encoding='base64', mimeType='image/png')))),
+            version='1.0.0')
+        return self.client.post_xml(doc=request_doc)
+
+    def test_decoded_to_file(self):
+        content = os.urandom(100000)
+        resp = self.execute(re.sub('(.{76})', '\\1\\n', base64.b64encode(content).decode('ascii')))
+        assert_response_success(resp)
+        self.assertEqual(get_output(resp.xml), {'size': '100000'})
+        [(file_name, data)] = self.inputs
+        self.assertEqual(data, content)
+        self.assertTrue(os.path.basename(os.path.dirname(file_name)).startswith('pywps_process_'))
+
+    def test_invalid(self):
+        resp = self.execute('abc')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(self.inputs, [])
+
+
+class SpooledInputTest(unittest.TestCase):
+    """Tests for inline complex inputs stored while parsing"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = configuration.get_config_value('server', 'workdir')
+        configuration.CONFIG.set('server', 'workdir', self.tmpdir)
+        self.inputs = []
+
+        def handler(request, response):
+            self.inputs.append((request.inputs['gml'][0].file, request.inputs['gml'][0].data,
+                                request.inputs['text'][0].data))
+            return response
+
+        process = Process(handler=handler, identifier='spooled', title='Spooled',
+                          inputs=[ComplexInput('gml', 'GML', supported_formats=[Format('application/gml+xml')]),
+                                  ComplexInput('text', 'Text', supported_formats=[Format('text/plain')])])
+        self.client = client_for(Service(processes=[process]))
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'workdir', self.workdir)
+        configuration.CONFIG.set('server', 'spoolinputs', 'true')
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, identifier='spooled'):
+        request_doc = WPS.Execute(
+            OWS.Identifier(identifier),
+            WPS.DataInputs(
+                WPS.Input(
+                    OWS.Identifier('gml'),
+                    WPS.Data(WPS.ComplexData(
+                        E.FeatureCollection(E.featureMember('a & b')),
+                        mimeType='application/gml+xml'))),
+                WPS.Input(
+                    OWS.Identifier('text'),
+                    WPS.Data(WPS.ComplexData('a < b', mimeType='text/plain')))),
+            version='1.0.0')
+        return self.client.post_xml(doc=request_doc)
+
+    def test_spooled(self):
+        assert_response_success(self.execute())
+        [(file_name, gml, text)] = self.inputs
+        self.assertTrue(os.path.basename(os.path.dirname(file_name)).startswith('pywps_process_'))
+        self.assertTrue(os.path.basename(file_name).startswith('pywps_input_'))
+        self.assertEqual(lxml.etree.fromstring(gml)[0].text, 'a & b')
+        self.assertEqual(text, 'a < b')
+        self.assertFalse([name for name in os.listdir(self.tmpdir) if name.startswith('pywps_input_')])
+
+    def test_not_executed(self):
+        resp = self.execute('unknown')
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_disabled(self):
+        configuration.CONFIG.set('server', 'spoolinputs', 'false')
+        assert_response_success(self.execute())
+        [(file_name, gml, text)] = self.inputs
+        self.assertFalse(os.path.basename(file_name).startswith('pywps_input_'))
+        self.assertEqual(lxml.etree.fromstring(gml)[0].text, 'a & b')
+        self.assertEqual(text, 'a < b')
+
+
+class ReferenceInputTest(unittest.TestCase):
+    """Tests for download of reference inputs"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = tempfile.mkdtemp(dir=self.tmpdir)
+        self.data = bytes(bytearray(range(256))) * 400
+        self.href = 'file://' + os.path.join(self.tmpdir, 'reference.bin')
+        with open(os.path.join(self.tmpdir, 'reference.bin'), 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'maxsingleinputsize', '1mb')
+        shutil.rmtree(self.tmpdir)
+
+    def create_input(self):
+        [data_input] = self.create_inputs([self.href])
+        return data_input
+
+    def create_inputs(self, hrefs, fetcher=None):
+        inpt = ComplexInput('complex', 'Complex input', max_occurs=len(hrefs),
+                            supported_formats=[Format('application/octet-stream')])
+        inpt.workdir = self.workdir
+        return Service().create_complex_inputs(inpt, [{'href': href} for href in hrefs], fetcher)
+
+    def test_binary(self):
+        data_input = self.create_input()
+        with open(data_input.file, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_concurrent(self):
+        fetcher = Fetcher(threads=4)
+        data_inputs = self.create_inputs([self.href] * 5, fetcher)
+        fetcher.wait()
+        self.assertEqual(len(set(data_input.file for data_input in data_inputs)), 5)
+        for data_input in data_inputs:
+            with open(data_input.file, 'rb') as f:
+                self.assertEqual(f.read(), self.data)
+
+    def test_concurrent_failure(self):
+        fetcher = Fetcher(threads=4)
+        missing = 'file://' + os.path.join(self.tmpdir, 'missing.bin')
+        self.create_inputs([self.href, missing + '1', self.href, missing + '2'], fetcher)
+        with self.assertRaises(NoApplicableCode) as cm:
+            fetcher.wait()
+        self.assertIn('missing.bin1', cm.exception.description)
+
+    def test_size_exceeded(self):
+        configuration.CONFIG.set('server', 'maxsingleinputsize', '50kb')
+        with self.assertRaises(FileSizeExceeded):
+            self.create_input()
+        self.assertEqual(os.listdir(self.workdir), [])
+
+    def test_size_exceeded_while_streaming(self):
+        class Reference(io.BytesIO):
+            headers = {}
+
+        file_name = os.path.join(self.workdir, 'reference.bin')
+        with self.assertRaises(FileSizeExceeded):
+            fetcher.download(Reference(self.data), file_name, 50 * 1024)
+        self.assertFalse(os.path.exists(file_name))
+        self.assertEqual(fetcher.download(Reference(self.data), file_name, len(self.data)), len(self.data))
+
+
+class ReferenceHandler(BaseHTTPRequestHandler):
+    """Data server, which fails first request of each path with 503"""
+
+    protocol_version = 'HTTP/1.1'
+    clients = set()
+    failed = set()
+
+    def do_GET(self):
+        ReferenceHandler.clients.add(self.client_address)
+        if self.path.startswith('/unavailable') and self.path not in ReferenceHandler.failed:
+            ReferenceHandler.failed.add(self.path)
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', '5')
+        self.end_headers()
+        self.wfile.write(b'hello')
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpReferenceTest(unittest.TestCase):
+    """Tests for download of HTTP reference inputs"""
+
+    def setUp(self):
+        configuration.CONFIG.set('server', 'referencebackoff', '0')
+        self.server = HTTPServer(('127.0.0.1', 0), ReferenceHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.workdir = tempfile.mkdtemp()
+        ReferenceHandler.clients.clear()
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'referencebackoff', '0.5')
+        fetcher.get_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.workdir)
+
+    def create_inputs(self, paths):
+        inpt = ComplexInput('complex', 'Complex input', max_occurs=len(paths),
+                            supported_formats=[Format('text/plain')])
+        inpt.workdir = self.workdir
+        hrefs = ['http://127.0.0.1:%i%s' % (self.server.server_port, path) for path in paths]
+        return Service().create_complex_inputs(inpt, [{'href': href} for href in hrefs])
+
+    def test_keep_alive(self):
+        data_inputs = self.create_inputs(['/a.txt', '/b.txt', '/c.txt'])
+        self.assertEqual([data_input.data for data_input in data_inputs], ['hello'] * 3)
+        self.assertEqual(len(ReferenceHandler.clients), 1)
+
+    def test_retry(self):
+        [data_input] = self.create_inputs(['/unavailable.txt'])
+        self.assertEqual(data_input.data, 'hello')
+
+
+class CacheHandler(BaseHTTPRequestHandler):
+    """Data server with cache headers given by the path"""
+
+    protocol_version = 'HTTP/1.1'
+    requests = []
+
+    def do_GET(self):
+        CacheHandler.requests.append((self.path, self.headers.get('If-None-Match')))
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.path.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"v1"')
+        if self.path.startswith('/fresh'):
+            self.send_header('Cache-Control', 'max-age=3600')
+        elif self.path.startswith('/nostore'):
+            self.send_header('Cache-Control', 'no-store')
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ReferenceCacheTest(unittest.TestCase):
+    """Tests for cache of HTTP reference inputs"""
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), CacheHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.workdir = tempfile.mkdtemp()
+        self.cache = refcache.ReferenceCache(os.path.join(self.workdir, 'cache'), 1024)
+        CacheHandler.requests = []
+
+    def tearDown(self):
+        fetcher.get_session().close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.workdir)
+
+    def fetch(self, path, file_name):
+        href = 'http://127.0.0.1:%i%s' % (self.server.server_port, path)
+        file_name = os.path.join(self.workdir, file_name)
+        self.cache.fetch(href, file_name, 1024)
+        with open(file_name, 'rb') as f:
+            self.assertEqual(f.read(), path.encode('utf-8'))
+        return os.stat(file_name)
+
+    def test_revalidate(self):
+        first = self.fetch('/data.txt', 'a.txt')
+        second = self.fetch('/data.txt', 'b.txt')
+        self.assertEqual(CacheHandler.requests, [('/data.txt', None), ('/data.txt', '"v1"')])
+        self.assertEqual(first.st_ino, second.st_ino)
+
+    def test_fresh(self):
+        self.fetch('/fresh.txt', 'a.txt')
+        self.fetch('/fresh.txt', 'b.txt')
+        self.assertEqual(len(CacheHandler.requests), 1)
+
+    def test_no_store(self):
+        self.fetch('/nostore.txt', 'a.txt')
+        self.fetch('/nostore.txt', 'b.txt')
+        self.assertEqual(CacheHandler.requests, [('/nostore.txt', None)] * 2)
+
+    def test_evict(self):
+        self.cache.max_size = len('/fresh1.txt')
+        self.fetch('/fresh1.txt', 'a.txt')
+        self.fetch('/fresh2.txt', 'b.txt')
+        self.fetch('/fresh1.txt', 'c.txt')
+        self.assertEqual(len(CacheHandler.requests), 3)
+
+    def test_service(self):
+        configuration.CONFIG.set('server', 'referencecache', os.path.join(self.workdir, 'cache'))
+        try:
+            inpt = ComplexInput('complex', 'Complex input', supported_formats=[Format('text/plain')])
+            inpt.workdir = self.workdir
+            href = 'http://127.0.0.1:%i/fresh.txt' % self.server.server_port
+            for _ in range(2):
+                [data_input] = Service().create_complex_inputs(inpt, [{'href': href}])
+                self.assertEqual(data_input.data, '/fresh.txt')
+        finally:
+            configuration.CONFIG.set('server', 'referencecache', '')
+        self.assertEqual(len(CacheHandler.requests), 1)
+
+
 class ExecuteXmlParserTest(unittest.TestCase):
     """Tests for Execute request XML Parser
     """
@@ -398,6 +1078,17 @@ def load_tests(loader=None, tests=None, pattern=None):
         loader = unittest.TestLoader()
     suite_list = [
         loader.loadTestsFromTestCase(ExecuteTest),
+        loader.loadTestsFromTestCase(ProcessInstanceTest),
+        loader.loadTestsFromTestCase(ThreadSafeExecuteTest),
+        loader.loadTestsFromTestCase(StatusDocumentTest),
+        loader.loadTestsFromTestCase(ResultCacheTest),
+        loader.loadTestsFromTestCase(RawDataOutputTest),
+        loader.loadTestsFromTestCase(StreamedResponseTest),
+        loader.loadTestsFromTestCase(Base64InputTest),
+        loader.loadTestsFromTestCase(SpooledInputTest),
+        loader.loadTestsFromTestCase(ReferenceInputTest),
+        loader.loadTestsFromTestCase(HttpReferenceTest),
+        loader.loadTestsFromTestCase(ReferenceCacheTest),
         loader.loadTestsFromTestCase(ExecuteXmlParserTest),
     ]
     return unittest.TestSuite(suite_list)
@@ -6,7 +6,10 @@
 # licensed under MIT, Please consult LICENSE.txt for details     #
 ##################################################################
 
+import base64
 import os
+import re
+import shutil
 import tempfile
 import datetime
 import unittest
@@ -17,9 +20,12 @@ from pywps.inout.basic import IOHandler, SOURCE_TYPE, SimpleHandler, BBoxInput,
     ComplexInput, ComplexOutput, LiteralInput, LiteralOutput
 from pywps.inout import BoundingBoxInput as BoundingBoxInputXML
 from pywps.inout.literaltypes import convert, AllowedValue
+from pywps.inout import storage
+from pywps.inout.storage import FileStorage, StorageQuota, store_file
+from pywps import configuration
 from pywps._compat import StringIO, text_type
 from pywps.validator.base import emptyvalidator
-from pywps.exceptions import InvalidParameterValue
+from pywps.exceptions import InvalidParameterValue, NotEnoughStorage
 from pywps.validator.mode import MODE
 
 from lxml import etree
@@ -85,8 +91,7 @@ class IOHandlerTest(unittest.TestCase):
             source = StringIO(text_type(self._value))
             self.iohandler.stream = source
 
-        self.skipTest('Memory object not implemented')
-        self.assertEqual(stream_val, self.iohandler.memory_object,
+        self.assertEqual(text_type(self._value).encode('utf-8'), bytes(bytearray(self.iohandler.memory_object)),
                          'Memory object obtained')
 
     def test_data(self):
@@ -123,8 +128,49 @@ class IOHandlerTest(unittest.TestCase):
         self.assertTrue(os.path.isdir(self.iohandler.workdir))
 
     def test_memory(self):
-        """Test data input IOHandler"""
-        self.skipTest('Memory object not implemented')
+        """Test memory object input IOHandler"""
+        self._value = b'lalala'
+        self.iohandler.memory_object = bytearray(self._value)
+        self.assertEqual(self.iohandler.source_type, SOURCE_TYPE.MEMORY)
+        self.assertEqual(self.iohandler.data, self._value)
+        self.assertEqual(self.iohandler.stream.read(), self._value)
+        with open(self.iohandler.file, 'rb') as f:
+            self.assertEqual(f.read(), self._value)
+        self.assertEqual(bytes(bytearray(self.iohandler.memory_object)), self._value)
+
+    def test_memory_map(self):
+        """Test memory object of file IOHandler"""
+        self._value = os.urandom(100000)
+        file_name = os.path.join(self.iohandler.workdir, 'raster.bin')
+        with open(file_name, 'wb') as f:
+            f.write(self._value)
+        self.iohandler.file = file_name
+
+        memory_object = self.iohandler.memory_object
+        self.assertEqual(memory_object[50000:50010], self._value[50000:50010])
+        self.assertEqual(len(memory_object), 100000)
+        with self.assertRaises(TypeError):
+            memory_object[0:1] = b'a'
+        self.assertIs(self.iohandler.memory_object, memory_object)
+
+        # bytes are viewed without copy
+        self.iohandler.data = self._value
+        self.assertIs(self.iohandler.memory_object.obj, self._value)
+
+    def test_base64(self):
+        """Test base64 encoded data IOHandler"""
+        self._value = os.urandom(200000)
+        # with line breaks
+        self.iohandler.base64 = re.sub('(.{76})', '\\1\\n', base64.b64encode(self._value).decode('ascii'))
+        self.assertEqual(self.iohandler.source_type, SOURCE_TYPE.FILE)
+        self.assertEqual(os.path.dirname(self.iohandler.file), self.iohandler.workdir)
+        self.assertEqual(self.iohandler.data, self._value)
+        self.assertEqual(self.iohandler.base64, base64.b64encode(self._value))
+
+    def test_base64_invalid(self):
+        with self.assertRaises((TypeError, ValueError)):
+            self.iohandler.base64 = 'abc'
+        self.assertEqual(os.listdir(self.iohandler.workdir), [])
 
     def test_data_bytes(self):
         self._value = b'aa'
@@ -381,6 +427,75 @@ class BoxOutputTest(unittest.TestCase):
         self.bbox_out.store = storage
         self.assertEqual(self.bbox_out.store, storage)
 
+class FileStorageTest(unittest.TestCase):
+    """FileStorage test cases"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.outputpath = configuration.get_config_value('server', 'outputpath')
+        configuration.CONFIG.set('server', 'outputpath', os.path.join(self.tmp_dir, 'outputs'))
+        self.source = os.path.join(self.tmp_dir, 'output.txt')
+        with open(self.source, 'w') as f:
+            f.write('output')
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'outputpath', self.outputpath)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_link(self):
+        output = ComplexOutput('complex', supported_formats=[Format('text/plain')])
+        output.file = self.source
+        output.uuid = 'request'
+        storage = FileStorage()
+        (_, output_name, url) = storage.store(output)
+
+        stored = os.path.join(self.tmp_dir, 'outputs', 'request', output_name)
+        self.assertEqual(storage.strategy, 'link')
+        self.assertTrue(url.endswith('/request/output.txt'))
+        self.assertEqual(os.stat(stored).st_ino, os.stat(self.source).st_ino)
+
+    def test_copy(self):
+        target = os.path.join(self.tmp_dir, 'copy.txt')
+        link = os.link
+        try:
+            # as if the target was on different file system
+            del os.link
+            strategy = store_file(self.source, target)
+        finally:
+            os.link = link
+
+        self.assertIn(strategy, ('reflink', 'copy'))
+        self.assertNotEqual(os.stat(target).st_ino, os.stat(self.source).st_ino)
+        with open(target) as f:
+            self.assertEqual(f.read(), 'output')
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['copy.txt', 'output.txt'])
+
+    def test_quota(self):
+        get_free_space = storage.get_free_space
+        storage.get_free_space = lambda folder: 100
+        try:
+            quota = StorageQuota(self.tmp_dir)
+            quota.reserve('first', 60)
+            with self.assertRaises(NotEnoughStorage):
+                quota.reserve('second', 50)
+            quota.reserve('second', 40)
+            self.assertEqual(quota.get_reserved(), 100)
+
+            # written outputs are counted until the next refresh
+            quota.commit('first', 60)
+            quota.release('second')
+            self.assertEqual(quota.get_reserved(), 0)
+            with self.assertRaises(NotEnoughStorage):
+                quota.reserve('second', 50)
+        finally:
+            storage.get_free_space = get_free_space
+
+    def test_free_space(self):
+        stat = os.statvfs(self.tmp_dir)
+        free_space = storage.get_free_space(self.tmp_dir)
+        self.assertTrue(0 < free_space <= stat.f_blocks * stat.f_frsize)
+
+
 def load_tests(loader=None, tests=None, pattern=None):
     if not loader:
         loader = unittest.TestLoader()
@@ -392,6 +507,7 @@ def load_tests(loader=None, tests=None, pattern=None):
         loader.loadTestsFromTestCase(LiteralInputTest),
         loader.loadTestsFromTestCase(LiteralOutputTest),
         loader.loadTestsFromTestCase(BoxInputTest),
-        loader.loadTestsFromTestCase(BoxOutputTest)
+        loader.loadTestsFromTestCase(BoxOutputTest),
+        loader.loadTestsFromTestCase(FileStorageTest)
     ]
     return unittest.TestSuite(suite_list)
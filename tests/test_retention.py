@@ -0,0 +1,135 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+"""Unit tests for removal of expired outputs
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import uuid
+
+from pywps import configuration, dblog
+from pywps.app import WPSRequest, retention
+
+DAY = 86400
+
+
+class Response(object):
+    status = 200
+    message = 'Running'
+    status_percentage = 10
+
+
+class RetentionTest(unittest.TestCase):
+    """Retention test cases"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outputpath = configuration.get_config_value('server', 'outputpath')
+        self.workdir = configuration.get_config_value('server', 'workdir')
+        configuration.CONFIG.set('server', 'outputpath', os.path.join(self.tmpdir, 'outputs'))
+        configuration.CONFIG.set('server', 'workdir', os.path.join(self.tmpdir, 'work'))
+        os.mkdir(os.path.join(self.tmpdir, 'outputs'))
+        os.mkdir(os.path.join(self.tmpdir, 'work'))
+
+        self.old = str(uuid.uuid1())
+        self.older = str(uuid.uuid1())
+        self.new = str(uuid.uuid1())
+        self.running = str(uuid.uuid1())
+        self.create_output(self.old, 2 * DAY)
+        self.create_output(self.older, 3 * DAY)
+        self.create_output(self.new, 0)
+        self.create_output(self.running, 3 * DAY)
+        self.create_workdir('pywps_process_%s_abc' % self.old, 2 * DAY)
+        self.create_workdir('pywps_process_%s_abc' % self.running, 2 * DAY)
+        self.create_workdir('pywps_process_def', 0)
+        self.create_workdir('unrelated', 2 * DAY)
+        # inline input of killed request
+        input_file = os.path.join(self.tmpdir, 'work', 'pywps_input_ghi')
+        open(input_file, 'w').close()
+        os.utime(input_file, (time.time() - 2 * DAY, time.time() - 2 * DAY))
+
+        request = WPSRequest()
+        request.operation = 'execute'
+        request.version = '1.0.0'
+        dblog.log_request(self.running, request)
+        dblog.update_response(self.running, Response())
+
+    def tearDown(self):
+        response = Response()
+        response.status_percentage = 100
+        dblog.update_response(self.running, response)
+        configuration.CONFIG.set('server', 'outputpath', self.outputpath)
+        configuration.CONFIG.set('server', 'workdir', self.workdir)
+        configuration.CONFIG.set('server', 'outputretention', '0')
+        configuration.CONFIG.set('server', 'outputmaxsize', '0')
+        configuration.CONFIG.set('server', 'workdirretention', '0')
+        shutil.rmtree(self.tmpdir)
+
+    def create_output(self, request_uuid, age):
+        accessed = time.time() - age
+        output_dir = os.path.join(self.tmpdir, 'outputs', request_uuid)
+        os.mkdir(output_dir)
+        for file_name in (os.path.join(output_dir, 'output.txt'), output_dir + '.xml'):
+            with open(file_name, 'w') as f:
+                f.write('x' * 1000)
+            os.utime(file_name, (accessed, accessed))
+        os.utime(output_dir, (accessed, accessed))
+
+    def create_workdir(self, name, age):
+        accessed = time.time() - age
+        workdir = os.path.join(self.tmpdir, 'work', name)
+        os.mkdir(workdir)
+        os.utime(workdir, (accessed, accessed))
+
+    def get_outputs(self):
+        return sorted(os.listdir(os.path.join(self.tmpdir, 'outputs')))
+
+    def get_workdirs(self):
+        return sorted(os.listdir(os.path.join(self.tmpdir, 'work')))
+
+    def test_disabled(self):
+        self.assertEqual(retention.collect(), ([], 0))
+        self.assertEqual(len(self.get_outputs()), 8)
+
+    def test_age(self):
+        configuration.CONFIG.set('server', 'outputretention', '1')
+        configuration.CONFIG.set('server', 'workdirretention', '24')
+        (removed, freed) = retention.collect()
+
+        self.assertEqual(freed, 4000)
+        self.assertEqual(self.get_outputs(), sorted([self.new, self.new + '.xml',
+                                                     self.running, self.running + '.xml']))
+        self.assertEqual(self.get_workdirs(), sorted(['pywps_process_%s_abc' % self.running,
+                                                      'pywps_process_def', 'unrelated']))
+
+    def test_size(self):
+        configuration.CONFIG.set('server', 'outputmaxsize', '5kb')
+        (removed, freed) = retention.collect()
+
+        # only the least recently accessed output is removed
+        self.assertEqual(freed, 2000)
+        self.assertEqual(len(self.get_outputs()), 6)
+        self.assertNotIn(self.older, self.get_outputs())
+
+    def test_dry_run(self):
+        configuration.CONFIG.set('server', 'outputretention', '1')
+        (removed, freed) = retention.collect(dry_run=True)
+
+        self.assertEqual(len(removed), 4)
+        self.assertEqual(len(self.get_outputs()), 8)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(RetentionTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -0,0 +1,154 @@
+##################################################################
+# Copyright 2016 OSGeo Foundation,                               #
+# represented by PyWPS Project Steering Committee,               #
+# licensed under MIT, Please consult LICENSE.txt for details     #
+##################################################################
+
+import unittest
+import multiprocessing
+import os
+import shutil
+import socket
+import tempfile
+import time
+import uuid
+import lxml.etree
+from pywps import Service, Process, LiteralInput, LiteralOutput
+from pywps import configuration, dblog
+from pywps.app import WPSRequest, pool, scheduler
+from pywps.app.basic import xpath_ns
+from pywps.tests import client_for, assert_response_accepted
+
+
+def create_greeter():
+    def greeter(request, response):
+        response.outputs['message'].data = "Hello %s!" % request.inputs['name'][0].data
+        return response
+
+    return Process(handler=greeter,
+                   identifier='scheduler_greeter',
+                   title='Greeter',
+                   inputs=[LiteralInput('name', 'Input name', data_type='string')],
+                   outputs=[LiteralOutput('message', 'Output message', data_type='string')],
+                   store_supported=True,
+                   status_supported=True)
+
+
+def create_request(name):
+    request = WPSRequest()
+    request.operation = 'execute'
+    request.version = '1.0.0'
+    request.identifier = 'scheduler_greeter'
+    request.inputs = {'name': [LiteralInput('name', 'Input name', data_type='string')]}
+    request.inputs['name'][0].data = name
+    request.outputs = {}
+    request.raw = False
+    return request
+
+
+def wait_for_status(status_location, timeout=20):
+    """Wait for finished process and return its status document"""
+
+    start = time.time()
+    while True:
+        if os.path.isfile(status_location):
+            # status document is replaced atomically, it is never partial
+            with open(status_location, 'rb') as f:
+                doc = lxml.etree.fromstring(f.read())
+            if not xpath_ns(doc, '/wps:ExecuteResponse/wps:Status/wps:ProcessStarted') and \
+                    not xpath_ns(doc, '/wps:ExecuteResponse/wps:Status/wps:ProcessAccepted'):
+                return doc
+        if time.time() - start > timeout:
+            raise AssertionError('Process did not finish in %i seconds' % timeout)
+        time.sleep(0.1)
+
+
+def get_message(doc):
+    [message] = xpath_ns(doc, '//wps:Output[ows:Identifier="message"]/wps:Data/wps:LiteralData')
+    return message.text
+
+
+class SchedulerTest(unittest.TestCase):
+    """Scheduler tests, the queue is shared by more processes, so that
+    file database has to be used"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.database = configuration.get_config_value('logging', 'database')
+        self.session_maker = dblog._SESSION_MAKER
+        configuration.CONFIG.set('logging', 'database', 'sqlite:///%s' % os.path.join(self.tmpdir, 'pywps.db'))
+        dblog._SESSION_MAKER = None
+
+    def tearDown(self):
+        pool.close()
+        dblog.get_session().get_bind().dispose()
+        configuration.CONFIG.set('logging', 'database', self.database)
+        configuration.CONFIG.set('server', 'workerpool', 'false')
+        configuration.CONFIG.set('server', 'maxtasksperchild', '0')
+        configuration.CONFIG.set('server', 'parallelprocesses', '2')
+        dblog._SESSION_MAKER = self.session_maker
+        shutil.rmtree(self.tmpdir)
+
+    def execute(self, client, names):
+        status_locations = []
+        for name in names:
+            resp = client.get('?service=wps&version=1.0.0&request=execute&identifier=scheduler_greeter'
+                              '&datainputs=name=%s&storeExecuteResponse=true&status=true' % name)
+            assert_response_accepted(resp)
+            [status_location] = xpath_ns(resp.xml, '/wps:ExecuteResponse/@statusLocation')
+            status_locations.append(status_location.replace('file://', ''))
+
+        for (name, status_location) in zip(names, status_locations):
+            doc = wait_for_status(status_location)
+            assert xpath_ns(doc, '/wps:ExecuteResponse/wps:Status/wps:ProcessSucceeded')
+            assert get_message(doc) == 'Hello %s!' % name
+
+    def test_run_job(self):
+        process = create_greeter()
+        scheduler.register([process])
+
+        request_uuid = str(uuid.uuid1())
+        dblog.store_process(request_uuid, create_request('queue'))
+        scheduler.run_job((request_uuid, None, create_request('queue').json))
+
+        instance = process.new_instance()
+        instance._set_uuid(request_uuid)
+        doc = wait_for_status(instance.status_location, timeout=0)
+        assert xpath_ns(doc, '/wps:ExecuteResponse/wps:Status/wps:ProcessSucceeded')
+        assert get_message(doc) == 'Hello queue!'
+        assert len(dblog.get_stored()) == 0
+        assert not dblog.get_claimed()
+
+    def test_queue(self):
+        configuration.CONFIG.set('server', 'parallelprocesses', '1')
+        client = client_for(Service(processes=[create_greeter()]))
+        self.execute(client, ['first', 'second', 'third'])
+
+    def test_worker_pool(self):
+        configuration.CONFIG.set('server', 'workerpool', 'true')
+        configuration.CONFIG.set('server', 'maxtasksperchild', '1')
+        client = client_for(Service(processes=[create_greeter()]))
+        self.execute(client, ['first', 'second', 'third'])
+
+    def test_requeue_dead(self):
+        dead = multiprocessing.Process(target=time.sleep, args=(0,))
+        dead.start()
+        dead.join()
+
+        request_uuid = str(uuid.uuid1())
+        dblog.store_process(request_uuid, create_request('dead'))
+        dblog.claim_stored('%s:%s' % (socket.gethostname(), dead.pid), 60)
+        assert len(dblog.get_stored()) == 0
+
+        scheduler._requeue_dead()
+        assert len(dblog.get_stored()) == 1
+        dblog.remove_stored(request_uuid)
+
+
+def load_tests(loader=None, tests=None, pattern=None):
+    if not loader:
+        loader = unittest.TestLoader()
+    suite_list = [
+        loader.loadTestsFromTestCase(SchedulerTest),
+    ]
+    return unittest.TestSuite(suite_list)
@@ -5,8 +5,15 @@
 ##################################################################
 
 import unittest
+import base64
 import lxml.etree
+import os
+import shutil
+from werkzeug.test import EnvironBuilder
+from werkzeug.wrappers import Request
+from pywps import E, WPS, OWS, configuration, get_inputs_from_xml
 from pywps.app import WPSRequest
+from pywps.exceptions import InvalidParameterValue, NoApplicableCode
 import tempfile
 import datetime
 import json
@@ -115,10 +122,108 @@ class WPSRequestTest(unittest.TestCase):
         self.assertEqual(self.request.inputs['time'][0].data, datetime.time(9, 0, 0), 'Time set')
 
 
+class PostRequestTest(unittest.TestCase):
+    """Tests for parsing of POST requests"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = configuration.get_config_value('server', 'workdir')
+        configuration.CONFIG.set('server', 'workdir', self.tmpdir)
+        self.content = os.urandom(200000)
+        self.doc = WPS.Execute(
+            OWS.Identifier('foo'),
+            WPS.DataInputs(
+                WPS.Input(
+                    OWS.Identifier('name'),
+                    WPS.Data(WPS.LiteralData('bar', uom='m'))),
+                WPS.Input(
+                    OWS.Identifier('gml'),
+                    WPS.Data(WPS.ComplexData(
+                        ' ',
+                        E.FeatureCollection(
+                            lxml.etree.Comment(' features '),
+                            E.featureMember('a & b' * 10000, {'{http://www.w3.org/1999/xlink}href': '#a'}),
+                            xmlns='http://www.opengis.net/gml'),
+                        mimeType='application/gml+xml'))),
+                WPS.Input(
+                    OWS.Identifier('text'),
+                    WPS.Data(WPS.ComplexData('\n  a < b\n', mimeType='text/plain'))),
+                WPS.Input(
+                    OWS.Identifier('image'),
+                    WPS.Data(WPS.ComplexData(
+                        '\n'.join(base64.encodestring(self.content).decode('ascii').splitlines()),
+                        encoding='base64', mimeType='image/png'))),
+                WPS.Input(
+                    OWS.Identifier('empty'),
+                    WPS.Data(WPS.ComplexData(mimeType='text/plain'))),
+                WPS.Input(
+                    OWS.Identifier('reference'),
+                    WPS.Reference({'{http://www.w3.org/1999/xlink}href': 'http://example.org/data.gml'},
+                                  mimeType='application/gml+xml'))),
+            WPS.ResponseForm(WPS.RawDataOutput(OWS.Identifier('result'))),
+            version='1.0.0')
+
+    def tearDown(self):
+        configuration.CONFIG.set('server', 'workdir', self.workdir)
+        configuration.CONFIG.set('server', 'spoolinputs', 'true')
+        shutil.rmtree(self.tmpdir)
+
+    def post(self, data):
+        return WPSRequest(Request(EnvironBuilder(method='POST', data=data).get_environ()))
+
+    def test_inputs(self):
+        configuration.CONFIG.set('server', 'spoolinputs', 'false')
+        request = self.post(lxml.etree.tostring(self.doc))
+        self.assertEqual(request.inputs, get_inputs_from_xml(self.doc, decode_base64=False))
+        self.assertEqual(request.identifier, 'foo')
+        self.assertTrue(request.raw)
+        self.assertEqual(list(request.outputs), ['result'])
+
+    def test_spooled(self):
+        request = self.post(lxml.etree.tostring(self.doc))
+        inputs = get_inputs_from_xml(self.doc)
+        for identifier in ('gml', 'text', 'image'):
+            [inpt] = request.inputs[identifier]
+            self.assertEqual(os.path.dirname(inpt.pop('file')), self.tmpdir)
+            self.assertNotIn('data', inpt)
+            self.assertEqual(inpt, dict(inputs[identifier][0], data=inpt.get('data')))
+        for identifier in ('name', 'empty', 'reference'):
+            self.assertEqual(request.inputs[identifier], inputs[identifier])
+        self.assertEqual(len(request.spooled_files), 3)
+
+        [gml, text, image] = [open(file_name, 'rb').read() for file_name in request.spooled_files]
+        feature_collection = xpath_first(self.doc, '//gml:FeatureCollection')
+        self.assertEqual(lxml.etree.tostring(lxml.etree.fromstring(gml), method='c14n'),
+                         lxml.etree.tostring(feature_collection, method='c14n', with_tail=False))
+        self.assertEqual(text, b'\n  a < b\n')
+        self.assertEqual(image, self.content)
+
+        request.clean()
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_invalid_base64(self):
+        xpath_first(self.doc, '//wps:ComplexData[@encoding]').text = 'abc'
+        with self.assertRaises(InvalidParameterValue):
+            self.post(lxml.etree.tostring(self.doc))
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_invalid_xml(self):
+        data = lxml.etree.tostring(self.doc)
+        with self.assertRaises(NoApplicableCode):
+            self.post(data[:len(data) // 2])
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+
+def xpath_first(doc, path):
+    return doc.xpath(path, namespaces={'gml': 'http://www.opengis.net/gml',
+                                       'wps': 'http://www.opengis.net/wps/1.0.0'})[0]
+
+
 def load_tests(loader=None, tests=None, pattern=None):
     if not loader:
         loader = unittest.TestLoader()
     suite_list = [
-        loader.loadTestsFromTestCase(WPSRequestTest)
+        loader.loadTestsFromTestCase(WPSRequestTest),
+        loader.loadTestsFromTestCase(PostRequestTest)
     ]
     return unittest.TestSuite(suite_list)